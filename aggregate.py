@@ -0,0 +1,141 @@
+''' This script contains the global statistics of a corpus run: the pitch follower and rhythm counts of each midi file.
+
+The counts are kept per file, so that
+- a shard of a corpus run saves the counts of its files (partial aggregate, .npz) and the reduce
+  step (reduce.py) merges the partials of all shards into the global pitch quantity file and the
+  binary global model
+- a long-running process (watch mode) replaces the counts of one changed file by subtracting its
+  old counts from the totals and adding the new ones
+The totals and the global files don't depend on the order of the files or on the number of shards:
+the followers of a raw pitch are listed by pitch.
+'''
+
+import os
+import zlib
+import numpy as np
+from midi_util import Midi_Util, PitchFollower
+import md_format
+import note_events
+
+NUM_RAW_PITCHES = 12
+MAX_NOTES = 128
+
+def in_shard(path, shard, num_shards):
+    ''' Returns True if the file belongs to the shard (0 - num_shards-1). The shard of a file only depends on its (relative) path. '''
+    return zlib.crc32(path.replace(os.sep, '/').encode('utf-8')) % num_shards == shard
+
+def parse_shard(spec):
+    ''' Returns (shard, number of shards) of a "i/N" shard spec '''
+    shard, num_shards = (int(x) for x in spec.split('/'))
+    if not 0 <= shard < num_shards:
+        raise ValueError('Invalid shard "{}", expected i/N with 0 <= i < N'.format(spec))
+    return shard, num_shards
+
+def read_manifest(path):
+    ''' Returns the set of the midi file paths of a work manifest (one path per line, # starts a comment) '''
+    with open(path, "rt", encoding="utf-8") as f:
+        lines = [line.split('#')[0].strip() for line in f]
+    return set(os.path.normpath(line) for line in lines if line)
+
+class FileCounts:
+    ''' Pitch follower counts (raw pitch, follower pitch, quantity) and rhythm counts (rhythm, quantity) of one midi file '''
+
+    __slots__ = ('followers', 'rhythms', 'num_of_notes')
+
+    def __init__(self, followers, rhythms, num_of_notes):
+        self.followers = np.asarray(followers, dtype=np.int64).reshape(-1, 3)
+        self.rhythms = np.asarray(rhythms, dtype=np.int64).reshape(-1, 2)
+        self.num_of_notes = int(num_of_notes)
+
+    @classmethod
+    def from_util(cls, util):
+        ''' Returns the counts of the analysis of a Midi_Util (pitch_followers, note_rhythms and num_of_notes) '''
+        followers = [(raw_pitch, p.pitch, p.quantity) for raw_pitch in range(len(util.pitch_followers)) for p in util.pitch_followers[raw_pitch]]
+        rhythms = sorted(util.note_rhythms.items())
+        return cls(followers, rhythms, util.num_of_notes)
+
+class Aggregate:
+    ''' The counts of each file and their totals '''
+
+    def __init__(self):
+        self.files = {} # path -> FileCounts
+        self.follower_totals = np.zeros((NUM_RAW_PITCHES, MAX_NOTES), dtype=np.int64)
+        self.rhythm_totals = {} # rhythm -> quantity
+        self.num_of_notes = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def _apply(self, counts, sign):
+        np.add.at(self.follower_totals, (counts.followers[:, 0], counts.followers[:, 1]), sign * counts.followers[:, 2])
+        for rhythm, quantity in counts.rhythms.tolist():
+            self.rhythm_totals[rhythm] = self.rhythm_totals.get(rhythm, 0) + sign * quantity
+            if self.rhythm_totals[rhythm] == 0:
+                del self.rhythm_totals[rhythm]
+        self.num_of_notes += sign * counts.num_of_notes
+
+    def set_file(self, path, counts):
+        ''' Add the counts of a file, the old counts of the same file are subtracted first '''
+        self.remove_file(path)
+        self.files[path] = counts
+        self._apply(counts, +1)
+
+    def remove_file(self, path):
+        ''' Subtract the counts of a file (e.g. deleted or changed) '''
+        counts = self.files.pop(path, None)
+        if counts is not None:
+            self._apply(counts, -1)
+
+    def merge(self, other):
+        ''' Add the files of another (partial) aggregate, a file must not be part of both '''
+        for path in sorted(other.files):
+            if path in self.files:
+                raise ValueError('File "{}" is part of more than one partial aggregate'.format(path))
+            self.set_file(path, other.files[path])
+
+    def global_pitch_followers(self):
+        ''' Returns the global pitch followers (12 lists of PitchFollower, each sorted by pitch) '''
+        global_pitch_info = [[] for raw_pitch in range(NUM_RAW_PITCHES)]
+        for raw_pitch, pitch in zip(*np.nonzero(self.follower_totals)):
+            p = PitchFollower(int(pitch))
+            p.quantity = int(self.follower_totals[raw_pitch, pitch])
+            global_pitch_info[raw_pitch].append(p)
+        return global_pitch_info
+
+    def save_global_info(self, pitch_quantity_path):
+        ''' Write the global pitch quantity file '''
+        md_format.write_text(pitch_quantity_path, md_format.format_pitch_quantity(self.global_pitch_followers(), Midi_Util.RawPitchNames, Midi_Util.PitchNames, md_format.GLOBAL_PITCH_QUANTITY_HEADING))
+
+    def save_global_model(self, path, grid):
+        ''' Write the binary global model: the follower totals (12 x 128), the rhythm totals, the number of notes and files and the grid '''
+        rhythms = sorted(self.rhythm_totals)
+        np.savez(path, follower_counts=self.follower_totals,
+                 rhythms=np.array(rhythms, dtype=np.int64), rhythm_counts=np.array([self.rhythm_totals[r] for r in rhythms], dtype=np.int64),
+                 num_of_notes=self.num_of_notes, num_of_files=len(self.files),
+                 quantization=grid.quantization, triplets=grid.triplets)
+
+    def save(self, path, grid):
+        ''' Save the counts of each file (partial aggregate) as flat columns with the index of their file '''
+        paths = sorted(self.files)
+        counts = [self.files[p] for p in paths]
+        np.savez(path, paths=np.array(paths, dtype=str),
+                 follower_file=np.repeat(np.arange(len(paths)), [len(c.followers) for c in counts]),
+                 followers=np.vstack([c.followers for c in counts]) if counts else np.zeros((0, 3), dtype=np.int64),
+                 rhythm_file=np.repeat(np.arange(len(paths)), [len(c.rhythms) for c in counts]),
+                 rhythms=np.vstack([c.rhythms for c in counts]) if counts else np.zeros((0, 2), dtype=np.int64),
+                 num_of_notes=np.array([c.num_of_notes for c in counts], dtype=np.int64),
+                 quantization=grid.quantization, triplets=grid.triplets)
+
+    @classmethod
+    def load(cls, path):
+        ''' Load a partial aggregate written by save(). Returns the aggregate and its grid. '''
+        aggregate = cls()
+        with np.load(path) as data:
+            paths = data['paths'].tolist()
+            # The rows are sorted by file, split them at the first row of each file
+            followers = np.split(data['followers'], np.searchsorted(data['follower_file'], np.arange(1, len(paths))))
+            rhythms = np.split(data['rhythms'], np.searchsorted(data['rhythm_file'], np.arange(1, len(paths))))
+            for i, file_path in enumerate(paths):
+                aggregate.set_file(file_path, FileCounts(followers[i], rhythms[i], data['num_of_notes'][i]))
+            grid = note_events.Grid(int(data['quantization']), bool(data['triplets']))
+        return aggregate, grid
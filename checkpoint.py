@@ -0,0 +1,108 @@
+''' This script contains the failure bookkeeping of batch runs: the quarantine of bad input files and the checkpoint of an interrupted run.
+
+- Quarantine: the midi files that failed or were skipped, with the stage (read, convert, generate,
+  sweep) and the reason. It is written to diagnostics/quarantine.json.
+- Checkpoint: the finished midi files (with their modification time and size), the quarantine and
+  the partial global aggregate (see aggregate.py) of a run, written every n files and when the run
+  is interrupted. main.py --resume skips the finished files and the unchanged quarantined files
+  of the checkpoint, if the run has the same settings. A finished run removes its checkpoint.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import aggregate
+
+STATE_FILE = "state.json"
+AGGREGATE_FILE = "aggregate.npz"
+
+def describe(error):
+    ''' Returns the reason of an exception, e.g. "IndexError: list index out of range" '''
+    return type(error).__name__ + (": " + str(error) if str(error) else "")
+
+def fingerprint(settings):
+    ''' Returns the hash of the settings (dictionary) of a run, a checkpoint is only resumed with the same settings '''
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def file_state(path):
+    ''' Returns [modification time in ns, size] of a file, None if it doesn't exist '''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _write_json(path, data):
+    ''' Write the json file atomically, an interrupted write keeps the old file '''
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, "wt", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+    os.replace(temp_path, path)
+
+class Quarantine:
+    ''' The failed or skipped midi files: relative path -> {"stage", "reason", "state"} '''
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, path):
+        return path in self.files
+
+    def add(self, path, stage, reason, state=None):
+        self.files[path] = {"stage": stage, "reason": reason, "state": state}
+
+    def is_unchanged(self, path, state):
+        ''' Returns True if the file is quarantined and didn't change since '''
+        return path in self.files and self.files[path]["state"] == state
+
+    def save(self, path):
+        _write_json(path, {"files": self.files})
+
+class Checkpoint:
+    ''' The checkpoint directory of a run '''
+
+    def __init__(self, directory, settings):
+        self.directory = directory
+        self.fingerprint = fingerprint(settings)
+
+    def load(self):
+        ''' Returns the finished files {relative path: state}, the quarantine and the partial aggregate of the checkpoint,
+            None if there is no checkpoint of a run with the same settings '''
+        state_path = os.path.join(self.directory, STATE_FILE)
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path, "rt", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("fingerprint") != self.fingerprint:
+            return None
+        partial, grid = aggregate.Aggregate.load(os.path.join(self.directory, AGGREGATE_FILE))
+        return state["done"], Quarantine(state["quarantine"]), partial
+
+    def save(self, done, quarantine, counts, grid):
+        ''' Write the checkpoint: the aggregate first, then the state that refers to it '''
+        os.makedirs(self.directory, exist_ok=True)
+        aggregate_path = os.path.join(self.directory, AGGREGATE_FILE)
+        temp_path = aggregate_path + '.tmp.npz'
+        counts.save(temp_path, grid)
+        os.replace(temp_path, aggregate_path)
+        _write_json(os.path.join(self.directory, STATE_FILE), {"fingerprint": self.fingerprint, "done": done, "quarantine": quarantine.files})
+
+    def remove(self):
+        ''' Remove the checkpoint of a finished run '''
+        for name in (STATE_FILE, AGGREGATE_FILE):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        for directory in (self.directory, os.path.dirname(self.directory)): # the checkpoint directory of the run and checkpoint/ if it is empty
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
@@ -0,0 +1,88 @@
+''' This script contains the similarity index of the corpus for the nearest neighbour source selection.
+
+Each source is described by one fixed-length feature vector: its pitch class histogram, the
+histogram of the melodic intervals between consecutive notes and the histogram of its rhythms.
+The vectors of all sources are the unit length rows of one matrix, so the cosine similarities
+of a source to the whole corpus are one matrix product. The index keeps a copy of the note
+events of each source, so that a model can be blended from the neighbours without reading
+and analyzing their files again.
+'''
+
+import numpy as np
+import key_detection
+
+MAX_INTERVAL = 12 # melodic intervals are clipped to one octave up or down
+NUM_INTERVAL_BINS = 2 * MAX_INTERVAL + 1
+NUM_RHYTHM_BINS = 10 # log2 duration bins: 128th, 64th, 32th, 16th, 8th, 4th, half, whole, double, long
+NUM_FEATURES = 12 + NUM_INTERVAL_BINS + NUM_RHYTHM_BINS
+BLOCK_SIZE = 1024 # rows of the similarity matrix that are computed at once
+
+def _columns(events_list, column):
+    ''' Returns the source index and the concatenated values of a per-source column '''
+    values = [column(events) for events in events_list]
+    source_ids = np.repeat(np.arange(len(values)), [len(v) for v in values])
+    if len(source_ids) == 0:
+        return source_ids, np.zeros(0, dtype=np.int64)
+    return source_ids, np.concatenate(values)
+
+def interval_histograms(events_list):
+    ''' Returns the n x 25 matrix of the melodic interval histograms (-12 to +12 semitones). The last note is followed by the first one. '''
+    source_ids, intervals = _columns(events_list, lambda events: np.roll(events.pitches, -1) - events.pitches)
+    bins = np.clip(intervals, -MAX_INTERVAL, MAX_INTERVAL) + MAX_INTERVAL
+    return np.bincount(source_ids * NUM_INTERVAL_BINS + bins, minlength=len(events_list) * NUM_INTERVAL_BINS).reshape(len(events_list), NUM_INTERVAL_BINS)
+
+def rhythm_histograms(events_list):
+    ''' Returns the n x 10 matrix of the rhythm histograms. Rhythms are binned by their nearest power of 2 duration,
+        so sources on different grids are comparable. '''
+    source_ids, rhythms = _columns(events_list, lambda events: np.diff(events.steps) * 128 / events.grid.steps_per_whole) # in 128th notes
+    bins = np.clip(np.rint(np.log2(np.maximum(rhythms, 1))), 0, NUM_RHYTHM_BINS - 1).astype(np.int64)
+    return np.bincount(source_ids * NUM_RHYTHM_BINS + bins, minlength=len(events_list) * NUM_RHYTHM_BINS).reshape(len(events_list), NUM_RHYTHM_BINS)
+
+def _normalized(matrix, norm):
+    ''' Divide each row by its norm, rows with norm 0 stay 0 '''
+    norm = np.asarray(norm, dtype=np.float64).reshape(-1, 1)
+    return np.divide(matrix, norm, out=np.zeros(matrix.shape), where=norm > 0)
+
+def feature_matrix(events_list):
+    ''' Returns the n x NUM_FEATURES feature matrix with unit length rows. Each histogram is normalized to a sum of 1 first,
+        so that the three parts have the same weight. '''
+    parts = [key_detection.pitch_class_histograms(events_list), interval_histograms(events_list), rhythm_histograms(events_list)]
+    features = np.hstack([_normalized(part, part.sum(axis=1)) for part in parts])
+    return _normalized(features, np.linalg.norm(features, axis=1))
+
+class CorpusIndex:
+    ''' Feature matrix and note events of the sources of a corpus '''
+
+    def __init__(self, names, events_list):
+        self.names = list(names)
+        self.events = [events.copy() for events in events_list] # the caller may change its events (e.g. by the generation)
+        self.features = feature_matrix(self.events)
+
+    def __len__(self):
+        return len(self.names)
+
+    def similarities(self, i):
+        ''' Returns the cosine similarities of source i to all sources '''
+        return self.features @ self.features[i]
+
+    def _top_k(self, similarities, rows, k):
+        ''' Returns the k most similar columns of each row, most similar first. The source itself is excluded. '''
+        similarities[np.arange(len(rows)), rows] = -np.inf
+        k = min(k, len(self) - 1)
+        if k <= 0:
+            return np.zeros((len(rows), 0), dtype=np.int64)
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(top, order, axis=1)
+
+    def neighbours(self, i, k):
+        ''' Returns the indices of the k most similar sources of source i, most similar first '''
+        return self._top_k(self.similarities(i)[None, :], np.array([i]), k)[0]
+
+    def all_neighbours(self, k):
+        ''' Returns the n x k matrix of the k most similar sources of all sources. The similarity matrix is computed in blocks of rows. '''
+        result = []
+        for start in range(0, len(self), BLOCK_SIZE):
+            rows = np.arange(start, min(start + BLOCK_SIZE, len(self)))
+            result.append(self._top_k(self.features[rows] @ self.features.T, rows, k))
+        return np.vstack(result) if result else np.zeros((0, 0), dtype=np.int64)
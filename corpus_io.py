@@ -0,0 +1,156 @@
+''' This script contains the file I/O layer of the driver for large and remote (e.g. NFS) corpora.
+
+The blocking calls (directory listings, stat, mkdir, reading and writing files) are handed to a
+thread pool, so that their round-trips overlap with each other and with the analysis:
+- discover() lists the directories of the corpus concurrently
+- Directories creates each output directory once and remembers the existing ones
+- prefetch() reads the next files while the current one is analyzed
+- Writer saves the outputs in the background, a file can be waited for before it is read back
+'''
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+MAX_WORKERS = 8 # concurrent I/O requests
+
+def _scan(path):
+    ''' Returns the file names and the sub directory paths of a directory in listing order '''
+    files = []
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if not entry.is_symlink(): # like os.walk, symbolic links to directories are not followed
+                    dirs.append(entry.path)
+            else:
+                files.append(entry.name)
+    return files, dirs
+
+def discover(path, extension='mid', skip='archive', max_workers=MAX_WORKERS):
+    ''' Returns the (root, file) tuples of all files with the given extension below path, in the order of os.walk (top-down).
+        Directories whose path contains skip are not listed. The directories are listed concurrently. '''
+    listings = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {path: pool.submit(_scan, path)} if os.path.isdir(path) else {}
+        while pending:
+            root, future = pending.popitem()
+            try:
+                listings[root] = future.result()
+            except OSError: # unreadable directories are skipped like os.walk does
+                listings[root] = ([], [])
+            for sub_dir in listings[root][1]:
+                if skip and skip in sub_dir:
+                    continue
+                pending[sub_dir] = pool.submit(_scan, sub_dir)
+
+    found = []
+    stack = [path] if path in listings else []
+    while stack:
+        root = stack.pop()
+        files, dirs = listings[root]
+        if not (skip and skip in root):
+            found.extend((root, file) for file in files if file.split('.')[-1] == extension)
+        stack.extend(reversed([d for d in dirs if d in listings]))
+    return found
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+def snapshot(paths, max_workers=MAX_WORKERS):
+    ''' Returns {path: (modification time, size)} of the existing files of paths, the files are checked concurrently (polling, e.g. for a watch mode) '''
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return {path: state for path, state in zip(paths, pool.map(_stat, paths)) if state is not None}
+
+class Directories:
+    ''' Creates output directories once, the existing directories are cached '''
+
+    def __init__(self):
+        self.known = set()
+        self.lock = threading.Lock()
+
+    def ensure(self, path):
+        ''' Create the directory (and its parents) if it doesn't exist yet '''
+        if path in self.known:
+            return path
+        os.makedirs(path, exist_ok=True)
+        with self.lock:
+            self.known.add(path)
+        return path
+
+def prefetch(items, load, ahead=MAX_WORKERS, max_workers=MAX_WORKERS):
+    ''' Yields (item, result, error) for each item in order, load(item) runs in a thread pool up to ahead items in advance.
+        Exceptions of load are returned as error (result is None), so that the caller decides to skip the item. '''
+    items = iter(items)
+    queue = deque()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for item in items:
+            queue.append((item, pool.submit(load, item)))
+            if len(queue) >= ahead:
+                break
+        while queue:
+            item, future = queue.popleft()
+            next_item = next(items, None)
+            if next_item is not None:
+                queue.append((next_item, pool.submit(load, next_item)))
+            try:
+                result, error = future.result(), None
+            except Exception as e:
+                result, error = None, e
+            yield item, result, error
+
+class Writer:
+    ''' Writes files in a background thread pool. Use as context manager, leaving it waits for all writes. '''
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = {} # path -> futures of the writes of this path, in submit order
+
+    @staticmethod
+    def _after(previous, write, args):
+        if previous is not None:
+            wait([previous]) # the writes of a path don't overlap, the error of the previous write is raised by its own future
+        return write(*args)
+
+    def submit(self, path, write, *args):
+        ''' Call write(*args) in the background, e.g. submit(path, mid.save, path). A write starts after the previous write of the same path. '''
+        futures = self.pending.setdefault(path, [])
+        futures.append(self.pool.submit(self._after, futures[-1] if futures else None, write, args))
+
+    def wait(self, path):
+        ''' Wait until the writes of path are done (e.g. before the file is read back), the first error is raised '''
+        for future in self.pending.pop(path, []):
+            future.result()
+
+    def failure(self, paths):
+        ''' Wait until the writes of the paths are done, returns the first error (None if all writes succeeded) '''
+        error = None
+        for path in paths:
+            for future in self.pending.pop(path, []):
+                if error is None:
+                    error = future.exception()
+        return error
+
+    def flush(self):
+        ''' Wait for all writes that were submitted so far, the first error is raised '''
+        pending, self.pending = self.pending, {}
+        for futures in pending.values():
+            for future in futures:
+                future.result()
+
+    def close(self):
+        ''' Wait for all writes, the first error is raised '''
+        self.pool.shutdown(wait=True)
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
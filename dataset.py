@@ -0,0 +1,132 @@
+''' This script contains the columnar export of the generated variations as training dataset.
+
+A dataset directory contains
+- index.json: the columns, the shards, the sources (midi file and note count), the generation settings and the grid
+- shard-00000/, shard-00001/, ...: one .npy file per note column (step, pitch, velocity, variation_id, source_id, setting_id)
+  and per variation column (variation_id, source_id, setting_id, length, start, count), start/count select the notes
+  of a variation inside of its shard
+- sources/: the note columns (step, pitch, velocity, source_id) of the source midi files
+The .npy files are loaded with memory mapping, so opening a dataset doesn't read the notes.
+Pitches are array indices (midi note + 12) like in the note events.
+'''
+
+import os
+import json
+import numpy as np
+import note_events
+
+NOTE_COLUMNS = {"step": np.int32, "pitch": np.int16, "velocity": np.uint8, "variation_id": np.int32, "source_id": np.int32, "setting_id": np.int32}
+VARIATION_COLUMNS = {"variation_id": np.int32, "source_id": np.int32, "setting_id": np.int32, "length": np.int32, "start": np.int64, "count": np.int64}
+SOURCE_COLUMNS = {"step": np.int32, "pitch": np.int16, "velocity": np.uint8, "source_id": np.int32}
+SHARD_NOTES = 1 << 20 # notes per shard
+
+def _save_columns(out_dir, columns, dtypes):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, dtype in dtypes.items():
+        values = np.concatenate(columns[name]) if columns[name] else np.zeros(0)
+        np.save(os.path.join(out_dir, name + ".npy"), values.astype(dtype, copy=False))
+
+class DatasetWriter:
+    ''' Collects the variations in memory and writes a shard when it holds shard_notes notes '''
+
+    def __init__(self, path, grid, shard_notes=SHARD_NOTES):
+        self.path = path
+        self.grid = grid
+        self.shard_notes = shard_notes
+        self.sources = [] # {"file", "notes"} of each source id
+        self.settings = [] # generation parameters of each setting id
+        self.shards = [] # {"name", "notes", "variations", "first_variation"} of each written shard
+        self.source_columns = {name: [] for name in SOURCE_COLUMNS}
+        self.num_of_variations = 0
+        self._new_shard()
+
+    def _new_shard(self):
+        self.notes = {name: [] for name in NOTE_COLUMNS}
+        self.variations = {name: [] for name in VARIATION_COLUMNS}
+        self.shard_size = 0
+        self.shard_first_variation = self.num_of_variations
+
+    def add_source(self, file, events):
+        ''' Add a source midi file and its note events, returns its source id '''
+        source_id = len(self.sources)
+        self.sources.append({"file": file, "notes": len(events)})
+        for name, values in (("step", events.steps), ("pitch", events.pitches), ("velocity", events.velocities), ("source_id", np.full(len(events), source_id))):
+            self.source_columns[name].append(values)
+        return source_id
+
+    def add_setting(self, parameters):
+        ''' Add the generation parameters of a setting, returns its setting id '''
+        self.settings.append(parameters)
+        return len(self.settings) - 1
+
+    def add(self, events, source_id, setting_id):
+        ''' Add the note events of a variation, returns its variation id '''
+        variation_id = self.num_of_variations
+        n = len(events)
+        columns = (("step", events.steps), ("pitch", events.pitches), ("velocity", events.velocities),
+                   ("variation_id", np.full(n, variation_id)), ("source_id", np.full(n, source_id)), ("setting_id", np.full(n, setting_id)))
+        for name, values in columns:
+            self.notes[name].append(values)
+        for name, value in (("variation_id", variation_id), ("source_id", source_id), ("setting_id", setting_id),
+                            ("length", events.length), ("start", self.shard_size), ("count", n)):
+            self.variations[name].append(np.array([value]))
+        self.shard_size += n
+        self.num_of_variations += 1
+        if self.shard_size >= self.shard_notes:
+            self.flush()
+        return variation_id
+
+    def flush(self):
+        ''' Write the collected variations as a new shard '''
+        num_of_variations = self.num_of_variations - self.shard_first_variation
+        if num_of_variations == 0:
+            return
+        name = "shard-%05d" % len(self.shards)
+        _save_columns(os.path.join(self.path, name), self.notes, NOTE_COLUMNS)
+        _save_columns(os.path.join(self.path, name, "variations"), self.variations, VARIATION_COLUMNS)
+        self.shards.append({"name": name, "notes": self.shard_size, "variations": num_of_variations, "first_variation": self.shard_first_variation})
+        self._new_shard()
+
+    def close(self):
+        ''' Write the last shard, the source notes and the index '''
+        self.flush()
+        _save_columns(os.path.join(self.path, "sources"), self.source_columns, SOURCE_COLUMNS)
+        index = {"note_columns": list(NOTE_COLUMNS), "variation_columns": list(VARIATION_COLUMNS), "source_columns": list(SOURCE_COLUMNS),
+                 "shards": self.shards, "sources": self.sources, "settings": self.settings,
+                 "num_of_variations": self.num_of_variations, "quantization": self.grid.quantization, "triplets": self.grid.triplets}
+        with open(os.path.join(self.path, "index.json"), "wt", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+            f.write("\n")
+
+class Dataset:
+    ''' A dataset directory opened with memory mapped columns '''
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, "index.json"), "rt", encoding="utf-8") as f:
+            self.index = json.load(f)
+        self.grid = note_events.Grid(self.index["quantization"], self.index["triplets"])
+        self.sources = self.index["sources"]
+        self.settings = self.index["settings"]
+        load = lambda directory, name: np.load(os.path.join(path, directory, name + ".npy"), mmap_mode=mmap_mode)
+        self.shards = [{name: load(shard["name"], name) for name in self.index["note_columns"]} for shard in self.index["shards"]]
+        self.shard_variations = [{name: load(os.path.join(shard["name"], "variations"), name) for name in self.index["variation_columns"]} for shard in self.index["shards"]]
+        self.source_notes = {name: load("sources", name) for name in self.index["source_columns"]}
+        self._first_variations = np.array([shard["first_variation"] for shard in self.index["shards"]], dtype=np.int64)
+
+    def __len__(self):
+        return self.index["num_of_variations"]
+
+    def variation(self, variation_id):
+        ''' Returns the note events of a variation (the columns are views of the memory mapped shard) and its source and setting id '''
+        shard = int(np.searchsorted(self._first_variations, variation_id, side='right')) - 1
+        if not 0 <= variation_id < len(self) or shard < 0:
+            raise IndexError(variation_id)
+        row = variation_id - self.index["shards"][shard]["first_variation"]
+        variations = self.shard_variations[shard]
+        start, count = int(variations["start"][row]), int(variations["count"][row])
+        notes = self.shards[shard]
+        events = note_events.NoteEvents.__new__(note_events.NoteEvents) # keep the views, the constructor would convert them
+        events.steps, events.pitches, events.velocities = notes["step"][start:start+count], notes["pitch"][start:start+count], notes["velocity"][start:start+count]
+        events.length, events.grid = int(variations["length"][row]), self.grid
+        return events, int(variations["source_id"][row]), int(variations["setting_id"][row])
@@ -0,0 +1,98 @@
+''' This script contains the near-duplicate detection of the sources: MinHash signatures of their interval and rhythm n-grams.
+
+A source is described by its cyclic sequence of (melodic interval, rhythm) tokens, one per note:
+the interval to the next note and the distance to the next note in 384th notes (the last note is
+followed by the first one). The tokens don't change when a riff is transposed, shifted in time or
+rotated in its loop, and sources on different grids are comparable.
+
+The set of the n-grams of the tokens (shingles) of each source is hashed with a rolling polynomial
+hash, its MinHash signature estimates the Jaccard similarity of two sets: the fraction of equal
+signature values. The signatures are split into bands (locality sensitive hashing), only the
+sources with an equal band are compared, so the detection doesn't compare all pairs of the corpus.
+Sources with a similarity >= threshold are joined into clusters, the first source of a cluster
+(in corpus order) is its representative. A source can join a cluster through another member, its
+reported similarity is the one to that member (a representative can be less similar).
+'''
+
+import numpy as np
+
+NGRAM = 3 # tokens per shingle
+NUM_HASHES = 60 # length of the MinHash signature
+ROWS = 3 # signature values per band, NUM_HASHES / ROWS bands
+THRESHOLD = 0.6 # minimum estimated Jaccard similarity of near-duplicates
+RHYTHM_UNIT = 384 # rhythms in 384th notes, fits both straight and triplet grids
+MAX_RHYTHM = 4095
+_PRIME = np.uint64(1099511628211) # multiplier of the rolling hash
+_SEEDS = np.random.default_rng(0x6d696469).integers(0, 2**63, size=NUM_HASHES, dtype=np.uint64)
+
+def _mix(x):
+    ''' splitmix64 finalizer, a bijective scrambling of uint64 values '''
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+def tokens(events):
+    ''' Returns the (interval, rhythm) token of each note as one integer '''
+    intervals = np.clip(np.roll(events.pitches, -1) - events.pitches, -127, 127) + 128
+    rhythms = np.diff(np.append(events.steps, events.steps[:1] + events.length)) if len(events) > 0 else np.zeros(0, dtype=np.int64)
+    rhythms = np.clip(np.rint(rhythms * RHYTHM_UNIT / events.grid.steps_per_whole), 0, MAX_RHYTHM).astype(np.int64)
+    return (intervals * (MAX_RHYTHM + 1) + rhythms).astype(np.uint64)
+
+def shingles(events, n=NGRAM):
+    ''' Returns the unique rolling hashes of the cyclic n-grams of the tokens '''
+    values = tokens(events)
+    if len(values) == 0:
+        return values
+    extended = np.concatenate([values] * (1 + (n - 1) // len(values) + 1))[:len(values) + n - 1]
+    hashes = np.zeros(len(values), dtype=np.uint64)
+    with np.errstate(over='ignore'): # the hash is computed modulo 2^64
+        for j in range(n):
+            hashes = hashes * _PRIME + _mix(extended[j:j + len(values)])
+    return np.unique(hashes)
+
+def signature(events):
+    ''' Returns the MinHash signature (NUM_HASHES uint64 values) of the source, None if it has no notes '''
+    values = shingles(events)
+    if len(values) == 0:
+        return None
+    with np.errstate(over='ignore'):
+        return _mix(values[None, :] ^ _SEEDS[:, None]).min(axis=1)
+
+def similarity(a, b):
+    ''' Returns the estimated Jaccard similarity of two signatures '''
+    return float(np.mean(a == b))
+
+def find_clusters(events_list, threshold=THRESHOLD):
+    ''' Returns the clusters of near-duplicates (lists of at least 2 source indices, the representative first)
+        and the (index, similarity) of the member each source joined its cluster through '''
+    signatures = [signature(events) for events in events_list]
+    parent = list(range(len(events_list)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # Candidate pairs: sources with an equal band of the signature
+    compared, links = set(), {}
+    for band in range(NUM_HASHES // ROWS):
+        buckets = {}
+        for i, values in enumerate(signatures):
+            if values is not None:
+                buckets.setdefault(values[band * ROWS:(band + 1) * ROWS].tobytes(), []).append(i)
+        for members in buckets.values():
+            for k, j in enumerate(members):
+                for i in members[:k]:
+                    if find(i) != find(j) and (i, j) not in compared:
+                        compared.add((i, j))
+                        value = similarity(signatures[i], signatures[j])
+                        if value >= threshold:
+                            links.setdefault(i, (j, value))
+                            links.setdefault(j, (i, value))
+                            a, b = find(i), find(j)
+                            parent[max(a, b)] = min(a, b) # the earliest source is the root
+    clusters = {}
+    for i in range(len(events_list)):
+        clusters.setdefault(find(i), []).append(i)
+    clusters = [members for root, members in sorted(clusters.items()) if len(members) > 1]
+    return clusters, links
@@ -0,0 +1,67 @@
+''' This script contains the diagnostics helpers: leveled, lazily formatted logging and the per-file run summary. '''
+
+import json
+import os
+import sys
+
+# Log levels, a message is emitted when its level is <= the current level
+QUIET = 0
+WARNING = 1
+INFO = 2
+DEBUG = 3
+
+LEVELS = {'quiet': QUIET, 'warning': WARNING, 'info': INFO, 'debug': DEBUG}
+
+class Diagnostics:
+
+    def __init__(self, level=INFO, stream=None):
+        self.stream = stream # None = sys.stdout at the time of writing
+        self.set_level(level)
+
+    def set_level(self, level):
+        ''' Set the log level by number or by name (quiet, warning, info, debug) '''
+        if isinstance(level, str):
+            level = LEVELS[level.lower()]
+        self.level = level
+        # Flags for cheap checks in the hot loops (no call, no formatting)
+        self.warning_enabled = level >= WARNING
+        self.info_enabled = level >= INFO
+        self.debug_enabled = level >= DEBUG
+
+    def log(self, level, msg="", *args):
+        ''' Write a message if the level is enabled. The message is only formatted (msg % args) when it is written. '''
+        if level > self.level:
+            return
+        if args:
+            msg = msg % args
+        print (msg, file=self.stream or sys.stdout)
+
+    def warning(self, msg="", *args):
+        if self.warning_enabled:
+            self.log(WARNING, msg, *args)
+
+    def info(self, msg="", *args):
+        if self.info_enabled:
+            self.log(INFO, msg, *args)
+
+    def debug(self, msg="", *args):
+        if self.debug_enabled:
+            self.log(DEBUG, msg, *args)
+
+    def error(self, msg="", *args):
+        ''' Errors are always written (to stderr), even at quiet level '''
+        if args:
+            msg = msg % args
+        print (msg, file=sys.stderr)
+
+# Shared instance, the level is set once by the driver (e.g. main.py --log-level)
+log = Diagnostics()
+
+def write_summary(path, summary):
+    ''' Write a per-file run summary (note count, rhythm histogram, follower table, settings) as .json file '''
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True) # summaries may be written concurrently
+    with open(path, "wt", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+        f.write("\n")
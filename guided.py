@@ -0,0 +1,185 @@
+''' This script contains the guided generation: a simulated annealing search from the source towards a target within a time budget.
+
+The search edits one note at a time: it changes the pitch of a note to a follower of the previous
+note (from the model, moved into the note range by octaves) or mutes/unmutes a note. The state keeps the aggregates of the target terms
+(interval counts, number of notes, notes out of range, notes that differ from the source) and each
+edit updates them in O(1), so the cost of a candidate is computed without evaluating the variation again.
+
+Target terms (each between 0 and about 1, lower is better):
+- interval: total variation distance of the melodic interval histogram to the target distribution
+- density: relative difference of the notes per whole note to the target density
+- range: fraction of the notes outside of note min and note max
+- distance: difference of the fraction of changed (or muted) notes to the target fraction
+'''
+
+import math
+import time
+import numpy as np
+import corpus_index
+import note_events
+from riff_model import RiffGenerator, pitch_to_min_max
+
+WEIGHTS = {"interval": 1.0, "density": 1.0, "range": 1.0, "distance": 1.0}
+TEMPERATURE = 0.05 # start temperature of the annealing, it falls linearly to 0 at the end of the budget
+MUTE_PROBABILITY = 0.2 # probability of a mute/unmute edit instead of a pitch edit
+CHECK_INTERVAL = 32 # proposed edits between two checks of the clock
+
+class Target:
+    ''' Target of the guided search: interval distribution (25 bins, -12 to +12 semitones), notes per whole note,
+        note range and fraction of the notes that differ from the source '''
+
+    def __init__(self, intervals, density, note_min=0, note_max=127, distance=0.5, weights=None):
+        intervals = np.asarray(intervals, dtype=np.float64)
+        self.intervals = (intervals / intervals.sum() if intervals.sum() > 0 else intervals).tolist()
+        self.density = float(density)
+        self.note_min = int(note_min)
+        self.note_max = int(note_max)
+        self.distance = float(distance)
+        self.weights = dict(WEIGHTS, **(weights or {}))
+
+    @classmethod
+    def from_source(cls, events, note_min=0, note_max=127, density=None, distance=0.5, weights=None):
+        ''' Returns the target with the interval distribution of the source and its density (if not given) '''
+        if density is None:
+            density = len(events) * events.grid.steps_per_whole / max(events.length, 1)
+        return cls(corpus_index.interval_histograms([events])[0], density, note_min, note_max, distance, weights)
+
+class _State:
+    ''' Pitches, muted notes and the aggregates of the target terms. The active notes are a circular linked list. '''
+
+    def __init__(self, events, target):
+        self.target = target
+        self.source = events.pitches.tolist()
+        self.pitches = list(self.source)
+        self.active = [True] * len(self.source)
+        n = len(self.source)
+        self.prev = [(i - 1) % n for i in range(n)]
+        self.next = [(i + 1) % n for i in range(n)]
+        self.counts = [0] * corpus_index.NUM_INTERVAL_BINS
+        for i in range(n):
+            self.counts[self._bin(i, self.next[i])] += 1
+        self.num_active = n
+        self.out_of_range = sum(1 for p in self.pitches if not target.note_min <= p <= target.note_max)
+        self.changed = 0
+        self.density_factor = events.grid.steps_per_whole / max(events.length, 1)
+
+    def _bin(self, i, j):
+        return min(max(self.pitches[j] - self.pitches[i], -corpus_index.MAX_INTERVAL), corpus_index.MAX_INTERVAL) + corpus_index.MAX_INTERVAL
+
+    def _in_range(self, pitch):
+        return self.target.note_min <= pitch <= self.target.note_max
+
+    def _is_changed(self, i):
+        return not self.active[i] or self.pitches[i] != self.source[i]
+
+    def terms(self):
+        ''' Returns the target terms of the current state '''
+        target, total = self.target, self.num_active
+        interval = 0.5 * sum(abs(c / total - t) for c, t in zip(self.counts, target.intervals))
+        density = abs(total * self.density_factor - target.density) / target.density if target.density > 0 else 0.0
+        return {"interval": interval, "density": density, "range": self.out_of_range / total,
+                "distance": abs(self.changed / len(self.source) - target.distance)}
+
+    def cost(self):
+        weights = self.target.weights
+        return sum(weights[name] * value for name, value in self.terms().items())
+
+    def set_pitch(self, i, pitch):
+        ''' Change the pitch of an active note, only the intervals to its neighbours change '''
+        p, q = self.prev[i], self.next[i]
+        was_changed = self._is_changed(i)
+        self.counts[self._bin(p, i)] -= 1
+        self.counts[self._bin(i, q)] -= 1
+        self.out_of_range -= not self._in_range(self.pitches[i])
+        self.pitches[i] = pitch
+        self.counts[self._bin(p, i)] += 1
+        self.counts[self._bin(i, q)] += 1
+        self.out_of_range += not self._in_range(pitch)
+        self.changed += self._is_changed(i) - was_changed
+
+    def toggle(self, i):
+        ''' Mute an active note or unmute a muted one. A muted note keeps its place, its neighbours are linked directly. '''
+        p, q = self.prev[i], self.next[i]
+        was_changed = self._is_changed(i)
+        if self.active[i]:
+            self.counts[self._bin(p, i)] -= 1
+            self.counts[self._bin(i, q)] -= 1
+            self.counts[self._bin(p, q)] += 1
+            self.next[p], self.prev[q] = q, p
+            self.out_of_range -= not self._in_range(self.pitches[i])
+            self.num_active -= 1
+        else:
+            self.counts[self._bin(p, q)] -= 1
+            self.counts[self._bin(p, i)] += 1
+            self.counts[self._bin(i, q)] += 1
+            self.next[p], self.prev[q] = i, i
+            self.out_of_range += not self._in_range(self.pitches[i])
+            self.num_active += 1
+        self.active[i] = not self.active[i]
+        self.changed += self._is_changed(i) - was_changed
+
+    def unmute_links(self, i):
+        ''' Link a muted note between the nearest active notes before and after it '''
+        n = len(self.source)
+        p = (i - 1) % n
+        while not self.active[p]:
+            p = (p - 1) % n
+        self.prev[i], self.next[i] = p, self.next[p]
+
+def search(events, model, rng, target, budget, locked=None, max_steps=None):
+    ''' Anneal the source towards the target for budget seconds (or max_steps proposed edits), locked notes are not edited.
+        Returns the best variation and its target terms (including the weighted "cost"). '''
+    generator = RiffGenerator(model, rng)
+    n = len(events)
+    if n < 2:
+        return events.copy(), {"cost": 0.0, "steps": 0}
+    state = _State(events, target)
+    editable = [i for i in range(n) if locked is None or not locked[i]]
+    cost = state.cost()
+    best_cost, best = cost, (list(state.pitches), list(state.active), state.terms())
+    start = time.perf_counter()
+    progress, steps = 0.0, 0
+    while editable and progress < 1.0:
+        steps += 1
+        if max_steps is not None:
+            progress = steps / max_steps
+        elif steps % CHECK_INTERVAL == 0:
+            progress = (time.perf_counter() - start) / budget if budget > 0 else 1.0
+        i = editable[rng.randint(0, len(editable) - 1)]
+        if rng.random() < MUTE_PROBABILITY:
+            if state.active[i] and state.num_active <= 2:
+                continue
+            if not state.active[i]:
+                state.unmute_links(i)
+            state.toggle(i)
+            undo = (state.toggle, i)
+        elif state.active[i]:
+            pitch = generator.random_follower(state.pitches[state.prev[i]], True)
+            if pitch is None:
+                pitch = state.pitches[i] + rng.randint(-corpus_index.MAX_INTERVAL, corpus_index.MAX_INTERVAL)
+            pitch = pitch_to_min_max(min(max(pitch, 0), 127), target.note_min, target.note_max)
+            if pitch == state.pitches[i]:
+                continue
+            undo = (state.set_pitch, i, state.pitches[i])
+            state.set_pitch(i, pitch)
+        else:
+            continue
+        new_cost = state.cost()
+        temperature = TEMPERATURE * (1.0 - progress)
+        if new_cost > cost and (temperature <= 0 or rng.random() >= math.exp((cost - new_cost) / temperature)):
+            undo[0](*undo[1:]) # reject
+            continue
+        cost = new_cost
+        if cost < best_cost:
+            best_cost, best = cost, (list(state.pitches), list(state.active), state.terms())
+
+    pitches, active, terms = best
+    active = np.array(active, dtype=bool)
+    variation = note_events.NoteEvents(events.steps[active], np.array(pitches, dtype=np.int64)[active], events.velocities[active], events.length, events.grid)
+    terms["cost"] = best_cost
+    terms["steps"] = steps
+    return variation, terms
+
+def generate(events, model, rng, target, amount, budget, locked=None):
+    ''' Returns amount variations (and their terms) of the source, the time budget (seconds) is shared equally by the variations '''
+    return [search(events, model, rng, target, budget / max(amount, 1), locked) for i in range(amount)]
@@ -0,0 +1,281 @@
+''' This script contains the sequential per-note kernels of the generation: the pitch follower chain, the rhythm walk and the follower counting.
+
+The kernels are plain loops over the model tables. The backend is chosen at import time:
+- numba: the kernels are compiled with numba.njit when numba is installed, the tables are numpy arrays
+- python: the same functions run in the interpreter (fallback, or forced with MIDI_RANDOMIZER_KERNELS=python)
+  on lists (see as_input), indexing a list is much faster than indexing a numpy array in the
+  interpreter, and the searches of the helpers use bisect
+The kernels don't draw random numbers themselves, they read them from a sequence of uniform draws
+(two for each note or rhythm step), so both backends return the same results for the same draws.
+The rhythm walk can be continued with more draws, so the caller draws for the notes and not for
+every step of the loop. python kernels.py checks both backends against each other.
+'''
+
+import os
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+try:
+    if os.environ.get("MIDI_RANDOMIZER_KERNELS", "").lower() == "python":
+        raise ImportError("python kernels forced")
+    import numba
+    BACKEND = "numba"
+    _jit = numba.njit(cache=True)
+except ImportError:
+    BACKEND = "python"
+    _jit = lambda function: function
+
+NUM_RAW_PITCHES = 12
+MAX_NOTES = 128
+
+def _py_row_choice(values, cumulative, start, end, u):
+    ''' Weighted choice inside of a CSR row with the uniform draw u, -1 for an empty row '''
+    if end <= start or cumulative[end-1] <= 0:
+        return -1
+    r = int(u * cumulative[end-1])
+    for j in range(start, end):
+        if cumulative[j] > r:
+            return values[j]
+    return values[end-1]
+
+def _list_row_choice(values, cumulative, start, end, u):
+    ''' _py_row_choice of the python backend (lists) '''
+    if end <= start or cumulative[end-1] <= 0:
+        return -1
+    j = bisect_right(cumulative, int(u * cumulative[end-1]), start, end)
+    return values[j] if j < end else values[end-1]
+
+def _py_find(keys, key):
+    ''' Returns the index of the key in the sorted keys, -1 if it is missing '''
+    lo, hi = 0, len(keys)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if keys[mid] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo < len(keys) and keys[lo] == key:
+        return lo
+    return -1
+
+def _list_find(keys, key):
+    ''' _py_find of the python backend (lists) '''
+    i = bisect_left(keys, key)
+    return i if i < len(keys) and keys[i] == key else -1
+
+def _py_follower_counts(pitches):
+    ''' Returns the follower counts (12 x 128) and the index of the first note of each (raw pitch, follower) pair.
+        The last note is followed by the first one. '''
+    n = len(pitches)
+    counts = np.zeros((NUM_RAW_PITCHES, MAX_NOTES), dtype=np.int64)
+    first = np.full((NUM_RAW_PITCHES, MAX_NOTES), n, dtype=np.int64)
+    for i in range(n):
+        raw_pitch, follower = pitches[i] % NUM_RAW_PITCHES, pitches[(i+1) % n]
+        if counts[raw_pitch, follower] == 0:
+            first[raw_pitch, follower] = i
+        counts[raw_pitch, follower] += 1
+    return counts, first
+
+def _py_pitch_followers(pitches, velocities, locked, algorithm, follower_offsets, follower_pitches, follower_cumulative, cmajor, draws):
+    ''' Randomize the pitches (see RiffGenerator.random_pitch_followers) in place, note i uses the draws 2*i and 2*i+1 '''
+    for i in range(len(pitches)):
+        if locked[i] or pitches[i] <= 0:
+            continue
+        u, v = draws[2*i], draws[2*i+1]
+        raw_pitch = pitches[i] % NUM_RAW_PITCHES
+        start, end = follower_offsets[raw_pitch], follower_offsets[raw_pitch+1]
+        pitch = -1
+        if algorithm <= 1:
+            if u <= algorithm and end > start:
+                pitch = follower_pitches[start + int(v * (end - start))]
+        elif algorithm <= 2:
+            if u > algorithm - 1:
+                if end > start:
+                    pitch = follower_pitches[start + int(v * (end - start))]
+            else:
+                pitch = cmajor[int(v * len(cmajor))]
+        else:
+            if u < algorithm - 2:
+                pitch = _row_choice(follower_pitches, follower_cumulative, start, end, v)
+            else:
+                pitch = cmajor[int(v * len(cmajor))]
+        if pitch >= 0: # a pitch without followers is kept
+            pitches[i] = pitch
+            velocities[i] = 100
+
+def _py_rhythm_walk(length, algorithm, rhythm_values, rhythm_cumulative,
+                    row_steps, row_offsets, row_rhythms, row_cumulative,
+                    transition_prev, transition_offsets, transition_rhythms, transition_cumulative,
+                    locked_steps, draws, step, seq_counter, last_rhythm):
+    ''' Walk through the loop with random rhythms (see RiffGenerator.random_rhythm_intervals) from the step, the index in the pitch
+        sequence and the last rhythm of the walk so far (0, 0, 0 at the start, the note at step 0 is set by the caller).
+        Rhythm step k uses the draws 2*k and 2*k+1. Returns the number of notes, their steps, their index in the pitch sequence,
+        the state of the walk and True if it is finished (False: the draws are used up, continue with the state and new draws). '''
+    out_steps = np.zeros(len(draws) // 2, dtype=np.int64)
+    out_sequence = np.zeros(len(draws) // 2, dtype=np.int64)
+    num_rhythms = len(rhythm_cumulative)
+    count, k = 0, 0
+    while step < length:
+        if 2*k + 1 >= len(draws):
+            return count, out_steps, out_sequence, step, seq_counter, last_rhythm, False
+        u, v = draws[2*k], draws[2*k+1]
+        k += 1
+        if algorithm <= 1:
+            random_rhythm = _row_choice(rhythm_values, rhythm_cumulative, 0, num_rhythms, u)
+        else:
+            random_rhythm = -1
+            if algorithm <= 2 or last_rhythm == 0:
+                row = _find(row_steps, step)
+                if row >= 0:
+                    random_rhythm = _row_choice(row_rhythms, row_cumulative, row_offsets[row], row_offsets[row+1], u)
+            else:
+                row = _find(transition_prev, last_rhythm)
+                if row >= 0:
+                    random_rhythm = _row_choice(transition_rhythms, transition_cumulative, transition_offsets[row], transition_offsets[row+1], u)
+            if random_rhythm <= 0: # fill unknown rhythms with random rhythms
+                random_rhythm = _row_choice(rhythm_values, rhythm_cumulative, 0, num_rhythms, v)
+        if random_rhythm <= 0:
+            break
+        last_rhythm = random_rhythm
+        step = step + random_rhythm
+        seq_counter += 1
+        if step >= length:
+            break
+        if _find(locked_steps, step) >= 0:
+            continue
+        out_steps[count] = step
+        out_sequence[count] = seq_counter
+        count += 1
+    return count, out_steps, out_sequence, step, seq_counter, last_rhythm, True
+
+def _list_rhythm_walk(length, algorithm, rhythm_values, rhythm_cumulative,
+                      row_steps, row_offsets, row_rhythms, row_cumulative,
+                      transition_prev, transition_offsets, transition_rhythms, transition_cumulative,
+                      locked_steps, draws, step, seq_counter, last_rhythm):
+    ''' _py_rhythm_walk of the python backend (lists): the searches are inlined, the steps and indices are returned as lists '''
+    out_steps, out_sequence = [], []
+    num_rhythms, num_rows, num_transitions, num_locked = len(rhythm_cumulative), len(row_steps), len(transition_prev), len(locked_steps)
+    total = rhythm_cumulative[-1] if num_rhythms > 0 else 0
+    for k in range(0, len(draws) - 1, 2):
+        if step >= length:
+            break
+        u, v = draws[k], draws[k+1]
+        random_rhythm = -1
+        if algorithm > 1:
+            if algorithm <= 2 or last_rhythm == 0:
+                keys, key, num, offsets, values, cumulative = row_steps, step, num_rows, row_offsets, row_rhythms, row_cumulative
+            else:
+                keys, key, num, offsets, values, cumulative = transition_prev, last_rhythm, num_transitions, transition_offsets, transition_rhythms, transition_cumulative
+            row = bisect_left(keys, key)
+            if row < num and keys[row] == key:
+                start, end = offsets[row], offsets[row+1]
+                if end > start and cumulative[end-1] > 0:
+                    j = bisect_right(cumulative, int(u * cumulative[end-1]), start, end)
+                    random_rhythm = values[j] if j < end else values[end-1]
+            u = v # fill unknown rhythms with random rhythms
+        if random_rhythm <= 0 and total > 0:
+            j = bisect_right(rhythm_cumulative, int(u * total), 0, num_rhythms)
+            random_rhythm = rhythm_values[j] if j < num_rhythms else rhythm_values[num_rhythms-1]
+        if random_rhythm <= 0:
+            return len(out_steps), out_steps, out_sequence, step, seq_counter, last_rhythm, True
+        last_rhythm = random_rhythm
+        step = step + random_rhythm
+        seq_counter += 1
+        if step >= length:
+            break
+        i = bisect_left(locked_steps, step)
+        if i < num_locked and locked_steps[i] == step:
+            continue
+        out_steps.append(step)
+        out_sequence.append(seq_counter)
+    else:
+        if step < length:
+            return len(out_steps), out_steps, out_sequence, step, seq_counter, last_rhythm, False
+    return len(out_steps), out_steps, out_sequence, step, seq_counter, last_rhythm, True
+
+# The helpers are compiled first, the kernels call the compiled versions (the bisect versions in the python backend)
+_row_choice = _jit(_py_row_choice) if BACKEND == "numba" else _list_row_choice
+_find = _jit(_py_find) if BACKEND == "numba" else _list_find
+follower_counts = _jit(_py_follower_counts)
+pitch_followers = _jit(_py_pitch_followers)
+rhythm_walk = _jit(_py_rhythm_walk) if BACKEND == "numba" else _list_rhythm_walk
+
+def as_input(values):
+    ''' Returns a table (numpy array) or the draws (list) in the input format of the kernels of the backend '''
+    if BACKEND == "numba":
+        return np.asarray(values)
+    return values.tolist() if isinstance(values, np.ndarray) else values
+
+def as_list(values):
+    ''' Returns an output of a kernel (numpy array or list) as list '''
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+def random_inputs(rng):
+    ''' Returns random inputs of the kernels (numpy arrays, see self_check): the pitches, the locked notes, the pitch follower tables,
+        the C major pitches, the loop length, the algorithm, the rhythm tables of rhythm_walk and the draws '''
+    n = int(rng.integers(2, 64))
+    offsets = np.concatenate(([0], np.cumsum(rng.integers(0, 4, NUM_RAW_PITCHES))))
+    length = int(rng.integers(16, 256))
+    rhythm_values = np.unique(rng.integers(1, 17, 4))
+    row_steps = np.unique(rng.integers(0, length, 8))
+    row_offsets = np.arange(len(row_steps) + 1)
+    row_rhythms = rng.integers(1, 17, len(row_steps))
+    row_cumulative = np.ones(len(row_steps), dtype=np.int64)
+    return {"pitches": rng.integers(24, 100, n), "locked": rng.random(n) < 0.1,
+            "follower_offsets": offsets, "follower_pitches": rng.integers(24, 100, offsets[-1]),
+            "follower_cumulative": np.concatenate([np.cumsum(rng.integers(1, 5, offsets[r+1] - offsets[r])) for r in range(NUM_RAW_PITCHES)]).astype(np.int64),
+            "cmajor": np.array([p + 7*12 for p in [0, 2, 4, 5, 7, 9, 11, 12, 14, 16, 17, 19, 21, 23]]),
+            "length": length, "algorithm": float(rng.uniform(0, 3)),
+            "rhythm_tables": [rhythm_values, np.cumsum(rng.integers(1, 5, len(rhythm_values))), row_steps, row_offsets, row_rhythms, row_cumulative,
+                              row_rhythms, row_offsets, row_rhythms, row_cumulative, np.unique(rng.integers(0, length, 3))],
+            "draws": rng.random(2 * max(n, length + 1))}
+
+def run_kernels(inputs, counts_kernel, followers_kernel, walk_kernel, convert, chunk):
+    ''' Run the kernels on the inputs of random_inputs, converted with convert (e.g. as_input). The rhythm walk is continued
+        with chunks of the draws. Returns the follower counts, the first notes, the pitches, the velocities, the steps and the sequence. '''
+    pitches, draws = inputs["pitches"], inputs["draws"]
+    counts, first = counts_kernel(pitches)
+    p, v = convert(pitches.copy()), convert(np.full(len(pitches), 64))
+    followers_kernel(p, v, convert(inputs["locked"]), inputs["algorithm"], convert(inputs["follower_offsets"]), convert(inputs["follower_pitches"]),
+                     convert(inputs["follower_cumulative"]), convert(inputs["cmajor"]), convert(draws))
+    tables = [convert(table) for table in inputs["rhythm_tables"]]
+    steps, sequence, state, finished, start = [], [], (0, 0, 0), False, 0
+    while not finished and start < len(draws):
+        count, out_steps, out_sequence, *state, finished = walk_kernel(inputs["length"], inputs["algorithm"], *tables, convert(draws[start:start+chunk]), *state)
+        steps += as_list(out_steps[:count])
+        sequence += as_list(out_sequence[:count])
+        start += chunk
+    return counts, first, np.asarray(p), np.asarray(v), steps, sequence
+
+def check_helpers(row_choice, find, rng):
+    ''' Returns the number of random rows and keys for which the helpers differ from the interpreted _py_row_choice and _py_find '''
+    mismatches = 0
+    values = rng.integers(1, 100, 16)
+    cumulative = np.concatenate([np.cumsum(rng.integers(0, 4, 8)), np.cumsum(rng.integers(0, 4, 8))]) # two rows, possibly empty
+    keys = np.unique(rng.integers(0, 64, 12))
+    for start, end in ((0, 8), (8, 16), (3, 3), (0, 0)):
+        for u in rng.random(8):
+            mismatches += row_choice(values, cumulative, start, end, u) != _py_row_choice(values, cumulative, start, end, u)
+    for key in rng.integers(-1, 66, 16):
+        mismatches += find(keys, key) != _py_find(keys, key)
+    return int(mismatches)
+
+def self_check(trials=200, seed=0):
+    ''' Compare the kernels of the backend with the interpreted kernels (_py_*) on random inputs. Returns the number of mismatches.
+        The interpreted kernels call the helpers of the backend (numba binds them at compile time), so the helpers are compared
+        with the interpreted helpers on their own. '''
+    rng = np.random.default_rng(seed)
+    mismatches = 0
+    for trial in range(trials):
+        mismatches += check_helpers(_row_choice, _find, rng) > 0
+        inputs = random_inputs(rng)
+        chunk = 2 * int(rng.integers(1, 16)) # the backend continues the walk with chunks of the draws, the reference walks at once
+        backend = run_kernels(inputs, follower_counts, pitch_followers, rhythm_walk, as_input, chunk)
+        reference = run_kernels(inputs, _py_follower_counts, _py_pitch_followers, _py_rhythm_walk, np.asarray, len(inputs["draws"]))
+        mismatches += not all(np.array_equal(a, b) for a, b in zip(backend, reference))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = self_check()
+    print("Kernel backend: " + BACKEND + ", " + str(mismatches) + " mismatches")
+    raise SystemExit(1 if mismatches else 0)
@@ -0,0 +1,64 @@
+''' This script contains the key detection and the transposition to C major (or A minor).
+
+The key of each source is estimated by correlating its duration weighted pitch class histogram
+with the 24 rotated Krumhansl-Kessler key profiles. All sources of a corpus are classified at
+once: the histograms are stacked into one matrix and correlated with one matrix product.
+'''
+
+import numpy as np
+from midi_util import Midi_Util
+
+# Krumhansl-Kessler probe tone profiles, index 0 = tonic
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+MAJOR = 0
+MINOR = 1
+
+def _key_profiles():
+    ''' Returns the 24 x 12 matrix of the key profiles, rows 0-11 = major keys with tonic 0-11, rows 12-23 = minor keys '''
+    rotations = (np.arange(12)[None, :] - np.arange(12)[:, None]) % 12 # rotations[tonic, pitch_class] = degree
+    return np.vstack((MAJOR_PROFILE[rotations], MINOR_PROFILE[rotations]))
+
+KEY_PROFILES = _key_profiles()
+
+def key_name(tonic, mode):
+    ''' Returns the name of a key, e.g. "A minor" '''
+    return Midi_Util.RawPitchNames[tonic] + (" major" if mode == MAJOR else " minor")
+
+def pitch_class_histograms(events_list):
+    ''' Returns the n x 12 matrix of the pitch class histograms of n note events. Each note is weighted by its
+        duration in steps (until the next note, the last note until the end of the loop). '''
+    lengths = np.array([len(events) for events in events_list], dtype=np.int64)
+    if lengths.sum() == 0:
+        return np.zeros((len(events_list), 12))
+    source_ids = np.repeat(np.arange(len(events_list)), lengths)
+    pitches = np.concatenate([events.pitches for events in events_list if len(events) > 0])
+    durations = np.concatenate([np.diff(np.append(events.steps, events.length)) for events in events_list if len(events) > 0])
+    histograms = np.bincount(source_ids * 12 + pitches % 12, weights=durations, minlength=len(events_list) * 12)
+    return histograms.reshape(len(events_list), 12)
+
+def detect_keys(histograms):
+    ''' Returns the tonic (0-11), the mode (MAJOR or MINOR) and the correlation of the best matching key of each histogram '''
+    histograms = np.atleast_2d(np.asarray(histograms, dtype=np.float64))
+    h = histograms - histograms.mean(axis=1, keepdims=True)
+    p = KEY_PROFILES - KEY_PROFILES.mean(axis=1, keepdims=True)
+    h_norm = np.linalg.norm(h, axis=1, keepdims=True)
+    h_norm[h_norm == 0] = 1 # empty or flat histograms correlate with nothing
+    correlations = (h / h_norm) @ (p / np.linalg.norm(p, axis=1, keepdims=True)).T # n x 24
+    best = np.argmax(correlations, axis=1)
+    return best % 12, best // 12, correlations[np.arange(len(best)), best]
+
+def transposition_to_c(tonic, mode):
+    ''' Returns the transposition in semitones (-6 to +5) that moves the key to C major, or to A minor for minor keys '''
+    tonic = np.asarray(tonic)
+    relative_major = np.where(np.asarray(mode) == MINOR, tonic + 3, tonic)
+    return (-relative_major + 6) % 12 - 6
+
+def transpose(events, transposition, max_notes=128):
+    ''' Transpose the note events by x semitones in place. Notes that would leave the pitch range are moved by an octave. '''
+    pitches = events.pitches + transposition
+    pitches = np.where(pitches < 0, pitches + 12, pitches)
+    pitches = np.where(pitches >= max_notes, pitches - 12, pitches)
+    events.pitches = pitches
+    return events
@@ -9,34 +9,41 @@ The goal is to create guitar or synth lead riffs.
 '''
 
 import os
+import io
+import sys
 import argparse
+import time
+import random
+import multiprocessing
 import numpy as np
 import midi_util
+import note_events
+import quantizer
+import key_detection
+import corpus_index
+import corpus_io
+import riff_model
+import kernels
+import scoring
+import guided
+import aggregate
+import sweep
+import checkpoint
+import output_cache
+import model_cache
+import shared_model
+import dataset
+import dedup
+import recombine
+import metrics
+import diagnostics
+from diagnostics import log
 from mido import MidiFile
 
+MIDI_IN_PATH = 'midi_in'
 
-DEBUG = True
-
-
-if __name__ == "__main__":
-
-    util = midi_util.Midi_Util()
-
-    global_pitch_info = []
-    global_pitch_info.append ([]) # followers of C
-    global_pitch_info.append ([]) # followers of Cis
-    global_pitch_info.append ([]) # followers of D
-    global_pitch_info.append ([]) # followers of Dis
-    global_pitch_info.append ([]) # followers of E
-    global_pitch_info.append ([]) # followers of F
-    global_pitch_info.append ([]) # followers of Fis
-    global_pitch_info.append ([]) # followers of G
-    global_pitch_info.append ([]) # followers of Gis
-    global_pitch_info.append ([]) # followers of A
-    global_pitch_info.append ([]) # followers of Ais
-    global_pitch_info.append ([]) # followers of B    
-
-    # Argument parsing
+def make_parser():
+    ''' Returns the parser of the command line arguments '''
     parser = argparse.ArgumentParser(
         description='Save a directory of MIDI files as arrays and back. \
                      The input midi must be quantized and 8 bars long. \
@@ -58,21 +65,87 @@ if __name__ == "__main__":
         '--quantization',
         default=5,
         help='defines a 1/2**quantization note quantization grid')    
+    parser.add_argument(
+        '--triplets',
+        dest='triplets',
+        action='store_true',
+        help='add triplets to the quantization grid (3 x 2**quantization steps per whole note, e.g. 1/32 and 1/32 triplets)')
+    parser.add_argument(
+        '--quantize-input',
+        dest='quantize_input',
+        action='store_true',
+        help='quantize the input midi files (no need to quantize them in a DAW before)')
+    parser.add_argument(
+        '--quantize-grid',
+        dest='quantize_grid',
+        default=None,
+        help='defines a 1/2**quantize-grid note grid the input notes are moved to (default = --quantization), e.g. 4 to move the notes to 1/16 notes')
+    parser.add_argument(
+        '--quantize-strength',
+        dest='quantize_strength',
+        default=1.0,
+        help='1.0 = move the input notes onto the quantize grid (default), 0.5 = move them half the way (the notes are always snapped to the --quantization grid)')
+    parser.add_argument(
+        '--swing-tolerance',
+        dest='swing_tolerance',
+        default=0.0,
+        help='0.0 = move the input notes to the nearest grid line (default), > 0 notes up to 0.5 + swing-tolerance grid steps late are moved back to the previous grid line')
+    parser.add_argument(
+        '--detect-key',
+        dest='detect_key',
+        action='store_true',
+        help='detect the key of the input midi files and transpose them to C major (or A minor) before the analysis')
+    parser.add_argument(
+        '--transpose-back',
+        dest='transpose_back',
+        action='store_true',
+        help='transpose the variations back to the detected key of their input midi file (requires --detect-key)')
+    parser.add_argument(
+        '--blend-neighbours',
+        dest='blend_neighbours',
+        default=0,
+        help='0 = model each midi file on its own (default), k > 0 blend the pitch followers and rhythms of the k most similar midi files of the corpus into the model')
+    parser.add_argument(
+        '--dedup',
+        dest='dedup',
+        default='off',
+        choices=['off', 'skip', 'global'],
+        help='near-duplicate midi files (transposed, shifted or slightly edited copies): skip = only the first file of each cluster is processed, global = all files are processed but each cluster counts once in the global statistics (default: off)')
+    parser.add_argument(
+        '--dedup-threshold',
+        dest='dedup_threshold',
+        default=dedup.THRESHOLD,
+        help='minimum similarity (0 - 1) of the interval and rhythm n-grams of near-duplicate midi files')
+    parser.add_argument(
+        '--shard',
+        dest='shard',
+        default=None,
+        help='i/N = process only the i-th of N shards of the midi files (0 <= i < N) and save the partial global statistics to aggregate/, merge the shards with reduce.py')
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        default=None,
+        help='process only the midi files listed in this file (one path per line) and save the partial global statistics to aggregate/, merge them with reduce.py')
     parser.add_argument(
         '--amount',
         dest='amount',
         default=1,
         help='create a certain amount of variations')
+    parser.add_argument(
+        '--keep-best',
+        dest='keep_best',
+        default=0,
+        help='0 = write all variations (default), k > 0 score the variations (style of the source, range, novelty) and write only the best k of them')
     parser.add_argument(
         '--random-notes',
         dest='random_notes',
         default=0,
-        help='0 = no random (default), 1 file random followers, 2 C major random between C5 and C6, 3 file random followers by (pitch-)quantity.md') # file random means that if a C is followed by a D in the file, then this sequence(s) might be randomly applied to other steps, while random followers by quantity means that the probability of certain notes is controlled by the pitch-quantity.md file. Please keep in mind that every occuring raw_pitch note event needs a pitch follower otherwise you get a index out of bounds.
+        help='0 = no random (default), 1 file random followers, 2 C major random between C5 and C6, 3 file random followers by (pitch-)quantity.md') # file random means that if a C is followed by a D in the file, then this sequence(s) might be randomly applied to other steps, while random followers by quantity means that the probability of certain notes is controlled by the pitch-quantity.md file. A note whose raw_pitch has no pitch follower keeps its pitch.
     parser.add_argument(
         '--random-rhythm',
         dest='random_rhythm',        
         default=0,
-        help='0 = no random (default), 1 file random, 2 file random by (rhythm-)quantity.md (step-based)') # file random means that only the rhythm timing in the file are used but are put into different order, while step-based means that the rhythm randomization at each step is controlled by the rhythm-quantity.md file.
+        help='0 = no random (default), 1 file random, 2 file random by (rhythm-)quantity.md (step-based), 3 file random by the rhythm that follows the last rhythm (Markov)') # file random means that only the rhythm timing in the file are used but are put into different order, while step-based means that the rhythm randomization at each step is controlled by the rhythm-quantity.md file.
     parser.add_argument(
         '--note-min',
         dest='note_min',
@@ -98,122 +171,922 @@ if __name__ == "__main__":
         dest='transpose_same',
         action='store_true',
         help='always transpose notes that are followed by the same note')
+    parser.add_argument(
+        '--guided',
+        dest='guided',
+        default=0,
+        help='0 = random generation (default), t > 0 search each variation from the source towards a target (interval profile of the source, density, note range, distance to the source) within t milliseconds per midi file')
+    parser.add_argument(
+        '--target-density',
+        dest='target_density',
+        default=None,
+        help='target notes per whole note of the guided generation (default: the density of the source)')
+    parser.add_argument(
+        '--target-distance',
+        dest='target_distance',
+        default=0.5,
+        help='target fraction of the notes that the guided generation changes or mutes (0 - 1)')
+    parser.add_argument(
+        '--sweep',
+        dest='sweep',
+        default=None,
+        help='config file (.json) with a list or grid of generation settings, each source is analyzed once and its variations of each setting are written to midi_out/<setting>/')
+    parser.add_argument(
+        '--recombine',
+        dest='recombine',
+        default=None,
+        help='config file (.json) with pitch and rhythm sources (glob patterns), each source is analyzed once and the variations of each pair (pitch followers of one source, rhythms of the other) are written to midi_out/recombine/')
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        default=os.cpu_count() or 1,
+        help='number of worker processes for the generation of a sweep (1 = no worker processes)')
+    parser.add_argument(
+        '--export-dataset',
+        dest='export_dataset',
+        default=None,
+        help='directory for a columnar training dataset (.npy shards and index.json) of the sources, the written variations and their generation settings')
+    parser.add_argument(
+        '--seed',
+        dest='seed',
+        type=int,
+        default=None,
+        help='random seed, each midi file gets its own random sequence of the seed and its path, so its variations are reproducible')
+    parser.add_argument(
+        '--output-cache',
+        dest='output_cache',
+        default=None,
+        help='directory of the output cache (needs --seed): the written files of each source and setting, repeated runs with the same source, model, settings and seed read them instead of generating them')
+    parser.add_argument(
+        '--output-cache-size',
+        dest='output_cache_size',
+        default=512,
+        help='maximum size of the output cache on disk in MB, the least recently used entries are removed first')
+    parser.add_argument(
+        '--model-cache-size',
+        dest='model_cache_size',
+        default=None,
+        help='maximum memory of the model cache in MB (default 64 with --watch, else 0 = no cache): the models and analyses of the sources by path, events and modification time and size of their .md files, repeated requests for an unchanged source (e.g. in watch mode) skip reading the .md files')
+    parser.add_argument(
+        '--resume',
+        dest='resume',
+        action='store_true',
+        help='continue an interrupted run with the same settings: skip the midi files of its checkpoint that were finished (or failed) and did not change since')
+    parser.add_argument(
+        '--checkpoint-every',
+        dest='checkpoint_every',
+        default=25,
+        help='save the finished midi files and the partial global statistics to checkpoint/ every n midi files (0 = never), a finished run removes its checkpoint')
+    parser.add_argument(
+        '--metrics-file',
+        dest='metrics_file',
+        default=None,
+        help='Prometheus text file (.prom) with the counters and stage latencies of the run, rewritten every --metrics-interval seconds (e.g. for the textfile collector of the node exporter)')
+    parser.add_argument(
+        '--metrics-interval',
+        dest='metrics_interval',
+        default=10,
+        help='seconds between two writes of the metrics file')
+    parser.add_argument(
+        '--watch',
+        dest='watch',
+        action='store_true',
+        help='keep running and update the outputs of a midi file when it or one of its pitch_quantity, rhythm_quantity or lock_steps .md files changes')
+    parser.add_argument(
+        '--watch-interval',
+        dest='watch_interval',
+        default=2,
+        help='seconds between two checks for changes in watch mode')
+    parser.add_argument(
+        '--log-level',
+        dest='log_level',
+        default='info',
+        choices=list(diagnostics.LEVELS),
+        help='quiet, warning, info (default) or debug (prints the note arrays, pitch followers and rhythm info of each variation)')
     parser.set_defaults(use_cached=False)
     parser.set_defaults(transpose_same=False)
-    args = parser.parse_args()
+    parser.set_defaults(triplets=False)
+    parser.set_defaults(detect_key=False)
+    parser.set_defaults(transpose_back=False)
+    parser.set_defaults(watch=False)
+    parser.set_defaults(resume=False)
+    return parser
+
+class Run:
+    ''' The settings, the output paths and the shared state of a run: the background writer, the caches, the metrics,
+        the global statistics, the quarantine and the checkpoint '''
+
+    def __init__(self, args):
+        self.args = args
+        self.grid = note_events.Grid(args.quantization, args.triplets)
+        self.quantize_grid = note_events.Grid(args.quantize_grid, args.triplets) if args.quantize_grid is not None else self.grid
+        self.util = midi_util.Midi_Util(self.grid)
+        self.summaries = [] # per-file run summaries, written at the end of the run
+        self.metrics = metrics.Metrics(args.metrics_file, float(args.metrics_interval)) # counters, stage latencies and progress of the run
+        self.rng = random.Random() # one random number generator for all variations of the run (without --seed)
+        self.cache = output_cache.OutputCache(args.output_cache, float(args.output_cache_size) * 1024 * 1024) if args.output_cache is not None and args.seed is not None else None
+        if args.model_cache_size is None:
+            args.model_cache_size = 64 if args.watch else 0 # a single pass requests each source once, only the watch mode has hits
+        self.cached_models = model_cache.ModelCache(float(args.model_cache_size) * 1024 * 1024) if float(args.model_cache_size) > 0 else None
+        self.dataset_writer = None
+
+        # Get paths
+        path_prefix, self.path_suffix = os.path.split(args.path)
+        if args.path == '' or args.path == MIDI_IN_PATH:
+            if len(self.path_suffix) == 0: # Handle case where a trailing / requires two splits.
+                path_prefix, self.path_suffix = os.path.split(path_prefix)
+        else:
+            path_prefix = ''
+        self.base_path_out_pitch_quantity = os.path.join(path_prefix, 'pitch_quantity')
+        self.base_path_out_rhythm_quantity = os.path.join(path_prefix, 'rhythm_quantity')
+        self.base_path_out_lock_steps = os.path.join(path_prefix, 'lock_steps')
+        self.base_path_out_arrays = os.path.join(path_prefix, 'array')
+        self.base_path_out_midi_out = os.path.join(path_prefix, 'midi_out')
+        self.base_path_out_diagnostics = os.path.join(path_prefix, 'diagnostics')
+        self.base_path_out_aggregate = os.path.join(path_prefix, 'aggregate')
+        self.base_path_out_checkpoint = os.path.join(path_prefix, 'checkpoint')
+
+        # Select the midi files of this run (shard or manifest), the global statistics of a partial run are saved for reduce.py
+        self.shard = aggregate.parse_shard(args.shard) if args.shard is not None else None
+        self.manifest = aggregate.read_manifest(args.manifest) if args.manifest is not None else None
+        self.global_counts = aggregate.Aggregate() # pitch follower and rhythm counts of each midi file
+        self.directories = corpus_io.Directories() # output directories that exist
+        self.writer = corpus_io.Writer() # the outputs are written in the background
+
+        # Failures are isolated per midi file: the file is quarantined with the reason and the run continues.
+        # The checkpoint of an interrupted run (--resume) has the finished files, the quarantine and the global statistics of the finished files.
+        self.quarantine = checkpoint.Quarantine()
+        self.done = {} # relative path -> modification time and size of the finished midi files
+        self.finished = [] # (source, relative path, state, written files) of the files whose writes are not confirmed yet
+        checkpoint_settings = {name: value for name, value in vars(args).items() if name not in ('resume', 'checkpoint_every', 'log_level', 'workers', 'watch', 'watch_interval', 'metrics_file', 'metrics_interval', 'model_cache_size')}
+        self.checkpoint = checkpoint.Checkpoint(os.path.join(self.base_path_out_checkpoint, self.get_run_name()), checkpoint_settings)
+
+    def get_relative_path(self, root, file):
+        return os.path.relpath(os.path.join(root, file), self.args.path)
+
+    def is_selected(self, item):
+        root, file = item
+        if self.shard is not None and not aggregate.in_shard(self.get_relative_path(root, file), *self.shard):
+            return False
+        if self.manifest is not None and not (os.path.normpath(os.path.join(root, file)) in self.manifest or self.get_relative_path(root, file) in self.manifest):
+            return False
+        return True
+
+    def get_suffix(self, root):
+        if (self.args.path == '' or self.args.path == 'midi_in'):
+            return root.split(self.args.path)[-1]
+        return self.path_suffix.split(MIDI_IN_PATH)[-1]
+
+    def get_array_paths(self, root, file):
+        out_dir_arrays = self.base_path_out_arrays + '/' + self.get_suffix(root)
+        return '{}.npz'.format(os.path.join(out_dir_arrays, file)), '{}.npy'.format(os.path.join(out_dir_arrays, file)) # note events and grid, dense step array of older versions
+
+    def md_paths(self, source):
+        ''' Returns the pitch quantity, rhythm quantity and lock steps .md files of a source '''
+        return (os.path.join(self.base_path_out_pitch_quantity + '/' + source["suffix"], source["file"]).replace(".mid",".md"),
+                os.path.join(self.base_path_out_rhythm_quantity + '/' + source["suffix"], source["file"]).replace(".mid",".md"),
+                os.path.join(self.base_path_out_lock_steps + '/' + source["suffix"], source["file"]).replace(".mid",".md"))
+
+    def get_output_path(self, source, out_dir_midi_out, i):
+        output_file = source["file"].split('.')
+        output_file = output_file[0:len(output_file)-1]
+        return os.path.join(self.directories.ensure(out_dir_midi_out), "".join(output_file) + str(i+1) + ".mid")
+
+    def get_summary_path(self, source):
+        return os.path.join(self.base_path_out_diagnostics + '/' + source["suffix"], source["file"]).replace(".mid",".json")
+
+    def get_run_name(self):
+        ''' Returns the name of the partial aggregate and of the checkpoint of the run '''
+        if self.shard is not None:
+            return "shard-{}-of-{}".format(*self.shard)
+        if self.manifest is not None:
+            return "manifest-{}".format(os.path.splitext(os.path.basename(self.args.manifest))[0])
+        return "run"
+
+    def source_seed(self, source, *parts):
+        ''' Returns the random seed of a source (and e.g. a sweep setting), None without --seed '''
+        return output_cache.derive_seed(self.args.seed, self.get_relative_path(source["root"], source["file"]), *parts) if self.args.seed is not None else None
+
+    def output_events(self, source, events):
+        ''' Returns the events in the key of the output files '''
+        if self.args.transpose_back and source["transposition"] != 0:
+            return key_detection.transpose(events.copy(), -source["transposition"]) # back to the original key
+        return events
+
+    def quarantine_file(self, root, file, stage, reason):
+        ''' Quarantine a midi file that failed or was skipped in a stage of the run (read, convert, generate, write, sweep) '''
+        self.quarantine.add(self.get_relative_path(root, file), stage, reason, checkpoint.file_state(os.path.join(root, file)))
+
+    def save_midi(self, path, mid):
+        ''' Save a midi file or its encoded bytes (e.g. of the output cache) '''
+        with self.metrics.time("write"):
+            if isinstance(mid, bytes):
+                with open(path, "wb") as f:
+                    f.write(mid)
+                size = len(mid)
+            else:
+                mid.save(path)
+                size = os.path.getsize(path)
+        self.metrics.inc("bytes_written_total", size)
+
+    def write_midi(self, path, mid):
+        self.writer.submit(path, self.save_midi, path, mid)
+
+    def save_global_info(self):
+        ''' Save the global pitch quantity file of the counts of all files, a partial run saves its statistics for reduce.py instead '''
+        if self.shard is not None or self.manifest is not None:
+            self.global_counts.save(os.path.join(self.directories.ensure(self.base_path_out_aggregate), self.get_run_name() + ".npz"), self.grid)
+        else:
+            self.global_counts.save_global_info(os.path.join(self.directories.ensure(self.base_path_out_pitch_quantity),"global_pitch_quantity.md"))
+
+    def write_summaries(self):
+        for summary_path, summary in self.summaries:
+            self.writer.submit(summary_path, diagnostics.write_summary, summary_path, summary)
+        self.summaries.clear()
+
+    def confirm_finished(self):
+        ''' Mark the finished files as done once their background writes succeeded, a file with a failed write is quarantined '''
+        for source, path, state, written in self.finished:
+            error = self.writer.failure(written)
+            if error is None:
+                self.done[path] = state
+                continue
+            self.global_counts.remove_file(path)
+            self.quarantine_file(source["root"], source["file"], "write", checkpoint.describe(error))
+            log.error('Error: File %s quarantined: %s', os.path.join(source["root"], source["file"]), checkpoint.describe(error))
+            self.metrics.count_file("quarantined")
+        self.finished.clear()
+
+    def save_checkpoint(self):
+        ''' Write the summaries of the finished files and save the checkpoint '''
+        self.write_summaries()
+        self.confirm_finished()
+        self.writer.flush()
+        self.checkpoint.save(self.done, self.quarantine, self.global_counts, self.grid)
+        log.info('Checkpoint: %d files finished, %d quarantined', len(self.done), len(self.quarantine))
+
+    def resume(self):
+        ''' Load the finished files, the quarantine and the partial global statistics of the checkpoint of an interrupted run '''
+        if self.args.sweep is not None or self.args.recombine is not None:
+            log.warning('Warning: --resume is not supported by the sweep and the recombination, all midi files are processed.')
+            return
+        state = self.checkpoint.load()
+        if state is None:
+            log.warning('Warning: No checkpoint of a run with the same settings found in %s, all midi files are processed.', self.checkpoint.directory)
+            return
+        self.done, self.quarantine, partial = state
+        self.global_counts.merge(partial)
+        log.info('Resuming: %d files finished, %d quarantined', len(self.done), len(self.quarantine))
 
-    # Get paths
-    MIDI_IN_PATH = 'midi_in'
-    path_prefix, path_suffix = os.path.split(args.path)
-    if args.path == '' or args.path == MIDI_IN_PATH:
-        if len(path_suffix) == 0: # Handle case where a trailing / requires two splits.
-            path_prefix, path_suffix = os.path.split(path_prefix)
+    def is_pending(self, item):
+        ''' Returns False for the unchanged quarantined files of a resumed run, and for its finished files if the other files don't need them (neighbours) '''
+        path, state = self.get_relative_path(*item), checkpoint.file_state(os.path.join(*item))
+        if self.quarantine.is_unchanged(path, state):
+            return False
+        return int(self.args.blend_neighbours) > 0 or self.done.get(path) != state
+
+def read_source(run, item):
+    ''' Read the midi file, or the cached note events (None if there are none). Runs in the I/O threads. '''
+    root, file = item
+    if not run.args.use_cached:
+        return MidiFile(os.path.join(root,file))
+    out_file_array, out_file_legacy_array = run.get_array_paths(root, file)
+    if os.path.exists(out_file_array):
+        return note_events.NoteEvents.load(out_file_array) # load the cached file
+    elif os.path.exists(out_file_legacy_array):
+        return note_events.NoteEvents.from_step_array(np.load(out_file_legacy_array), run.grid) # load the cached file
+    return None
+
+def convert_source(run, root, file, data, use_cached):
+    ''' Returns the source (paths, note events) of a midi file (data = midi object) or of the cached note events (data = events), None if it is skipped '''
+    args, grid = run.args, run.grid
+
+    # Get output file path
+    suffix = run.get_suffix(root)
+    out_file_array, out_file_legacy_array = run.get_array_paths(root, file)
+
+    quantize_report = None
+
+    # Create the array file (note events and grid)
+    if not use_cached:
+        mid = data
+
+        time_sig_msgs = [ msg for msg in mid.tracks[0] if msg.type == 'time_signature' ]
+        if len(time_sig_msgs) == 1:
+            time_sig = time_sig_msgs[0]
+            if not (time_sig.numerator == 4 and time_sig.denominator == 4):
+                log.warning('Time signature not 4/4. Skipping...')
+                run.quarantine_file(root, file, "convert", "Time signature not 4/4")
+                return None
+        else:
+            log.warning('No time signature. Skipping...')
+            run.quarantine_file(root, file, "convert", "No time signature")
+            return None
+
+        if args.quantize_input:
+            mid, quantize_report = quantizer.quantize(mid, grid, run.quantize_grid, float(args.quantize_strength), float(args.swing_tolerance))
+            log.info('  %s', quantize_report)
+
+        events = run.util.midi_to_events(mid) # get the midi note events
+
+        run.directories.ensure(run.base_path_out_arrays + '/' + suffix)
+        run.writer.submit(out_file_array, events.copy().save, out_file_array) # Write or 'Save' the events to the out_file (a copy, the events are transposed and varied below)
+    elif data is None:
+        log.error("Error: File " + out_file_array + " not found.")
+        run.quarantine_file(root, file, "convert", "File " + out_file_array + " not found")
+        return None
     else:
-        path_prefix = ''
-    base_path_out_pitch_quantity = os.path.join(path_prefix, 'pitch_quantity')
-    base_path_out_rhythm_quantity = os.path.join(path_prefix, 'rhythm_quantity')
-    base_path_out_lock_steps = os.path.join(path_prefix, 'lock_steps')
-    base_path_out_arrays = os.path.join(path_prefix, 'array')
-    base_path_out_midi_out = os.path.join(path_prefix, 'midi_out')
-
-    for root, dirs, files in os.walk(args.path):
-        if 'archive' in root: # skip files in the 'archive'
-            continue
-        for file in files:
-            if '.mid' in file and file.split('.')[-1] == 'mid':
-                print (os.path.join(root, file))
+        events = data
+        if events.grid != grid:
+            log.error("Error: File " + out_file_array + " was created with another quantization grid.")
+            run.quarantine_file(root, file, "convert", "File " + out_file_array + " was created with another quantization grid")
+            return None
+
+    return {"root": root, "file": file, "suffix": suffix, "events": events, "quantize_report": quantize_report, "transposition": 0}
+
+def read_sources(run):
+    ''' Read and convert the pending midi files of the run (or their cached note events). Returns their sources. '''
+    sources = []
+    items = filter(run.is_pending, filter(run.is_selected, corpus_io.discover(run.args.path)))
+    for (root, file), data, error in corpus_io.prefetch(items, lambda item: read_source(run, item)):
+        log.info(os.path.join(root, file))
+        if error is None:
+            try:
+                with run.metrics.time("convert"):
+                    source = convert_source(run, root, file, data, run.args.use_cached)
+            except Exception as convert_error:
+                run.quarantine_file(root, file, "convert", checkpoint.describe(convert_error))
+                log.error('Error: File %s quarantined: %s', os.path.join(root, file), checkpoint.describe(convert_error))
+                run.metrics.count_file("quarantined")
+                continue
+            if source is not None:
+                sources.append(source)
+                run.metrics.count_file("read")
+            else:
+                run.metrics.count_file("quarantined")
+        else:
+            run.quarantine_file(root, file, "read", checkpoint.describe(error))
+            log.error('Error: File %s quarantined: %s', os.path.join(root, file), checkpoint.describe(error))
+            run.metrics.count_file("quarantined")
+        run.metrics.tick()
+    return sources
+
+def deduplicate(run, sources):
+    ''' Find the clusters of near-duplicate sources and write them to diagnostics/duplicates.json. Returns the sources of the run:
+        only the first source of each cluster (skip), or all sources with the duplicates marked (global). '''
+    args = run.args
+    clusters, links = dedup.find_clusters([source["events"] for source in sources], float(args.dedup_threshold))
+    report, duplicates = [], set()
+    for cluster in clusters:
+        representative = sources[cluster[0]]
+        representative["duplicates"] = [run.get_relative_path(sources[i]["root"], sources[i]["file"]) for i in cluster[1:]]
+        joined = [] # the member each duplicate joined the cluster through and their similarity
+        for i in cluster[1:]:
+            source = sources[i]
+            source["duplicate_of"] = run.get_relative_path(representative["root"], representative["file"])
+            duplicates.add(i)
+            j, value = links[i]
+            joined.append((run.get_relative_path(sources[j]["root"], sources[j]["file"]), value))
+            log.info('%s: near-duplicate of %s (similarity %.2f to %s)%s', os.path.join(source["root"], source["file"]), source["duplicate_of"],
+                     value, joined[-1][0], ", skipped" if args.dedup == 'skip' else "")
+            run.metrics.count_file("duplicate")
+        report.append({"file": run.get_relative_path(representative["root"], representative["file"]),
+                       "duplicates": [{"file": path, "joined": via, "similarity": round(value, 3)} for path, (via, value) in zip(representative["duplicates"], joined)]})
+    if clusters:
+        diagnostics.write_summary(os.path.join(run.base_path_out_diagnostics, "duplicates.json"), {"mode": args.dedup, "threshold": float(args.dedup_threshold), "clusters": report})
+        log.info('Near-duplicates: %d files in %d clusters', len(duplicates), len(clusters))
+    if args.dedup == 'skip':
+        return [source for i, source in enumerate(sources) if i not in duplicates]
+    return sources
+
+def detect_keys(sources):
+    ''' Detect the key of the sources at once and transpose them to C major (or A minor) '''
+    if len(sources) == 0:
+        return
+    tonics, modes, scores = key_detection.detect_keys(key_detection.pitch_class_histograms([source["events"] for source in sources]))
+    transpositions = key_detection.transposition_to_c(tonics, modes).tolist()
+    for source, tonic, mode, score, transposition in zip(sources, tonics.tolist(), modes.tolist(), scores.tolist(), transpositions):
+        key_detection.transpose(source["events"], transposition)
+        source["transposition"] = transposition
+        source["key"] = {"name": key_detection.key_name(tonic, mode), "correlation": round(score, 3), "transposition": transposition}
+        log.info('%s: %s, transposed by %s semitones', os.path.join(source["root"], source["file"]), source["key"]["name"], transposition)
+
+def find_neighbours(args, sources):
+    ''' Returns the index of the sources and the most similar sources of each source (after the key detection, so that the pitch classes are comparable) '''
+    if int(args.blend_neighbours) > 0 and len(sources) > 1:
+        index = corpus_index.CorpusIndex([os.path.join(source["root"], source["file"]) for source in sources], [source["events"] for source in sources])
+        return index, index.all_neighbours(int(args.blend_neighbours)).tolist()
+    return None, [[] for source in sources]
+
+def process_source(run, n, source, analyze, index, source_neighbours):
+    ''' Analyze the source (or load the analysis from its .md files) and build its model. Returns the run summary and the model. '''
+    args, grid, util = run.args, run.grid, run.util
+    root, file, suffix, events = source["root"], source["file"], source["suffix"], source["events"]
+
+    # Get output file path and save info to .md files
+    out_dir_pitch_quantity = run.base_path_out_pitch_quantity + '/' + suffix
+    out_dir_rhythm_quantity = run.base_path_out_rhythm_quantity + '/' + suffix
+    out_dir_lock_steps = run.base_path_out_lock_steps + '/' + suffix
+    pitch_quantity_path, rhythm_quantity_path, lock_steps_path = run.md_paths(source)
+    path = run.get_relative_path(root, file)
 
-                # Get output file path
-                if (args.path == '' or args.path == 'midi_in'):
-                    suffix = root.split(args.path)[-1]
+    # Calculate midi info such as pitches and rhythms
+    if analyze:
+        run.directories.ensure(out_dir_pitch_quantity)
+        run.directories.ensure(out_dir_rhythm_quantity)
+        run.directories.ensure(out_dir_lock_steps)
+
+        util.__init__(grid)
+        util.calc_pitch_followers(events)
+        util.calc_rhythm_intervals(events)
+        util.save_info(pitch_quantity_path, rhythm_quantity_path)
+
+    # The model cache holds the model and the analysis of an unchanged source (events and state of its .md files), the .md files aren't read again
+    lock_steps_path = lock_steps_path if args.lock_steps and os.path.exists(lock_steps_path) else None
+    neighbour_events = [index.events[j] for j in source_neighbours]
+    cached_models, cached = run.cached_models, None
+    if cached_models is not None:
+        md_files = [lock_steps_path] if analyze else [pitch_quantity_path, rhythm_quantity_path, lock_steps_path]
+        cache_key = model_cache.make_key(events, md_files, neighbour_events, analyze)
+        cached = cached_models.get(path, cache_key)
+        run.metrics.inc("model_cache_requests_total", 1, (("result", "hit" if cached is not None else "miss"),))
+
+    if cached is not None:
+        model, (analysis, counts) = cached
+    else:
+        # Load info from cached files
+        if not analyze and os.path.exists(pitch_quantity_path) and os.path.exists(out_dir_rhythm_quantity):
+            # Info will be loaded by the model below, only the summary needs the rhythm histogram of the events
+            util.__init__(grid)
+            util.load_info(pitch_quantity_path, rhythm_quantity_path)
+            util.calc_rhythm_intervals(events)
+        analysis, counts = util.get_summary(vars(args)), aggregate.FileCounts.from_util(util)
+
+        # Build the model once, it is shared by all variations of this midi file
+        model = riff_model.load(events, pitch_quantity_path, rhythm_quantity_path, lock_steps_path, neighbour_events)
+        if cached_models is not None:
+            cached_models.put(path, cache_key, model, (analysis, counts))
+            run.metrics.set_gauge("model_cache_bytes", cached_models.size)
+
+    summary = dict(analysis) # the analysis of a cached model is shared by its requests
+    summary["kernels"] = kernels.BACKEND
+    if "duplicate_of" not in source: # near-duplicates (--dedup global) don't count in the global statistics
+        run.global_counts.set_file(path, counts)
+    else:
+        summary["duplicate_of"] = source["duplicate_of"]
+    if "duplicates" in source:
+        summary["duplicates"] = source["duplicates"]
+    if source["quantize_report"] is not None:
+        summary["quantize"] = source["quantize_report"].to_dict()
+    if "key" in source:
+        summary["key"] = source["key"]
+    if len(source_neighbours) > 0:
+        similarities = index.similarities(n)
+        summary["neighbours"] = [{"file": index.names[j], "similarity": round(float(similarities[j]), 3)} for j in source_neighbours]
+        log.info('  Neighbours: %s', ", ".join(os.path.basename(index.names[j]) for j in source_neighbours))
+
+    return summary, model
+
+def get_cache_key(run, source, model, setting, seed):
+    ''' Returns the output cache key of the variations of a source, None if they are not cached
+        (no cache or seed, the time-bounded guided search, the dataset export needs the note events) '''
+    if run.cache is None or seed is None or float(setting.guided) > 0 or run.dataset_writer is not None:
+        return None
+    parameters = dict(generation_parameters(setting), transpose_back=run.args.transpose_back, transposition=source["transposition"])
+    return output_cache.make_key(source["events"], model, parameters, seed)
+
+def write_cached(run, source, entry, out_dir_midi_out):
+    ''' Write the files of an output cache entry. Returns the written files and the scores of the kept variations. '''
+    files, kept_scores = output_cache.decode(entry)
+    output_paths = [run.get_output_path(source, out_dir_midi_out, i) for i in range(len(files))]
+    for output_path, data in zip(output_paths, files):
+        run.write_midi(output_path, data)
+    log.info('  Variations read from the output cache')
+    return output_paths, kept_scores
+
+def generation_parameters(setting):
+    ''' Returns the generation parameters of the settings, numbers given on the command line are converted from strings '''
+    def number(value):
+        if isinstance(value, str):
+            return float(value) if '.' in value else int(value)
+        return value
+    return {name: number(vars(setting)[name]) for name in sweep.PARAMETERS}
+
+def generate_variations(run, source, model, setting, rng, out_dir_midi_out, write=None, encoded=None):
+    ''' Generate the variations of the source with the settings, keep the best ones and write them (with run.write_midi by default,
+        the encoded files are appended to the encoded list, e.g. for the output cache). Returns the written files, the scores of
+        the kept variations (None without keep best) and the events of the written files. '''
+    util = run.util
+    write = write if write is not None else run.write_midi
+    events = source["events"]
+    variations = []
+    if float(setting.guided) > 0:
+        target = guided.Target.from_source(events, int(setting.note_min), int(setting.note_max),
+                                           float(setting.target_density) if setting.target_density is not None else None, float(setting.target_distance))
+        for temp_events, terms in guided.generate(events, model, rng, target, int(setting.amount), float(setting.guided) / 1000, model.is_locked(events.steps)):
+            log.info('  Guided variation: cost %.3f after %d steps (%s)', terms["cost"], terms["steps"], ", ".join("%s %.3f" % (name, terms[name]) for name in guided.WEIGHTS if name in terms))
+            variations.append(temp_events)
+    for i in range(int(setting.amount) if float(setting.guided) <= 0 else 0):
+        log.info()
+        generator = riff_model.RiffGenerator(model, rng)
+        temp_events = generator.generate(events, float(setting.random_notes),
+                                         float(setting.transpose_algorithm), float(setting.transpose_probability), setting.transpose_same,
+                                         int(setting.note_min), int(setting.note_max), float(setting.random_rhythm))
+        log.info()
+
+        if log.debug_enabled:
+            util.print_array_notes(temp_events)
+            model.print_pitch_followers(util.RawPitch.A)
+            model.print_rhythm_info()
+        variations.append(temp_events)
+
+    # Score all variations at once and keep only the best ones
+    kept_scores = None
+    if int(setting.keep_best) > 0:
+        scores = scoring.score_batch(variations, events, int(setting.note_min), int(setting.note_max))
+        kept = scoring.best(scores["score"], int(setting.keep_best)).tolist()
+        log.info('  Kept variations %s of %d (score %s)', [k+1 for k in kept], len(variations), ", ".join("%.3f" % scores["score"][k] for k in kept))
+        kept_scores = [{name: round(float(values[k]), 3) for name, values in scores.items()} for k in kept]
+        variations = [variations[k] for k in kept]
+
+    output_paths = []
+    variations = [run.output_events(source, temp_events) for temp_events in variations]
+    for i, temp_events in enumerate(variations):
+        mid = util.events_to_midi (temp_events, "Track1")
+        output_path = run.get_output_path(source, out_dir_midi_out, i)
+        if encoded is not None:
+            buffer = io.BytesIO()
+            mid.save(file=buffer)
+            mid = buffer.getvalue()
+            encoded.append(mid)
+        write(output_path, mid)
+        output_paths.append(output_path)
+    return output_paths, kept_scores, variations
+
+def generate_source(run, source, model, out_dir_midi_out, seed):
+    ''' Write the variations of the source with the settings of the command line (or the files of the output cache).
+        Returns the written files and the scores of the kept variations. '''
+    cache_key = get_cache_key(run, source, model, run.args, seed)
+    entry = run.cache.get(cache_key) if cache_key is not None else None
+    if entry is not None:
+        output_paths, kept_scores = write_cached(run, source, entry, out_dir_midi_out)
+        variations = []
+    else:
+        encoded = [] if cache_key is not None else None
+        with run.metrics.time("generate"):
+            output_paths, kept_scores, variations = generate_variations(run, source, model, run.args, random.Random(seed) if seed is not None else run.rng, out_dir_midi_out, encoded=encoded)
+        if cache_key is not None:
+            run.cache.put(cache_key, output_cache.encode(encoded, kept_scores))
+    run.metrics.inc("variations_total", len(output_paths))
+    if run.dataset_writer is not None:
+        source_id = run.dataset_writer.add_source(run.get_relative_path(source["root"], source["file"]), run.output_events(source, source["events"]))
+        for temp_events in variations:
+            run.dataset_writer.add(temp_events, source_id, 0)
+    return output_paths, kept_scores
+
+def run_source(run, n, source, analyze, index, source_neighbours):
+    ''' Analyze the source and write its variations with the settings of the command line. Returns the run summary and the written files. '''
+    with run.metrics.time("analyze"):
+        summary, model = process_source(run, n, source, analyze, index, source_neighbours)
+    output_paths, kept_scores = generate_source(run, source, model, run.base_path_out_midi_out + '/' + source["suffix"], run.source_seed(source))
+    if kept_scores is not None:
+        summary["variations"] = kept_scores
+    return summary, output_paths
+
+def process_sources(run, sources, index, neighbours, sweep_settings=None, recombine_config=None):
+    ''' Analyze the sources and write their variations with the settings of the command line, or only analyze them for the sweep
+        or the recombination. Returns the (source, model) jobs of the sweep and the (source, model) of each relative path of the recombination. '''
+    args = run.args
+    sweep_jobs = [] # (source, model) of each source, the variations of all settings are generated after the analysis
+    recombine_models = {} # relative path -> (source, model), each source is analyzed once for all its pairs
+    recombine_selected = None # relative paths of the sources of the pairs, the other files are not analyzed
+    if recombine_config is not None:
+        pairs, _ = recombine.pairings([run.get_relative_path(source["root"], source["file"]) for source in sources], *recombine_config)
+        recombine.pair_names(pairs) # pairs with the same output files are rejected before the analysis
+        recombine_selected = set(path for pair in pairs for path in pair)
+    run.metrics.set_total(len(sources))
+    try:
+        for n, source in enumerate(sources):
+            run.metrics.tick(n)
+            path = run.get_relative_path(source["root"], source["file"])
+            if recombine_selected is not None and path not in recombine_selected:
+                continue # not a source of a pair (its events can still be a neighbour of one)
+            state = checkpoint.file_state(os.path.join(source["root"], source["file"]))
+            if run.done.get(path) == state:
+                run.metrics.count_file("resumed")
+                continue # finished before the run was interrupted
+            if len(sources) > 1:
+                log.info(os.path.join(source["root"], source["file"]))
+            try:
+                if sweep_settings is None and recombine_config is None:
+                    summary, output_paths = run_source(run, n, source, not args.use_cached, index, neighbours[n])
                 else:
-                    suffix = path_suffix.split(MIDI_IN_PATH)[-1]
-                out_dir_arrays = base_path_out_arrays + '/' + suffix
-                out_dir_midi_out = base_path_out_midi_out + '/' + suffix
-
-                # Create the array file
-                out_file_array = '{}.npy'.format(os.path.join(out_dir_arrays, file)) # Get output path + filename of the array
-                if not args.use_cached: 
-
-                    # Read Midi file
-                    mid = MidiFile(os.path.join(root,file))
-
-                    time_sig_msgs = [ msg for msg in mid.tracks[0] if msg.type == 'time_signature' ]
-                    if len(time_sig_msgs) == 1:
-                        time_sig = time_sig_msgs[0]
-                        if not (time_sig.numerator == 4 and time_sig.denominator == 4):
-                            print ('Time signature not 4/4. Skipping...')
-                            continue
-                    else:
-                        print ('No time signature. Skipping...')
+                    with run.metrics.time("analyze"):
+                        summary, model = process_source(run, n, source, not args.use_cached, index, neighbours[n])
+            except Exception as error:
+                run.global_counts.remove_file(path)
+                run.quarantine_file(source["root"], source["file"], "generate", checkpoint.describe(error))
+                log.error('Error: File %s quarantined: %s', os.path.join(source["root"], source["file"]), checkpoint.describe(error))
+                run.metrics.count_file("quarantined")
+                continue
+            run.metrics.count_file("processed")
+            run.summaries.append((run.get_summary_path(source), summary))
+            if sweep_settings is not None:
+                sweep_jobs.append((source, model))
+            elif recombine_config is not None:
+                recombine_models[path] = (source, model)
+            else:
+                written = output_paths + [run.get_summary_path(source)] + ([run.get_array_paths(source["root"], source["file"])[0]] if not args.use_cached else [])
+                run.finished.append((source, path, state, written))
+                if int(args.checkpoint_every) > 0 and (len(run.done) + len(run.finished)) % int(args.checkpoint_every) == 0:
+                    run.save_checkpoint()
+    except KeyboardInterrupt:
+        if sweep_settings is None and recombine_config is None and int(args.checkpoint_every) > 0:
+            run.save_checkpoint()
+        raise
+    return sweep_jobs, recombine_models
+
+_sweep = None # the run, the (source, model) jobs and the settings of the sweep, the forked worker processes inherit them
+_sweep_models = None # models of the shared memory segment (in a worker process)
+
+def sweep_task(task):
+    ''' Generate the variations of one source with one setting of the sweep (runs in a worker process) '''
+    run, sweep_jobs, sweep_settings = _sweep
+    job, k, seed, encode = task
+    source, model = sweep_jobs[job]
+    if _sweep_models is not None:
+        model = _sweep_models[job]
+    name, parameters = sweep_settings[k]
+    setting = argparse.Namespace(**dict(vars(run.args), **parameters))
+    out_dir_midi_out = os.path.join(run.base_path_out_midi_out, name) + '/' + source["suffix"]
+    in_worker = multiprocessing.parent_process() is not None # the background writer belongs to the parent process
+    write = run.save_midi if in_worker else run.write_midi
+    encoded = [] if encode else None # the parent process puts the encoded files to the output cache
+    try:
+        output_paths, kept_scores, variations = generate_variations(run, source, model, setting, random.Random(seed), out_dir_midi_out, write, encoded)
+    except Exception as error: # the other tasks continue, the parent quarantines the file
+        return [], None, None, None, checkpoint.describe(error)
+    return output_paths, kept_scores, variations if run.dataset_writer is not None else None, encoded, None # the events are only sent back for the dataset
+
+def attach_models(handle):
+    ''' Worker initializer: use the models of the shared memory segment instead of the objects of the parent process '''
+    global _sweep_models
+    _sweep_models = shared_model.attach(handle)
+
+def run_sweep(run, sweep_settings, sweep_jobs):
+    ''' Generate the variations of each source with each setting, each (source, setting) task has its own random seed '''
+    global _sweep
+    args = run.args
+    tasks, cache_keys, results = [], {}, {}
+    for job, (source, model) in enumerate(sweep_jobs):
+        for k, (name, parameters) in enumerate(sweep_settings):
+            seed = run.source_seed(source, name) if args.seed is not None else run.rng.getrandbits(64)
+            setting = argparse.Namespace(**dict(vars(args), **parameters))
+            cache_key = get_cache_key(run, source, model, setting, seed) if args.seed is not None else None
+            entry = run.cache.get(cache_key) if cache_key is not None else None
+            if entry is not None: # served by the output cache, only the other tasks are generated
+                output_paths, kept_scores = write_cached(run, source, entry, os.path.join(run.base_path_out_midi_out, name) + '/' + source["suffix"])
+                results[(job, k)] = (output_paths, kept_scores, None, None, None)
+                continue
+            if cache_key is not None:
+                cache_keys[(job, k)] = cache_key
+            tasks.append((job, k, seed, cache_key is not None))
+    run.writer.flush() # the worker processes are forked, all files of the analysis are complete
+    in_workers = sweep.uses_workers(int(args.workers), len(tasks))
+    run.metrics.set_total(len(tasks), "tasks")
+    last_result = [time.perf_counter()]
+    def task_finished(i, result):
+        ''' Metrics of a sweep task: the time since the previous result (the results arrive in order), the files written by a worker '''
+        now = time.perf_counter()
+        run.metrics.observe("stage_seconds", now - last_result[0], (("stage", "generate"),))
+        last_result[0] = now
+        if in_workers:
+            run.metrics.inc("bytes_written_total", sum(os.path.getsize(output_path) for output_path in result[0]))
+        run.metrics.tick(i + 1)
+    _sweep = (run, sweep_jobs, sweep_settings)
+    try:
+        if in_workers:
+            # The workers attach to one shared copy of the models, the segment is removed when the sweep ends or fails
+            with shared_model.SharedModels([model for source, model in sweep_jobs]) as shared_models:
+                generated = sweep.map_tasks(sweep_task, tasks, int(args.workers), attach_models, (shared_models.handle,), task_finished)
+        else:
+            generated = sweep.map_tasks(sweep_task, tasks, int(args.workers), on_result=task_finished)
+    finally:
+        _sweep = None
+    for (job, k, seed, encode), result in zip(tasks, generated):
+        results[(job, k)] = result
+        if encode and result[4] is None:
+            run.cache.put(cache_keys[(job, k)], output_cache.encode(result[3], result[1]))
+    outputs = {}
+    source_ids = [run.dataset_writer.add_source(run.get_relative_path(source["root"], source["file"]), run.output_events(source, source["events"]))
+                  for source, model in sweep_jobs] if run.dataset_writer is not None else None
+    for (job, k), (output_paths, kept_scores, variations, encoded, error) in sorted(results.items()):
+        name = sweep_settings[k][0]
+        if error is not None:
+            source = sweep_jobs[job][0]
+            run.quarantine_file(source["root"], source["file"], "sweep " + name, error)
+            log.error('Error: File %s quarantined (%s): %s', os.path.join(source["root"], source["file"]), name, error)
+            run.metrics.count_file("quarantined")
+            continue
+        for temp_events in variations or []:
+            run.dataset_writer.add(temp_events, source_ids[job], k)
+        outputs.setdefault(name, []).extend(output_paths)
+        run.metrics.inc("variations_total", len(output_paths))
+        if kept_scores is not None:
+            run.summaries[job][1].setdefault("sweep", {})[name] = kept_scores
+    sweep.write_manifest(os.path.join(run.base_path_out_midi_out, "sweep_manifest.json"), args.sweep, sweep_settings, outputs)
+    log.info('Sweep: %d settings x %d files, manifest %s', len(sweep_settings), len(sweep_jobs), os.path.join(run.base_path_out_midi_out, "sweep_manifest.json"))
+
+def run_recombination(run, recombine_config, recombine_models):
+    ''' Generate the variations of each pair of a pitch source and a rhythm source, the models of the analysis are combined '''
+    pairs, missing = recombine.pairings(list(recombine_models), *recombine_config)
+    for pattern in missing:
+        log.warning('Warning: %s matches no midi file of the run', pattern)
+    run.metrics.set_total(len(pairs), "pairs")
+    outputs = []
+    for k, ((pitch_path, rhythm_path), name) in enumerate(zip(pairs, recombine.pair_names(pairs))):
+        run.metrics.tick(k)
+        (pitch_source, pitch_model), (rhythm_source, rhythm_model) = recombine_models[pitch_path], recombine_models[rhythm_path]
+        log.info('%s x %s', pitch_path, rhythm_path)
+        try:
+            events = recombine.combine_events(pitch_source["events"], rhythm_source["events"])
+            source = {"root": pitch_source["root"], "file": name, "suffix": "", "events": events,
+                      "quantize_report": None, "transposition": pitch_source["transposition"]}
+            output_paths, kept_scores = generate_source(run, source, riff_model.recombined(pitch_model, rhythm_model, events),
+                                                        os.path.join(run.base_path_out_midi_out, "recombine"), run.source_seed(source))
+        except Exception as error:
+            log.error('Error: Pair %s x %s failed: %s', pitch_path, rhythm_path, checkpoint.describe(error))
+            continue
+        outputs.append((pitch_path, rhythm_path, output_paths))
+    recombine.write_manifest(os.path.join(run.base_path_out_midi_out, "recombine_manifest.json"), run.args.recombine, outputs)
+    log.info('Recombination: %d pairs of %d analyzed files, manifest %s', len(outputs), len(recombine_models), os.path.join(run.base_path_out_midi_out, "recombine_manifest.json"))
+
+def finish(run):
+    ''' Save the summaries, the global statistics and the quarantine of the finished run and remove its checkpoint '''
+    args = run.args
+
+    # Save the per-file run summaries, the files with a failed write are quarantined before the global statistics are saved
+    run.write_summaries()
+    run.confirm_finished()
+    run.save_global_info()
+
+    if run.cache is not None:
+        stats = run.cache.stats()
+        log.info('Output cache: %d hits (%d in memory), %d misses, %d evictions, %d entries', stats["hits"], stats["memory_hits"], stats["misses"], stats["evictions"], stats["disk_entries"])
+    if run.cached_models is not None:
+        stats = run.cached_models.stats()
+        log.debug('Model cache: %d hits, %d misses (hit rate %.0f%%), %d invalidated, %d evictions, %.1f MB in %d models', stats["hits"], stats["misses"],
+                  100 * stats["hit_rate"], stats["invalidations"], stats["evictions"], stats["bytes"] / 1024 / 1024, stats["entries"])
+
+    if run.dataset_writer is not None:
+        run.dataset_writer.close()
+        log.info('Dataset: %d variations of %d files, %s', run.dataset_writer.num_of_variations, len(run.dataset_writer.sources), args.export_dataset)
+        run.dataset_writer = None # the watch mode doesn't export
+
+    run.writer.flush()
+
+    # The run is finished, save the quarantined files with their reasons
+    run.checkpoint.remove()
+    if len(run.quarantine) > 0:
+        run.quarantine.save(os.path.join(run.base_path_out_diagnostics, "quarantine.json"))
+        log.warning('Warning: %d files quarantined, see %s', len(run.quarantine), os.path.join(run.base_path_out_diagnostics, "quarantine.json"))
+    run.metrics.tick(run.metrics.total, force=True) # the final progress line and metrics file
+
+def watch(run, sources):
+    ''' Poll the midi files and their .md files, update only the changed sources and the global statistics (until Ctrl+C) '''
+    args = run.args
+    def watched_files(source):
+        return (os.path.join(source["root"], source["file"]),) + run.md_paths(source)
+
+    sources_by_path = {os.path.join(source["root"], source["file"]): source for source in sources}
+    last_state = corpus_io.snapshot([path for source in sources for path in watched_files(source)])
+    skipped = corpus_io.snapshot(path for path in (os.path.join(root, file) for root, file in filter(run.is_selected, corpus_io.discover(args.path))) if path not in sources_by_path) # midi files that are skipped until they change
+    log.info('Watching %s for changes (every %s seconds), press Ctrl+C to stop', args.path, args.watch_interval)
+    try:
+        while True:
+            time.sleep(float(args.watch_interval))
+            run.metrics.tick() # the metrics file of the watch mode stays fresh between updates
+            items = list(filter(run.is_selected, corpus_io.discover(args.path)))
+            midi_paths = set(os.path.join(root, file) for root, file in items)
+            candidates = [sources_by_path[path] if path in sources_by_path else {"root": root, "file": file, "suffix": run.get_suffix(root)}
+                          for path, (root, file) in zip([os.path.join(r, f) for r, f in items], items)]
+            state = corpus_io.snapshot([path for source in candidates for path in watched_files(source)])
+
+            # Removed midi files: subtract their counts
+            removed = [path for path in sources_by_path if path not in midi_paths]
+            for path in removed:
+                source = sources_by_path.pop(path)
+                run.global_counts.remove_file(run.get_relative_path(source["root"], source["file"]))
+                if run.cached_models is not None:
+                    run.cached_models.discard(run.get_relative_path(source["root"], source["file"]))
+                log.info('Removed %s', path)
+
+            # Changed or new midi files are read and analyzed again, changed .md files only regenerate the variations
+            changed = []
+            for candidate in candidates:
+                midi_path, *md_files = watched_files(candidate)
+                if midi_path not in sources_by_path and skipped.get(midi_path) == state.get(midi_path):
+                    continue
+                if midi_path not in sources_by_path or state.get(midi_path) != last_state.get(midi_path):
+                    log.info('Changed %s', midi_path)
+                    try:
+                        source = convert_source(run, candidate["root"], candidate["file"], MidiFile(midi_path), False)
+                    except (OSError, ValueError, EOFError) as error: # e.g. a file that is still being written
+                        log.error("Error: File " + midi_path + " can't be read: " + (str(error) or type(error).__name__))
+                        source = None
+                    if source is None:
+                        skipped[midi_path] = state.get(midi_path)
                         continue
+                    skipped.pop(midi_path, None)
+                    if args.detect_key:
+                        detect_keys([source])
+                    sources_by_path[midi_path] = source
+                    changed.append((source, True))
+                elif any(state.get(path) != last_state.get(path) for path in md_files):
+                    log.info('Changed %s', ", ".join(path for path in md_files if state.get(path) != last_state.get(path)))
+                    changed.append((candidate, False))
 
-                    array = util.midi_to_array(mid, args.quantization) # get the midi 'step array'
+            if changed or removed:
+                sources = list(sources_by_path.values())
+                index, neighbours = find_neighbours(args, sources)
+                position = {id(source): n for n, source in enumerate(sources)}
+                for source, analyze in changed:
+                    n = position[id(source)]
+                    summary_path = run.get_summary_path(source)
+                    summary, _ = run_source(run, n, source, analyze, index, neighbours[n])
+                    run.writer.submit(summary_path, diagnostics.write_summary, summary_path, summary)
+                run.save_global_info()
+                run.writer.flush()
+                log.info('Updated %d files, %d removed, %d files in the global statistics', len(changed), len(removed), len(run.global_counts))
 
-                    if not os.path.exists(out_dir_arrays):
-                        os.makedirs(out_dir_arrays)                
-                    if not os.path.exists(out_dir_midi_out):
-                        os.makedirs(out_dir_midi_out)
+            # Take the state after the update, so that the rewritten .md files don't count as changes
+            last_state = corpus_io.snapshot([path for source in sources_by_path.values() for path in watched_files(source)])
+    except KeyboardInterrupt:
+        log.info('Stopped watching')
 
-                    np.save(out_file_array, array) # Write or 'Save' the array to the out_file
-                elif os.path.exists(out_file_array):
-                    array = np.load(out_file_array) # load the cached file
-                else:
-                    print ("Error: File " + out_file_array + " not found.")
+def process(run):
+    ''' Read, analyze and generate the midi files of the run, then watch them with --watch '''
+    args = run.args
 
-                # Get output file path and save info to .md files
-                if (args.path == '' or args.path == 'midi_in'):
-                    suffix = root.split(args.path)[-1]
-                else:
-                    suffix = path_suffix.split(MIDI_IN_PATH)[-1]
-                out_dir_pitch_quantity = base_path_out_pitch_quantity + '/' + suffix
-                out_dir_rhythm_quantity = base_path_out_rhythm_quantity + '/' + suffix
-                out_dir_lock_steps = base_path_out_lock_steps + '/' + suffix
-
-                # Calculate midi info such as pitches and rhythms
-                if not args.use_cached:
-                    if not os.path.exists(out_dir_pitch_quantity):
-                        os.makedirs(out_dir_pitch_quantity)            
-                    if not os.path.exists(out_dir_rhythm_quantity):
-                        os.makedirs(out_dir_rhythm_quantity)
-                    if not os.path.exists(out_dir_lock_steps):
-                        os.makedirs(out_dir_lock_steps)
-
-                    util.__init__()
-                    pitch_info = util.calc_pitch_followers(array)
-                    util.calc_rhythm_intervals(array)
-
-                    global_pitch_info = util.merge_pitch_info(global_pitch_info, pitch_info)
-
-                    util.save_info(os.path.join(out_dir_pitch_quantity,file).replace(".mid",".md"), os.path.join(out_dir_rhythm_quantity,file).replace(".mid",".md"))
-
-                # Load info from cached files
-                elif args.use_cached and os.path.exists(os.path.join(out_dir_pitch_quantity,file).replace(".mid",".md")) and os.path.exists(out_dir_rhythm_quantity):
-                    # Info will be loaded in the 'for loop' below
-                    #util.load_info(os.path.join(out_dir_pitch_quantity,file).replace(".mid",".md"), os.path.join(out_dir_rhythm_quantity,file).replace(".mid",".md"))
-                    pass
-
-                for i in range(int(args.amount)):
-                    print()      
-                    util.__init__()           
-                    util.load_info(os.path.join(out_dir_pitch_quantity,file).replace(".mid",".md"), os.path.join(out_dir_rhythm_quantity,file).replace(".mid",".md"))
-                    if args.lock_steps and os.path.join(out_dir_lock_steps,file).replace(".mid",".md"):
-                        util.load_locks(os.path.join(out_dir_lock_steps,file).replace(".mid",".md"))                                   
-                    temp_array = util.notes_random_pitch_followers(array, float(args.random_notes))
-                    temp_array = util.notes_transpose (temp_array, float(args.transpose_algorithm), float(args.transpose_probability), args.transpose_same) # potentially correct notes that are followed by the same note by octaving them
-                    temp_array = util.notes_to_min_max (temp_array, int(args.note_min), int(args.note_max))
-                    temp_array = util.notes_random_rhythm_intervals(temp_array, float(args.random_rhythm))
-                    print()
-
-                    if DEBUG:
-                        util.print_array_notes(temp_array)
-                        util.print_pitch_followers(util.RawPitch.A)
-                        util.print_rhythm_info()
-
-                    mid = util.array_to_midi (temp_array, "Track1")
-                    output_file = file.split('.')
-                    output_file = output_file[0:len(output_file)-1]
-                    mid.save(os.path.join(out_dir_midi_out, "".join(output_file) + str(i+1) + ".mid"))
-
-    # Save global info
-    util.save_global_info(os.path.join(base_path_out_pitch_quantity,"global_pitch_quantity.md"), global_pitch_info)
+    # Read all midi files (or their cached note events) first, the key detection works on the whole corpus
+    sources = read_sources(run)
+
+    # Cluster the near-duplicate files before the analysis, the run processes or counts one file per cluster
+    if args.dedup != 'off':
+        sources = deduplicate(run, sources)
+
+    # Detect the key of all files at once and transpose them to C major (or A minor)
+    if args.detect_key:
+        detect_keys(sources)
+
+    index, neighbours = find_neighbours(args, sources)
+    sweep_settings = sweep.load_settings(args.sweep) if args.sweep is not None else None
+    recombine_config = recombine.load_config(args.recombine) if args.recombine is not None else None
+    if args.export_dataset is not None:
+        run.dataset_writer = dataset.DatasetWriter(args.export_dataset, run.grid)
+        if sweep_settings is None:
+            run.dataset_writer.add_setting(generation_parameters(args))
+        else:
+            for name, parameters in sweep_settings:
+                run.dataset_writer.add_setting(dict(generation_parameters(argparse.Namespace(**dict(vars(args), **parameters))), name=name))
+    sweep_jobs, recombine_models = process_sources(run, sources, index, neighbours, sweep_settings, recombine_config)
+
+    # Sweep: generate the variations of each source with each setting
+    if sweep_settings is not None:
+        run_sweep(run, sweep_settings, sweep_jobs)
+
+    # Recombination: the variations of each pair of a pitch source and a rhythm source
+    if recombine_config is not None:
+        run_recombination(run, recombine_config, recombine_models)
+
+    finish(run)
+
+    # Watch mode: update only the changed sources and the global statistics
+    if args.watch:
+        watch(run, sources)
+
+def main():
+    ''' Run the command line, returns the exit code (130 after Ctrl+C) '''
+    parser = make_parser()
+    args = parser.parse_args()
+    if args.sweep is not None and args.recombine is not None:
+        parser.error('--sweep and --recombine can not be combined')
+    log.set_level(args.log_level)
+    log.debug('Kernels: %s', kernels.BACKEND)
+    run = Run(args)
+    if args.output_cache is not None and args.seed is None:
+        log.warning('Warning: The output cache is only used with --seed, the variations of an unseeded run are random.')
+    if args.resume:
+        run.resume()
+    try:
+        process(run)
+    except KeyboardInterrupt:
+        resumable = args.sweep is None and args.recombine is None and int(args.checkpoint_every) > 0 # the checkpoint was saved
+        log.error('Interrupted' + (', continue the run with --resume' if resumable else ''))
+        return 130
+    run.writer.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+''' This script contains the reader and writer of the hand-editable .md files (pitch quantity, rhythm quantity and lock steps). '''
+
+import re
+from note_events import Grid
+
+# One data line of the pitch and the rhythm quantity files, e.g. "2 \t> 88\t = 4\t // D > E5"
+# Everything after the first '/' is a comment.
+QUANTITY_LINE = re.compile(r'^\s*([+-]?\d+)\s*>\s*([+-]?\d+)\s*=\s*([+-]?\d+)\s*(?:/.*)?$')
+# One line of the rhythm summary, e.g. "  Number of 8th notes = 35"
+RHYTHM_SUMMARY_LINE = re.compile(r'^\s*Number of (.+) notes\s*=\s*(\d+)\s*$')
+TOTAL_NOTES_LINE = re.compile(r'^\s*Total number of notes\s*=\s*(\d+)\s*$')
+# The unit of the step-based rhythms, e.g. "## Step > Multiples of 32th = Quantity // Comment"
+RHYTHM_UNIT_LINE = re.compile(r'^##\s*Step\s*>\s*Multiples of (\d+th)\b')
+
+PITCH_QUANTITY_HEADING = "# Desired pitch distribution probabilities\n"
+GLOBAL_PITCH_QUANTITY_HEADING = "# Global pitch distribution probabilities\n"
+PITCH_QUANTITY_COLUMNS = "## Pitch > Pitch-Follower = Quantity // Comment\n"
+RHYTHM_QUANTITY_HEADING = "# Desired rhythmic distribution probabilities\n"
+RHYTHM_STEP_HEADING = "\n# Desired rhythmic distribution probabilities (step-based)\n"
+RHYTHM_STEP_COLUMNS = "## Step > Multiples of %s = Quantity // Comment \n"
+LOCK_STEPS_HEADING = "# Lock certain steps\n## Steps to be locked, if any\n"
+
+class FormatError(ValueError):
+    ''' A line of a .md file can't be parsed, the message contains the file and line number '''
+    def __init__(self, path, line_number, line, expected):
+        self.path = path
+        self.line_number = line_number
+        self.line = line
+        super().__init__('{}:{}: malformed line {!r}, expected "{}"'.format(path, line_number, line, expected))
+
+def _read_lines(path, text=None):
+    ''' Returns the lines of the file, or of the text (e.g. given inline on the command line, path is only used in errors) '''
+    if text is not None:
+        return text.split('\n')
+    f = open(path, "rt", encoding="latin-1")
+    s = f.read() # read the complete file (till the end)
+    f.close()
+    return s.split('\n')
+
+def _is_skipped(line):
+    ''' Headings and empty lines carry no data '''
+    stripped = line.lstrip()
+    return stripped == '' or stripped.startswith('#')
+
+def read_pitch_quantity(path, num_raw_pitches=12, max_notes=128, text=None):
+    ''' Read a (global) pitch quantity file. Returns a list with the (pitch follower, quantity) tuples for each raw pitch, in file order. '''
+    pitch_followers = [[] for raw_pitch in range(num_raw_pitches)]
+    for line_number, line in enumerate(_read_lines(path, text), 1):
+        if _is_skipped(line):
+            continue
+        match = QUANTITY_LINE.match(line)
+        if match is None:
+            raise FormatError(path, line_number, line, "Pitch > Pitch-Follower = Quantity // Comment")
+        raw_pitch, pitch_follower, quantity = int(match.group(1)), int(match.group(2)), int(match.group(3))
+        if not 0 <= raw_pitch < num_raw_pitches or not 0 <= pitch_follower < max_notes:
+            raise FormatError(path, line_number, line, "Pitch (0-{}) > Pitch-Follower (0-{}) = Quantity".format(num_raw_pitches-1, max_notes-1))
+        pitch_followers[raw_pitch].append((pitch_follower, quantity))
+    return pitch_followers
+
+def read_rhythm_quantity(path, grid=None, text=None):
+    ''' Read a rhythm quantity file. Returns the total number of notes (or None), the rhythm summary {rhythm: quantity} and the
+        (step, rhythm, quantity) tuples of the step-based section in file order. Only the step-based section is required.
+        A file that was written for another grid than the given one (default 1/32) is rejected. '''
+    grid = grid if grid is not None else Grid()
+    num_of_notes = None
+    note_rhythms = {}
+    step_rhythms = []
+    start = False
+    multiple_suffix = "x" + grid.unit_name
+    for line_number, line in enumerate(_read_lines(path, text), 1):
+        if line.find("step-based") != -1:
+            start = True
+            continue
+        if start:
+            match = RHYTHM_UNIT_LINE.match(line)
+            if match is not None and match.group(1) != grid.unit_name:
+                raise FormatError(path, line_number, line, "Multiples of {} (the file was written for another quantization grid)".format(grid.unit_name))
+        if _is_skipped(line):
+            continue
+        if not start: # rhythm summary, informative only
+            match = TOTAL_NOTES_LINE.match(line)
+            if match is not None:
+                num_of_notes = int(match.group(1))
+                continue
+            match = RHYTHM_SUMMARY_LINE.match(line)
+            if match is not None:
+                name = match.group(1)
+                if name in grid.summary_values:
+                    note_rhythms[grid.summary_values[name]] = int(match.group(2))
+                    continue
+                if name.endswith(multiple_suffix) and name[:-len(multiple_suffix)].isdigit():
+                    note_rhythms[int(name[:-len(multiple_suffix)])] = int(match.group(2))
+                    continue
+            raise FormatError(path, line_number, line, "Number of <rhythm> notes = Quantity")
+        match = QUANTITY_LINE.match(line)
+        if match is None:
+            raise FormatError(path, line_number, line, "Step > Multiples of {} = Quantity // Comment".format(grid.unit_name))
+        step_rhythms.append((int(match.group(1)), int(match.group(2)), int(match.group(3))))
+    return num_of_notes, note_rhythms, step_rhythms
+
+def read_lock_steps(path, text=None):
+    ''' Read a lock steps file. Returns the locked steps in file order. '''
+    locked_steps = []
+    for line_number, line in enumerate(_read_lines(path, text), 1):
+        if _is_skipped(line):
+            continue
+        try:
+            locked_steps.append(int(line))
+        except ValueError:
+            raise FormatError(path, line_number, line, "Step") from None
+    return locked_steps
+
+def format_pitch_quantity(pitch_followers, raw_pitch_names, pitch_names, heading=PITCH_QUANTITY_HEADING):
+    ''' Returns the text of a pitch quantity file. pitch_followers contains a list of objects with pitch and quantity for each raw pitch. '''
+    lines = [heading, PITCH_QUANTITY_COLUMNS]
+    for raw_pitch in range(len(raw_pitch_names)):
+        raw_pitch_name = raw_pitch_names[raw_pitch]
+        for pitch_follower in pitch_followers[raw_pitch]:
+            lines.append("%d \t> %d\t = %d\t // %s > %s\n" % (raw_pitch, pitch_follower.pitch, pitch_follower.quantity, raw_pitch_name, pitch_names[pitch_follower.pitch]))
+    return "".join(lines)
+
+def rhythm_summary(note_rhythms, grid):
+    ''' Returns the (name, quantity) tuples of the rhythm summary, longest rhythm first. The named rhythms of the grid are always listed. '''
+    summary = []
+    for rhythm in sorted(set(grid.summary_names) | set(note_rhythms), reverse=True):
+        quantity = note_rhythms.get(rhythm, 0)
+        if rhythm in grid.summary_names:
+            summary.append((grid.summary_names[rhythm], quantity))
+        elif quantity > 0:
+            summary.append((str(rhythm) + "x" + grid.unit_name, quantity))
+    return summary
+
+def most_frequent_rhythm(row):
+    ''' Returns the rhythm with the highest quantity of a {rhythm: quantity} row, the shortest on a tie and 0 for an empty row '''
+    rhythm = 0
+    best = 0
+    for r in sorted(row):
+        if row[r] > best:
+            rhythm, best = r, row[r]
+    return rhythm
+
+def format_rhythm_quantity(num_of_notes, note_rhythms, rhythm_intervals_at_step, num_steps, grid):
+    ''' Returns the text of a rhythm quantity file. note_rhythms is the {rhythm: quantity} histogram, rhythm_intervals_at_step
+        the {rhythm: quantity} row of each known step. The most frequent rhythm of each of the num_steps steps is written. '''
+    lines = [RHYTHM_QUANTITY_HEADING, "  Total number of notes = %d\n" % num_of_notes]
+    for name, quantity in rhythm_summary(note_rhythms, grid):
+        lines.append("  Number of %s notes = %d\n" % (name, quantity))
+    lines.append(RHYTHM_STEP_HEADING)
+    lines.append(RHYTHM_STEP_COLUMNS % grid.unit_name)
+    for i in range(num_steps):
+        rhythm = most_frequent_rhythm(rhythm_intervals_at_step.get(i, {}))
+        lines.append("%d%s> %d%s= 1 // %s\n" % (i, " \t" if i < 10 else "\t", rhythm, " \t " if rhythm < 10 else "\t ", grid.rhythm_name(rhythm)))
+    return "".join(lines)
+
+def format_lock_steps(locked_steps):
+    ''' Returns the text of a lock steps file '''
+    return LOCK_STEPS_HEADING + "".join("%d\n" % step for step in locked_steps)
+
+def write_text(path, text):
+    ''' Write a complete .md file at once '''
+    f = open(path, "wt", encoding="latin-1")
+    f.write(text)
+    f.close()
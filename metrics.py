@@ -0,0 +1,166 @@
+''' This script contains the run metrics: counters, latency histograms, the progress line with ETA and the Prometheus text file.
+
+Updating a metric is a dictionary update under a lock (the files are written by background threads),
+so the metrics stay enabled in the hot loops. The progress line and the Prometheus file are only
+written by tick(), at most once per refresh interval.
+
+The Prometheus file is written atomically (temporary file + rename), so the textfile collector of the
+node exporter never reads a partial file, e.g. node_exporter --collector.textfile.directory=<dir of the file>.
+'''
+
+import os
+import time
+import threading
+import tempfile
+from diagnostics import log
+
+PREFIX = "midi_randomizer_"
+PROGRESS_INTERVAL = 2.0 # seconds between two progress lines
+# Upper bounds (seconds) of the latency histogram buckets, the last bucket is +Inf
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "files_total": ("counter", "Midi files by status (read, processed, quarantined, resumed, duplicate)"),
+    "variations_total": ("counter", "Written variations"),
+    "bytes_written_total": ("counter", "Bytes of the written midi files"),
+    "stage_seconds": ("histogram", "Latency of a stage (convert, analyze, generate, write) per midi file"),
+    "model_cache_requests_total": ("counter", "Model cache requests by result (hit, miss)"),
+    "model_cache_bytes": ("gauge", "Memory of the models in the model cache"),
+    "progress_ratio": ("gauge", "Processed part of the midi files (or sweep tasks) of the current phase"),
+    "eta_seconds": ("gauge", "Estimated seconds until the current phase is finished"),
+}
+
+def _labels(labels):
+    return "{" + ",".join('{}="{}"'.format(name, value) for name, value in labels) + "}" if labels else ""
+
+class Metrics:
+    ''' Counters and histograms by (name, labels), labels are a tuple of (name, value) tuples '''
+
+    def __init__(self, path=None, interval=10.0):
+        self.path = path # Prometheus text file, None = no file
+        self.interval = float(interval)
+        self.counters = {}
+        self.histograms = {} # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self.gauges = {} # (name, labels) -> value
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.total = 0 # midi files of the progress, 0 = unknown
+        self.done = 0
+        self.unit = "files"
+        self.last_progress = self.start
+        self.last_write = self.start
+
+    def inc(self, name, amount=1, labels=()):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, labels=()):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def count_file(self, status):
+        self.inc("files_total", 1, (("status", status),))
+
+    def observe(self, name, seconds, labels=()):
+        ''' Add a latency to the histogram '''
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            i = 0
+            while i < len(BUCKETS) and seconds > BUCKETS[i]:
+                i += 1
+            histogram[i] += 1
+            histogram[-1] += seconds
+
+    def time(self, stage):
+        ''' Returns a context manager that observes the latency of the stage '''
+        return _Timer(self, stage)
+
+    def set_total(self, total, unit="files"):
+        ''' Start the progress of a phase with the number of its midi files (or e.g. sweep tasks) '''
+        self.total, self.done, self.unit = total, 0, unit
+        self.phase_start = time.perf_counter()
+
+    def eta(self):
+        ''' Returns the estimated seconds until the phase is finished, None if unknown '''
+        if self.total <= 0 or self.done <= 0:
+            return None
+        return (time.perf_counter() - self.phase_start) / self.done * (self.total - self.done)
+
+    def tick(self, done=None, force=False):
+        ''' Update the progress and write the progress line and the Prometheus file if their interval has passed '''
+        if done is not None:
+            self.done = done
+        now = time.perf_counter()
+        if log.info_enabled and self.total > 1 and (force or now - self.last_progress >= PROGRESS_INTERVAL):
+            self.last_progress = now
+            eta = self.eta()
+            rate = self.done / max(now - self.phase_start, 1e-9)
+            log.info('Progress: %d/%d %s (%.0f%%), %.1f %s/s, %d variations, ETA %s', self.done, self.total, self.unit, 100.0 * self.done / self.total,
+                     rate, self.unit, self.counters.get(("variations_total", ()), 0), "-" if eta is None else "%d:%02d" % divmod(int(eta), 60))
+        if self.path is not None and (force or now - self.last_write >= self.interval):
+            self.last_write = now
+            self.write()
+
+    def format(self):
+        ''' Returns the metrics in the Prometheus text format '''
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(values)) for key, values in self.histograms.items())
+            gauges = sorted(self.gauges.items())
+        progress = [("progress_ratio", self.done / self.total if self.total > 0 else 0.0)]
+        eta = self.eta()
+        if eta is not None:
+            progress.append(("eta_seconds", eta))
+        lines, described = [], set()
+        def describe(name):
+            if name not in described:
+                described.add(name)
+                kind, text = HELP.get(name, ("untyped", name))
+                lines.append("# HELP {}{} {}".format(PREFIX, name, text))
+                lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append("{}{}{} {}".format(PREFIX, name, _labels(labels), value))
+        for (name, labels), values in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, count in zip([str(b) for b in BUCKETS] + ["+Inf"], values[:-1]):
+                cumulative += count
+                lines.append("{}{}_bucket{} {}".format(PREFIX, name, _labels(labels + (("le", bound),)), cumulative))
+            lines.append("{}{}_sum{} {}".format(PREFIX, name, _labels(labels), values[-1]))
+            lines.append("{}{}_count{} {}".format(PREFIX, name, _labels(labels), cumulative))
+        for (name, labels), value in gauges:
+            describe(name)
+            lines.append("{}{}{} {}".format(PREFIX, name, _labels(labels), value))
+        for name, value in progress:
+            describe(name)
+            lines.append("{}{} {}".format(PREFIX, name, value))
+        return "\n".join(lines) + "\n"
+
+    def write(self):
+        ''' Write the Prometheus text file atomically '''
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path), suffix='.tmp')
+        with os.fdopen(fd, "wt", encoding="utf-8") as f:
+            f.write(self.format())
+        os.replace(temp_path, self.path)
+
+class _Timer:
+    __slots__ = ('metrics', 'labels', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.labels = (("stage", stage),)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe("stage_seconds", time.perf_counter() - self.start, self.labels)
+        return False
@@ -0,0 +1,99 @@
+''' This script contains the model cache: the riff models of the sources, bounded by their size in bytes and evicted least recently used first.
+
+A model is derived from the source note events, its pitch_quantity and rhythm_quantity .md files,
+the optional lock_steps .md file and the events of the blended neighbours (see riff_model.load).
+The key is the source path and a hash of the events (already in memory) and of the state of the
+.md files (modification time and size, see checkpoint.file_state), so a repeated request for an
+unchanged source (e.g. in watch mode or for the hot riffs of a long-running process) neither reads
+nor parses the .md files: the analysis of the source (its summary and counts) is cached with the
+model. The .md files of a source that is analyzed again (e.g. a touched midi file) are written
+from its events, so its key doesn't depend on their state. An edited file is a miss. The cache
+keeps one model per source path: a new key of a path replaces (invalidates) the old entry.
+'''
+
+import sys
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import riff_model
+import checkpoint
+
+MAX_BYTES = 64 * 1024 * 1024
+
+def model_bytes(model):
+    ''' Returns the approximate memory of a model: its arrays and its lookup dictionaries '''
+    return (sum(getattr(model, name).nbytes for name in riff_model.ARRAYS)
+            + sys.getsizeof(model._follower_of_step) + sys.getsizeof(model._locked))
+
+def _hash_events(h, events):
+    for array in (events.steps, events.pitches, events.velocities):
+        h.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    h.update(repr((events.length, events.grid.quantization, events.grid.triplets)).encode('utf-8'))
+
+def make_key(events, paths, neighbours=(), analyzed=False):
+    ''' Returns the hex key of the source events, the state of the files (None = no file) and the neighbour events.
+        The .md files of an analyzed source were just written from its events, they are left out of the paths and keyed as analyzed. '''
+    h = hashlib.sha256()
+    _hash_events(h, events)
+    h.update(b'analyzed' if analyzed else b'loaded')
+    for path in paths:
+        h.update(repr(checkpoint.file_state(path) if path is not None else '-').encode('utf-8'))
+    for neighbour in neighbours:
+        _hash_events(h, neighbour)
+    return h.hexdigest()
+
+class ModelCache:
+    ''' LRU of the models by source path, with hit, miss, eviction and invalidation counters '''
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = int(max_bytes)
+        self.entries = OrderedDict() # path -> (key, model, analysis, size), least recently used first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove(self, path):
+        key, model, analysis, size = self.entries.pop(path)
+        self.size -= size
+
+    def get(self, path, key):
+        ''' Returns the model and the analysis of the source path cached with the key (see make_key), None if it isn't cached '''
+        entry = self.entries.get(path)
+        if entry is not None:
+            if entry[0] == key:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return entry[1], entry[2]
+            self._remove(path) # a file of the source changed
+            self.invalidations += 1
+        self.misses += 1
+        return None
+
+    def put(self, path, key, model, analysis=None):
+        ''' Cache the model and the analysis (e.g. summary and counts, small next to the model) of the source path with the key '''
+        if path in self.entries:
+            self._remove(path)
+        size = model_bytes(model)
+        if size <= self.max_bytes:
+            self.entries[path] = (key, model, analysis, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def discard(self, path):
+        ''' Remove the model of a source (e.g. a deleted midi file) '''
+        if path in self.entries:
+            self._remove(path)
+            self.invalidations += 1
+
+    def hit_rate(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests > 0 else 0.0
+
+    def stats(self):
+        ''' Returns the counters, the hit rate and the memory use '''
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "evictions": self.evictions,
+                "invalidations": self.invalidations, "bytes": self.size, "max_bytes": self.max_bytes, "entries": len(self.entries)}
@@ -0,0 +1,242 @@
+''' This script contains the event-based note representation and the quantization grid.
+
+A loop is stored as columns of its note on events (step, pitch, velocity) instead of a dense
+steps x 128 array, so memory and analysis cost scale with the number of notes and not with
+the resolution of the grid. Steps are counted in units of the grid (e.g. 1/32, 1/64 or
+1/96 = 1/32 with triplets).
+'''
+
+from math import log, floor, ceil
+import numpy as np
+from mido import MidiFile, MidiTrack, Message, MetaMessage
+
+class Grid:
+    ''' Quantization grid with 2**quantization steps per whole note (x3 when triplets are enabled) '''
+
+    def __init__(self, quantization=5, triplets=False):
+        self.quantization = int(quantization)
+        self.triplets = bool(triplets)
+        self.steps_per_whole = 2**self.quantization * (3 if self.triplets else 1)
+        self.unit_name = str(self.steps_per_whole) + "th" # e.g. 32th, the unit of the rhythm intervals
+        self.loop_steps = 8 * self.steps_per_whole # length of a 8 bar loop
+        self.max_break_time = 4 * self.steps_per_whole # maximum break time = 4 whole notes
+
+        # Rhythm names of the intervals that exist on this grid
+        self.summary_names = {}
+        for wholes, name in ((4, "long"), (2, "double"), (1, "whole")):
+            self.summary_names[wholes * self.steps_per_whole] = name
+        for division, name in ((2, "half"), (4, "4th"), (8, "8th"), (16, "16th"), (32, "32th"), (64, "64th"), (128, "128th"),
+                               (6, "4th triplet"), (12, "8th triplet"), (24, "16th triplet"), (48, "32th triplet")):
+            if self.steps_per_whole % division == 0:
+                self.summary_names[self.steps_per_whole // division] = name
+        self.summary_values = {name: interval for interval, name in self.summary_names.items()}
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and self.steps_per_whole == other.steps_per_whole
+
+    def __hash__(self):
+        return hash(self.steps_per_whole)
+
+    def __repr__(self):
+        return "Grid(quantization={}, triplets={})".format(self.quantization, self.triplets)
+
+    def rhythm_name(self, interval):
+        ''' Returns the name of a rhythm interval, e.g. "8th note" or "6x32th note" '''
+        if interval == 0:
+            return ""
+        if interval in self.summary_names:
+            return self.summary_names[interval] + " note"
+        return str(interval) + "x" + self.unit_name + " note"
+
+    def ticks_per_step(self, ticks_per_quarter):
+        ''' Returns the number of midi ticks per grid step '''
+        return ticks_per_quarter * 4 / self.steps_per_whole
+
+class NoteEvents:
+    ''' The note on events of a monophonic loop. Steps are sorted and unique, pitches are array indices (midi note + 12). '''
+
+    __slots__ = ('steps', 'pitches', 'velocities', 'length', 'grid')
+
+    def __init__(self, steps, pitches, velocities, length, grid):
+        self.steps = np.asarray(steps, dtype=np.int64)
+        self.pitches = np.asarray(pitches, dtype=np.int64)
+        self.velocities = np.asarray(velocities, dtype=np.int64)
+        self.length = int(length) # loop length in steps
+        self.grid = grid
+
+    def __len__(self):
+        return len(self.steps)
+
+    def copy(self):
+        return NoteEvents(self.steps.copy(), self.pitches.copy(), self.velocities.copy(), self.length, self.grid)
+
+    def set_events(self, events):
+        ''' Replace the events by a {step: (pitch, velocity)} dictionary '''
+        steps = sorted(events)
+        self.steps = np.array(steps, dtype=np.int64)
+        self.pitches = np.array([events[step][0] for step in steps], dtype=np.int64)
+        self.velocities = np.array([events[step][1] for step in steps], dtype=np.int64)
+
+    def to_dict(self):
+        ''' Returns the events as {step: (pitch, velocity)} dictionary '''
+        return dict(zip(self.steps.tolist(), zip(self.pitches.tolist(), self.velocities.tolist())))
+
+    @classmethod
+    def from_step_array(cls, step_array, grid=None):
+        ''' Convert a dense steps x 128 array (e.g. a cached .npy file) to events. The loudest note of a step is kept. '''
+        step_array = np.asarray(step_array)
+        steps, pitches = np.nonzero(step_array)
+        velocities = step_array[steps, pitches]
+        return _unique_steps(steps, pitches, velocities, len(step_array), grid if grid is not None else Grid())
+
+    def save(self, path):
+        ''' Save the events and the grid to a .npz file '''
+        np.savez(path, steps=self.steps, pitches=self.pitches, velocities=self.velocities,
+                 length=self.length, quantization=self.grid.quantization, triplets=self.grid.triplets)
+
+    @classmethod
+    def load(cls, path):
+        ''' Load the events from a .npz file written by save() '''
+        with np.load(path) as data:
+            grid = Grid(int(data['quantization']), bool(data['triplets']))
+            return cls(data['steps'], data['pitches'], data['velocities'], int(data['length']), grid)
+
+def _unique_steps(steps, pitches, velocities, length, grid):
+    ''' Keep one event per step: the highest velocity, the lowest pitch on a tie (same as np.argmax of the dense array) '''
+    order = np.lexsort((pitches, -velocities, steps))
+    steps, pitches, velocities = steps[order], pitches[order], velocities[order]
+    first = np.ones(len(steps), dtype=bool)
+    first[1:] = steps[1:] != steps[:-1]
+    return NoteEvents(steps[first], pitches[first], velocities[first], length, grid)
+
+def nearest_pow2(x):
+    ''' Normalize input to nearest power of 2, or midpoints between
+    consecutive powers of two. Round down when halfway between two
+    possibilities. '''
+
+    low = 2**int(floor(log(x, 2)))
+    high = 2**int(ceil(log(x, 2)))
+    mid = (low + high) / 2
+
+    if x < mid:
+        high = mid
+    else:
+        low = mid
+    if high - x < x - low:
+        nearest = high
+    else:
+        nearest = low
+    return nearest
+
+def get_note_track(mid):
+    ''' Given a MIDI object, return the first track with note events.'''
+
+    for i, track in enumerate(mid.tracks):
+        for msg in track:
+            if msg.type == 'note_on':
+                return i, track
+    raise ValueError(
+        'MIDI object does not contain any tracks with note messages.')
+
+def note_columns(track):
+    ''' Returns the cumulative tick, is note_on message, note and velocity columns of the note messages (note_on and note_off)
+        of a track. Also returns the cumulative tick of the last message. '''
+    times = np.array([msg.time for msg in track], dtype=np.int64)
+    cum_times = np.cumsum(times)
+    note_idx = [i for i, msg in enumerate(track) if msg.type == 'note_on' or msg.type == 'note_off']
+    notes = np.array([track[i].note for i in note_idx], dtype=np.int64)
+    velocities = np.array([track[i].velocity for i in note_idx], dtype=np.int64)
+    is_note_on = np.array([track[i].type == 'note_on' for i in note_idx], dtype=bool)
+    track_len_ticks = int(cum_times[-1]) if len(cum_times) > 0 else 0
+    return cum_times[note_idx], is_note_on, notes, velocities, track_len_ticks
+
+def midi_to_events(mid, grid, pitch_offset=12):
+    ''' Return the note on events of a 4/4 time signature, MIDI object on the given grid.
+
+    The number of steps is normalized to a power of 2 (or the midpoint between two powers of 2).
+    Note on events are truncated to the step they start in, later note events of the same
+    step and pitch replace earlier ones (a note on with velocity 0 clears the note).
+
+    Arguments:
+    mid -- MIDI object with a 4/4 time signature
+    grid -- The quantization grid
+    pitch_offset -- Offset of the array index relative to the midi note number '''
+
+    time_sig_msgs = [ msg for msg in mid.tracks[0] if msg.type == 'time_signature' ]
+    assert len(time_sig_msgs) == 1, 'No time signature found'
+    time_sig = time_sig_msgs[0]
+    assert time_sig.numerator == 4 and time_sig.denominator == 4, 'Not 4/4 time.'
+
+    _, track = get_note_track(mid)
+    ticks_per_quarter = mid.ticks_per_beat
+    ticks, is_note_on, notes, velocities, track_len_ticks = note_columns(track)
+    ticks, notes, velocities = ticks[is_note_on], notes[is_note_on], velocities[is_note_on]
+
+    num_steps = int(round(track_len_ticks / float(ticks_per_quarter) * grid.steps_per_whole / 4))
+    length = int(nearest_pow2(num_steps))
+
+    steps = (ticks * grid.steps_per_whole // (4 * ticks_per_quarter)).astype(np.int64)
+    pitches = notes + pitch_offset
+    inside = steps < length
+    steps, pitches, velocities = steps[inside], pitches[inside], velocities[inside]
+
+    # The last message of a step and pitch wins
+    keys = steps * 1024 + pitches
+    _, last = np.unique(keys[::-1], return_index=True)
+    last = len(keys) - 1 - last
+    steps, pitches, velocities = steps[last], pitches[last], velocities[last]
+    sounding = velocities > 0
+    return _unique_steps(steps[sounding], pitches[sounding], velocities[sounding], length, grid)
+
+def events_to_midi(events,
+                   name,
+                   pitch_offset=-12,
+                   midi_type=1,
+                   midi_ticks_per_quarter=480,
+                   midi_tempo=600000):
+    ''' Convert note events into a MIDI object. Each note lasts one step of the grid of the events.
+
+    Arguments:
+    events -- The note events
+    name -- Name of the track
+    pitch_offset -- Offset the pitch number relative to the array index.
+    midi_type -- Type of MIDI format.
+    midi_ticks_per_quarter -- The number of MIDI timesteps per quarter note. '''
+
+    mid = MidiFile(type=midi_type, ticks_per_beat=midi_ticks_per_quarter)
+    meta_track = MidiTrack()
+    note_track = MidiTrack()
+    mid.tracks.append(meta_track)
+    mid.tracks.append(note_track)
+
+    meta_track.append(MetaMessage('track_name', name=name, time=0))
+    meta_track.append(MetaMessage('time_signature',
+                                numerator=4,
+                                denominator=4,
+                                clocks_per_click=24,
+                                notated_32nd_notes_per_beat=8,
+                                time=0))
+    meta_track.append(MetaMessage('set_tempo', tempo=midi_tempo, time=0))
+    meta_track.append(MetaMessage('end_of_track', time=0))
+
+    ticks_per_quantum = events.grid.ticks_per_step(midi_ticks_per_quarter)
+
+    note_track.append(MetaMessage('track_name', name=name, time=0))
+    cumulative_events = []
+    for step, pitch in zip(events.steps.tolist(), events.pitches.tolist()):
+        cumulative_events.append(('note_on', pitch + pitch_offset, ticks_per_quantum * step))
+        cumulative_events.append(('note_off', pitch + pitch_offset, ticks_per_quantum * (step+1)))
+
+    # note_on events come before note_off events of the same time
+    cumulative_events.sort(
+        key=lambda msg: msg[2] if msg[0]=='note_on' else msg[2] + 0.5)
+    last_time = 0
+    for msg_type, pitch, time in cumulative_events:
+        note_track.append(Message(type=msg_type,
+                                channel=1,
+                                note=pitch,
+                                velocity=100,
+                                time=int(round(time)-round(last_time))))
+        last_time = time
+    note_track.append(MetaMessage('end_of_track', time=0))
+    return mid
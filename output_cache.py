@@ -0,0 +1,150 @@
+''' This script contains the output cache: the written midi files of a source and a setting, keyed by the content that determines them.
+
+The key is a hash of the source note events, the model (pitch followers, rhythms, locked steps),
+the generation parameters and the random seed, so a repeated request with the same inputs is
+served by reading the encoded midi files instead of generating them again. Without a seed the
+variations are random, so only seeded runs (main.py --seed) use the cache.
+
+Two tiers, both bounded by their size in bytes and evicted least recently used first:
+- memory: the entries of this process (e.g. the watch mode)
+- disk: one file per entry in <cache dir>/<first 2 hex digits of the key>/<key>.bin, its
+  modification time is the last use, so the order survives restarts
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from riff_model import ARRAYS
+
+VERSION = 2 # version of the generation, changes when a seed gives other variations (e.g. other random draws of the kernels)
+MEMORY_BYTES = 64 * 1024 * 1024
+DISK_BYTES = 512 * 1024 * 1024
+
+def derive_seed(seed, *parts):
+    ''' Returns a 64 bit seed of the run seed and e.g. the relative path of a source, so that each source has its own stable random sequence '''
+    digest = hashlib.sha256(json.dumps([seed] + [str(part) for part in parts]).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'little')
+
+def make_key(events, model, parameters, seed):
+    ''' Returns the hex key of the source note events, the model, the generation parameters (dictionary) and the seed '''
+    h = hashlib.sha256(b'v%d' % VERSION)
+    for array in (events.steps, events.pitches, events.velocities):
+        h.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+    h.update(json.dumps([events.length, events.grid.steps_per_whole, model.num_of_notes]).encode('utf-8'))
+    for name in ARRAYS:
+        h.update(name.encode('utf-8'))
+        h.update(np.ascontiguousarray(getattr(model, name), dtype=np.int64).tobytes())
+    h.update(json.dumps(parameters, sort_keys=True, default=str).encode('utf-8'))
+    h.update(str(seed).encode('utf-8'))
+    return h.hexdigest()
+
+def encode(files, kept_scores):
+    ''' Returns the entry bytes: a json header line (sizes of the files, scores of the kept variations) and the files '''
+    header = json.dumps({"sizes": [len(data) for data in files], "kept_scores": kept_scores}).encode('utf-8')
+    return b"\n".join([header, b"".join(files)])
+
+def decode(entry):
+    ''' Returns the files and the kept scores of the entry bytes '''
+    header, _, body = entry.partition(b"\n")
+    header = json.loads(header.decode('utf-8'))
+    files, offset = [], 0
+    for size in header["sizes"]:
+        files.append(body[offset:offset+size])
+        offset += size
+    return files, header["kept_scores"]
+
+class OutputCache:
+    ''' Memory and disk LRU of the cache entries, with hit and miss counters '''
+
+    def __init__(self, path, max_bytes=DISK_BYTES, memory_bytes=MEMORY_BYTES):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.memory_bytes = int(memory_bytes)
+        self.memory = OrderedDict() # key -> entry bytes, least recently used first
+        self.memory_size = 0
+        self.disk = OrderedDict() # key -> size of the file, least recently used first
+        self.disk_size = 0
+        self.hits = 0
+        self.memory_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        entries = []
+        if os.path.isdir(path):
+            for directory in os.scandir(path):
+                if directory.is_dir():
+                    for entry in os.scandir(directory.path):
+                        if entry.name.endswith('.bin'):
+                            stat = entry.stat()
+                            entries.append((stat.st_mtime_ns, entry.name[:-4], stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self.disk[key] = size
+            self.disk_size += size
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key + '.bin')
+
+    def _remember(self, key, entry):
+        ''' Put the entry to the memory tier, evict the least recently used entries '''
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        if len(entry) > self.memory_bytes:
+            return
+        self.memory[key] = entry
+        self.memory_size += len(entry)
+        while self.memory_size > self.memory_bytes:
+            self.memory_size -= len(self.memory.popitem(last=False)[1])
+
+    def get(self, key):
+        ''' Returns the entry bytes of the key, None on a miss '''
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            if key in self.disk:
+                self.disk.move_to_end(key)
+            self.hits += 1
+            self.memory_hits += 1
+            return entry
+        if key in self.disk:
+            try:
+                with open(self._file(key), 'rb') as f:
+                    entry = f.read()
+                os.utime(self._file(key)) # last use
+            except OSError: # removed by another process
+                self.disk_size -= self.disk.pop(key)
+            else:
+                self.disk.move_to_end(key)
+                self._remember(key, entry)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, key, entry):
+        ''' Store the entry bytes in both tiers, evict the least recently used files above the size limit '''
+        self._remember(key, entry)
+        path = self._file(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(entry)
+        os.replace(temp_path, path) # readers never see a partial entry
+        if key in self.disk:
+            self.disk_size -= self.disk.pop(key)
+        self.disk[key] = len(entry)
+        self.disk_size += len(entry)
+        while self.disk_size > self.max_bytes and len(self.disk) > 1:
+            old_key, size = self.disk.popitem(last=False)
+            self.disk_size -= size
+            self.evictions += 1
+            try:
+                os.remove(self._file(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        ''' Returns the counters and the sizes of both tiers '''
+        return {"hits": self.hits, "memory_hits": self.memory_hits, "misses": self.misses, "evictions": self.evictions,
+                "memory_bytes": self.memory_size, "disk_bytes": self.disk_size, "disk_entries": len(self.disk)}
@@ -0,0 +1,120 @@
+''' This script contains the ingest quantizer for unquantized midi files.
+
+The note messages of the note track are handled as columns (tick, note on/off, note, velocity).
+Note on and note off messages are paired per note in FIFO order, the note on ticks are moved
+towards the quantize grid by the given strength and snapped to the step grid of the analysis,
+the note off ticks keep the original note duration.
+'''
+
+import numpy as np
+from mido import MidiFile, MidiTrack
+import note_events
+
+class QuantizeReport:
+    ''' Statistics of a quantized track '''
+
+    def __init__(self, notes=0, moved=0, merged=0, unmatched=0):
+        self.notes = notes # number of note on events
+        self.moved = moved # notes whose start was moved
+        self.merged = merged # notes that start at the same step as a previous note (only one of them is kept by the analysis)
+        self.unmatched = unmatched # note on events without note off (ended at the end of the track) and note off events without note on (dropped)
+
+    def __str__(self):
+        return "Quantized {} notes: {} moved, {} merged, {} unmatched".format(self.notes, self.moved, self.merged, self.unmatched)
+
+    def to_dict(self):
+        return {"notes": self.notes, "moved": self.moved, "merged": self.merged, "unmatched": self.unmatched}
+
+def _rank_in_group(keys):
+    ''' Returns the index of each element among the elements with the same key (in the given order) '''
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    group_start = np.maximum.accumulate(np.where(starts, np.arange(len(keys)), 0))
+    rank = np.empty(len(keys), dtype=np.int64)
+    rank[order] = np.arange(len(keys)) - group_start
+    return rank
+
+def pair_notes(is_on, notes):
+    ''' Pair the note on and note off messages of the same note in FIFO order.
+        Returns the message indices of the note on events and of their note off events (-1 = no note off) and the number of unpaired note off events. '''
+    on_idx = np.nonzero(is_on)[0]
+    off_idx = np.nonzero(~is_on)[0]
+    # The n-th note on of a note belongs to the n-th note off of the same note
+    paired_off = np.full(len(on_idx), -1, dtype=np.int64)
+    if len(off_idx) == 0:
+        return on_idx, paired_off, 0
+    on_keys = notes[on_idx] * len(is_on) + _rank_in_group(notes[on_idx])
+    off_keys = notes[off_idx] * len(is_on) + _rank_in_group(notes[off_idx])
+    off_order = np.argsort(off_keys)
+    sorted_keys = off_keys[off_order]
+    pos = np.minimum(np.searchsorted(sorted_keys, on_keys), len(sorted_keys) - 1)
+    found = sorted_keys[pos] == on_keys
+    paired_off[found] = off_idx[off_order][pos[found]]
+    return on_idx, paired_off, len(off_idx) - int(np.count_nonzero(found))
+
+def quantize_ticks(ticks, ticks_per_quarter, grid, quantize_grid=None, strength=1.0, swing_tolerance=0.0):
+    ''' Returns the quantized note on ticks.
+
+    Arguments:
+    ticks -- Array of note on ticks
+    grid -- The step grid of the analysis, the result is always on this grid
+    quantize_grid -- The grid the notes are moved to (default: the step grid), e.g. a coarser grid
+    strength -- Fraction of the distance to the quantize grid that a note is moved (1.0 = onto the grid)
+    swing_tolerance -- Notes up to 0.5 + swing_tolerance quantize steps after a grid line are moved back to it (late/swung notes) '''
+    quantize_grid = quantize_grid if quantize_grid is not None else grid
+    ticks = np.asarray(ticks, dtype=np.float64)
+    quantize_step = quantize_grid.ticks_per_step(ticks_per_quarter)
+    target = np.maximum(np.floor(ticks / quantize_step - swing_tolerance + 0.5), 0) * quantize_step
+    moved = ticks + strength * (target - ticks)
+    step = grid.ticks_per_step(ticks_per_quarter)
+    return np.rint(np.rint(moved / step) * step).astype(np.int64)
+
+def quantize_track(track, ticks_per_quarter, grid, quantize_grid=None, strength=1.0, swing_tolerance=0.0):
+    ''' Return the quantized track and the QuantizeReport. All other messages keep their time. '''
+    ticks, is_note_on, notes, velocities, track_len_ticks = note_events.note_columns(track)
+    is_on = is_note_on & (velocities > 0)
+    on_idx, off_idx, unmatched_offs = pair_notes(is_on, notes)
+
+    on_ticks = ticks[on_idx]
+    off_ticks = np.where(off_idx >= 0, ticks[np.maximum(off_idx, 0)], track_len_ticks)
+    quantized_on = np.minimum(quantize_ticks(on_ticks, ticks_per_quarter, grid, quantize_grid, strength, swing_tolerance), track_len_ticks)
+    # The note off keeps the original duration of the note (at least one tick)
+    quantized_off = np.minimum(quantized_on + np.maximum(off_ticks - on_ticks, 1), track_len_ticks)
+
+    steps = (quantized_on * grid.steps_per_whole // (4 * ticks_per_quarter))
+    report = QuantizeReport(notes=len(on_idx),
+                            moved=int(np.count_nonzero(quantized_on != on_ticks)),
+                            merged=len(steps) - len(np.unique(steps)),
+                            unmatched=int(np.count_nonzero(off_idx < 0)) + unmatched_offs)
+
+    # Collect (cumulative time, order at the same time, message) of the quantized track
+    note_msgs = [msg for msg in track if msg.type == 'note_on' or msg.type == 'note_off']
+    cum_times = np.cumsum([msg.time for msg in track]).tolist()
+    timed = []
+    for i, msg in enumerate(track):
+        if not (msg.type == 'note_on' or msg.type == 'note_off'):
+            timed.append((cum_times[i], 3 if msg.type == 'end_of_track' else 1, msg))
+    for n, (on, off) in enumerate(zip(on_idx.tolist(), off_idx.tolist())):
+        timed.append((int(quantized_on[n]), 2, note_msgs[on])) # note on after the note off of the same time
+        if off >= 0:
+            timed.append((int(quantized_off[n]), 0, note_msgs[off]))
+        else:
+            timed.append((int(quantized_off[n]), 0, note_msgs[on].copy(velocity=0)))
+    timed.sort(key=lambda t: (t[0], t[1])) # stable, keeps the order of messages with the same time and kind
+
+    quantized_track = MidiTrack()
+    last_time = 0
+    for time, _, msg in timed:
+        quantized_track.append(msg.copy(time=time - last_time))
+        last_time = time
+    return quantized_track, report
+
+def quantize(mid, grid, quantize_grid=None, strength=1.0, swing_tolerance=0.0):
+    ''' Return a midi object whose note track is quantized and the QuantizeReport. The other tracks are shared with the input. '''
+    quantized_mid = MidiFile(type=mid.type, ticks_per_beat=mid.ticks_per_beat)
+    note_track_idx, note_track = note_events.get_note_track(mid)
+    quantized_mid.tracks.extend(mid.tracks)
+    quantized_mid.tracks[note_track_idx], report = quantize_track(note_track, mid.ticks_per_beat, grid, quantize_grid, strength, swing_tolerance)
+    return quantized_mid, report
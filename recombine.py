@@ -0,0 +1,85 @@
+''' This script contains the cross-source recombination: the pitch model of one source with the rhythm model of another one.
+
+The config file is a .json file with the pitch sources, the rhythm sources (glob patterns of the
+paths relative to the input path) and optionally the pairs, e.g.
+    {"pitch": ["leads/*.mid"], "rhythm": ["grooves/*.mid"]}
+    {"pairs": [["a.mid", "c.mid"], ["b.mid", "a.mid"]]}
+Without "pairs" every pitch source is paired with every rhythm source (except itself).
+
+Only the sources of the pairs are analyzed, each once, so N pitch and M rhythm sources cost N + M analyses, the pairs only
+combine the read-only arrays of the two models (see riff_model.recombined) and generate. The source
+of a pair has the rhythm (steps, velocities and loop length) of the rhythm source and the pitches
+of the pitch source in their order, repeated or cut to the number of notes of the rhythm source.
+'''
+
+import os
+import json
+import collections
+import fnmatch
+import numpy as np
+import note_events
+
+class ConfigError(ValueError):
+    ''' The recombination config file is invalid '''
+
+def load_config(path):
+    ''' Returns the pitch patterns, the rhythm patterns and the pairs (None = all pairs) of a config file '''
+    with open(path, "rt", encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config, dict) or (config.get("pairs") is None and (not config.get("pitch") or not config.get("rhythm"))):
+        raise ConfigError('{}: expected "pitch" and "rhythm" lists of midi files (glob patterns) or "pairs"'.format(path))
+    pairs = config.get("pairs")
+    if pairs is not None and not all(isinstance(pair, list) and len(pair) == 2 for pair in pairs):
+        raise ConfigError('{}: expected "pairs" as list of [pitch source, rhythm source]'.format(path))
+    return list(config.get("pitch", [])), list(config.get("rhythm", [])), [tuple(pair) for pair in pairs] if pairs is not None else None
+
+def _normalized(path):
+    return os.path.normpath(path).replace(os.sep, '/')
+
+def select(paths, patterns):
+    ''' Returns the paths (relative, in corpus order) that match one of the glob patterns '''
+    patterns = [_normalized(pattern) for pattern in patterns]
+    return [path for path in paths if any(fnmatch.fnmatchcase(_normalized(path), pattern) for pattern in patterns)]
+
+def pairings(paths, pitch_patterns, rhythm_patterns, pairs=None):
+    ''' Returns the (pitch source, rhythm source) pairs of the relative paths of the corpus and the paths of the config
+        that match no source (e.g. skipped files) '''
+    if pairs is not None:
+        known = set(_normalized(path) for path in paths)
+        by_name = {_normalized(path): path for path in paths}
+        missing = sorted(set(path for pair in pairs for path in pair if _normalized(path) not in known))
+        return [(by_name[_normalized(p)], by_name[_normalized(r)]) for p, r in pairs if _normalized(p) in known and _normalized(r) in known], missing
+    pitch_paths, rhythm_paths = select(paths, pitch_patterns), select(paths, rhythm_patterns)
+    missing = [pattern for pattern in pitch_patterns if not select(paths, [pattern])] + [pattern for pattern in rhythm_patterns if not select(paths, [pattern])]
+    return [(p, r) for p in pitch_paths for r in rhythm_paths if p != r], missing
+
+def pair_name(pitch_path, rhythm_path):
+    ''' Returns the file name of the source of a pair from the relative paths, e.g. "leads_a_x_grooves_b.mid" '''
+    stem = lambda path: _normalized(os.path.splitext(path)[0]).replace('/', '_')
+    return "{}_x_{}.mid".format(stem(pitch_path), stem(rhythm_path))
+
+def pair_names(pairs):
+    ''' Returns the file names of the pairs, pairs with the same file name are rejected (they would overwrite each other's files) '''
+    names = [pair_name(p, r) for p, r in pairs]
+    duplicates = sorted(name for name, count in collections.Counter(names).items() if count > 1)
+    if duplicates:
+        raise ConfigError('pairs with the same file name: {}'.format(", ".join(duplicates)))
+    return names
+
+def combine_events(pitch_events, rhythm_events):
+    ''' Returns the source of a pair: the rhythm of the rhythm source with the pitches of the pitch source '''
+    if pitch_events.grid != rhythm_events.grid:
+        raise ValueError('The pitch and rhythm sources must have the same quantization grid')
+    pitches = np.resize(pitch_events.pitches, len(rhythm_events)) if len(pitch_events) > 0 else np.zeros(len(rhythm_events), dtype=np.int64)
+    return note_events.NoteEvents(rhythm_events.steps.copy(), pitches, rhythm_events.velocities.copy(), rhythm_events.length, rhythm_events.grid)
+
+def write_manifest(path, config_path, outputs):
+    ''' Write the manifest of a recombination: the written files of each pair. outputs = [(pitch source, rhythm source, [files])] '''
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    manifest = {"config": config_path,
+                "pairs": [{"pitch": pitch, "rhythm": rhythm, "files": files} for pitch, rhythm, files in outputs]}
+    with open(path, "wt", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,60 @@
+''' Merge the partial global statistics of sharded runs (main.py --shard i/N or --manifest) into the global pitch quantity file and the binary global model. '''
+
+import os
+import argparse
+import aggregate
+from diagnostics import log
+import diagnostics
+
+
+if __name__ == "__main__":
+
+    # Argument parsing
+    parser = argparse.ArgumentParser(
+        description='Merge the partial aggregates of sharded runs into global_pitch_quantity.md and global_model.npz. \
+                     The result does not depend on the number of shards or the order of the partial aggregates.')
+    parser.add_argument(
+        'path',
+        default='aggregate',
+        nargs='?',
+        help='directory with the partial aggregates (.npz) of the shards')
+    parser.add_argument(
+        '--pitch-quantity',
+        dest='pitch_quantity',
+        default=os.path.join('pitch_quantity', 'global_pitch_quantity.md'),
+        help='global pitch quantity file to be written')
+    parser.add_argument(
+        '--model',
+        dest='model',
+        default=os.path.join('array', 'global_model.npz'),
+        help='binary global model to be written')
+    parser.add_argument(
+        '--log-level',
+        dest='log_level',
+        choices=sorted(diagnostics.LEVELS, key=diagnostics.LEVELS.get),
+        default='info',
+        help='amount of console output: quiet, warning, info (default) or debug')
+    args = parser.parse_args()
+    log.set_level(args.log_level)
+
+    merged = aggregate.Aggregate()
+    grid = None
+    for name in sorted(os.listdir(args.path)):
+        if name.split('.')[-1] != 'npz':
+            continue
+        partial, partial_grid = aggregate.Aggregate.load(os.path.join(args.path, name))
+        if grid is not None and partial_grid != grid:
+            raise SystemExit('Error: ' + name + ' was created with another quantization grid.')
+        grid = partial_grid
+        merged.merge(partial)
+        log.info('%s: %d files', name, len(partial))
+
+    if grid is None:
+        raise SystemExit('Error: No partial aggregates found in ' + args.path)
+
+    for path in (args.pitch_quantity, args.model):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+    merged.save_global_info(args.pitch_quantity)
+    merged.save_global_model(args.model, grid)
+    log.info('Merged %d files with %d notes', len(merged), merged.num_of_notes)
@@ -0,0 +1,508 @@
+''' This script contains the compact riff model and the variation generator.
+
+RiffModel holds the learned tables of one source (pitch followers, step-based rhythms, rhythm
+histogram, locked steps) as read-only numpy arrays. It is built once per source by the
+RiffModelBuilder and can be shared by any number of variations and threads. RiffGenerator
+is the small per-variation object: it owns the random number generator and the pitch
+sequence of the variation and never changes the model or the source events.
+
+The randomization algorithms are the same as the ones of Midi_Util (notes_random_pitch_followers,
+notes_transpose, notes_to_min_max and notes_random_rhythm_intervals), Midi_Util stays the
+reference (legacy) engine and the analysis that writes the .md files. The pitch follower chain
+and the rhythm walk run as kernels (see kernels.py) on uniform draws of the random number
+generator, so they draw other random numbers than Midi_Util for the same seed.
+'''
+
+import os
+import random
+from itertools import accumulate
+import numpy as np
+from diagnostics import log
+import md_format
+import note_events
+from midi_util import Midi_Util
+import kernels
+
+MAX_NOTES = 128 # highest midi note number (pitch G8)
+CMAJOR = [p + 7*12 for p in [0, 2, 4, 5, 7, 9, 11, 12, 14, 16, 17, 19, 21, 23]] # C major 2 octaves, shifted to octaves C5 and C6
+_CMAJOR = np.array(CMAJOR, dtype=np.int64)
+
+# Arrays of a RiffModel (all int64), e.g. the layout of the shared models and the content of the output cache key
+ARRAYS = ('follower_offsets', 'follower_pitches', 'follower_quantities', 'follower_cumulative',
+          'at_step_steps', 'at_step_followers',
+          'row_steps', 'row_offsets', 'row_rhythms', 'row_quantities', 'row_cumulative',
+          'transition_prev', 'transition_offsets', 'transition_rhythms', 'transition_quantities', 'transition_cumulative',
+          'rhythm_values', 'rhythm_cumulative',
+          'locked_steps')
+PITCH_ARRAYS = ('follower_offsets', 'follower_pitches', 'follower_quantities', 'follower_cumulative') # the pitch model of a recombination
+
+def _frozen(values, dtype=np.int64):
+    array = np.array(values, dtype=dtype)
+    array.setflags(write=False)
+    return array
+
+def _csr(rows):
+    ''' Returns the offsets and the concatenated (value, quantity) columns of a list of rows of (value, quantity) tuples '''
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(row) for row in rows])
+    values = [value for row in rows for value, quantity in row]
+    quantities = [quantity for row in rows for value, quantity in row]
+    return _frozen(offsets), _frozen(values), _frozen(quantities)
+
+def _table(rows):
+    ''' Returns the CSR arrays of a {key: {value: quantity}} table: the sorted keys, the offsets, the sorted values of each row,
+        their quantities and the cumulative quantities of each row (the sampler). '''
+    keys = sorted(rows)
+    items = [sorted(rows[key].items()) for key in keys]
+    offsets, values, quantities = _csr(items)
+    cumulative = _frozen([c for row in items for c in accumulate(q for _, q in row)])
+    return _frozen(keys), offsets, values, quantities, cumulative
+
+def transposed(pitch, transposition):
+    ''' Returns the pitch transposed by x semitones, or the pitch itself if the result is out of range. '''
+    if pitch + transposition > 0 and pitch + transposition < MAX_NOTES:
+        return pitch + transposition
+    return pitch
+
+def pitch_to_min_max(pitch, pitch_min, pitch_max):
+    ''' Returns the pitch transposed to be inside of min and max by using +- 12 semitones transposition.
+        A pitch is transposed down at most once, but up until it reaches the minimum. '''
+    while True:
+        if pitch > pitch_max and transposed(pitch, -12) != pitch:
+            return pitch - 12
+        if pitch < pitch_min and transposed(pitch, +12) != pitch:
+            pitch += 12
+            continue
+        return pitch
+
+class RiffModel:
+    ''' The read-only tables of one source. Rows are stored as offsets into flat value and quantity arrays (CSR). '''
+
+    __slots__ = ('grid', 'num_of_notes',
+                 'follower_offsets', 'follower_pitches', 'follower_quantities', 'follower_cumulative',
+                 'at_step_steps', 'at_step_followers', '_follower_of_step',
+                 'row_steps', 'row_offsets', 'row_rhythms', 'row_quantities', 'row_cumulative',
+                 'transition_prev', 'transition_offsets', 'transition_rhythms', 'transition_quantities', 'transition_cumulative',
+                 'rhythm_values', 'rhythm_cumulative',
+                 'locked_steps', '_locked', '_tables', '_frozen')
+
+    def __init__(self, grid, num_of_notes, followers, followers_at_step, rhythm_rows, rhythm_transitions, note_rhythms, locked_steps):
+        self.grid = grid
+        self.num_of_notes = num_of_notes
+
+        # Pitch followers of each raw pitch in the order they were found, cumulative quantities for the weighted choice
+        self.follower_offsets, self.follower_pitches, self.follower_quantities = _csr(followers)
+        self.follower_cumulative = _frozen([c for row in followers for c in accumulate(q for _, q in row)])
+
+        # Pitch that follows the note of the source at a step
+        self.at_step_steps = _frozen(sorted(followers_at_step))
+        self.at_step_followers = _frozen([followers_at_step[step] for step in sorted(followers_at_step)])
+        self._follower_of_step = dict(followers_at_step)
+
+        # Rhythm rows of the known steps (step-based) and of the known previous rhythms (Markov), rhythms sorted
+        self.row_steps, self.row_offsets, self.row_rhythms, self.row_quantities, self.row_cumulative = _table(rhythm_rows)
+        (self.transition_prev, self.transition_offsets, self.transition_rhythms, self.transition_quantities,
+         self.transition_cumulative) = _table(rhythm_transitions)
+
+        # Rhythm histogram (file-based rhythms), rhythms sorted
+        self.rhythm_values = _frozen(sorted(note_rhythms))
+        self.rhythm_cumulative = _frozen(np.cumsum([note_rhythms[r] for r in sorted(note_rhythms)]))
+
+        self.locked_steps = _frozen(sorted(locked_steps))
+        self._locked = frozenset(self.locked_steps.tolist())
+        self._tables = None
+        self._frozen = True
+
+    @classmethod
+    def from_arrays(cls, grid, num_of_notes, arrays):
+        ''' Returns a model of read-only arrays that were built before (e.g. views of a shared memory segment, see shared_model.py).
+            Only the lookup dictionaries are built again. '''
+        model = cls.__new__(cls)
+        object.__setattr__(model, 'grid', grid)
+        object.__setattr__(model, 'num_of_notes', num_of_notes)
+        for name, array in arrays.items():
+            object.__setattr__(model, name, array)
+        object.__setattr__(model, '_follower_of_step', dict(zip(model.at_step_steps.tolist(), model.at_step_followers.tolist())))
+        object.__setattr__(model, '_locked', frozenset(model.locked_steps.tolist()))
+        object.__setattr__(model, '_tables', None)
+        object.__setattr__(model, '_frozen', True)
+        return model
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("RiffModel is read-only")
+        object.__setattr__(self, name, value)
+
+    def has_rhythms(self):
+        ''' Returns True if the rhythm histogram is not empty '''
+        return len(self.rhythm_cumulative) > 0 and int(self.rhythm_cumulative[-1]) > 0
+
+    def followers(self, raw_pitch):
+        ''' Returns the (pitch, quantity) tuples of the followers of a raw pitch '''
+        start, end = self.follower_offsets[raw_pitch], self.follower_offsets[raw_pitch+1]
+        return list(zip(self.follower_pitches[start:end].tolist(), self.follower_quantities[start:end].tolist()))
+
+    def is_locked(self, steps):
+        ''' Returns the mask of the locked steps '''
+        return np.array(self._locked_list(np.asarray(steps, dtype=np.int64).tolist()), dtype=bool)
+
+    def _followers_list(self, steps):
+        get = self._follower_of_step.get
+        return [get(step, -1) for step in steps]
+
+    def _locked_list(self, steps):
+        locked = self._locked
+        return [step in locked for step in steps] if locked else [False] * len(steps)
+
+    def tables(self):
+        ''' Returns the arrays of the model and the C major pitches in the input format of the kernels (see kernels.as_input), converted once '''
+        if self._tables is None:
+            tables = {name: kernels.as_input(getattr(self, name)) for name in ARRAYS}
+            tables['cmajor'] = kernels.as_input(_CMAJOR)
+            object.__setattr__(self, '_tables', tables)
+        return self._tables
+
+    def print_rhythm_info(self):
+        ''' Prints the rhythm information of the model. '''
+        print ("Rhythm information")
+        print ("  Total number of notes = " + str(self.num_of_notes))
+        note_rhythms = dict(zip(self.rhythm_values.tolist(), np.diff(self.rhythm_cumulative, prepend=0).tolist()))
+        for name, quantity in md_format.rhythm_summary(note_rhythms, self.grid):
+            print ("  Number of " + name + " notes = " + str(quantity))
+        print ()
+
+    def print_pitch_followers(self, raw_pitch):
+        ''' Prints the pitch followers of a certain raw pitch. '''
+        raw_pitch_name = Midi_Util.RawPitchNames[raw_pitch]
+        print(raw_pitch_name + " followers")
+        for pitch, quantity in self.followers(raw_pitch):
+            print ("  " + raw_pitch_name + " is followed by " + Midi_Util.PitchNames[pitch] + " with quantity " + str(quantity))
+        print()
+
+class RiffModelBuilder:
+    ''' Collects the tables of a model, build() returns the read-only RiffModel '''
+
+    def __init__(self, grid=None):
+        self.grid = grid if grid is not None else note_events.Grid()
+        self.followers = [[] for raw_pitch in range(12)] # [pitch, quantity] lists of each raw pitch
+        self.followers_at_step = {}
+        self.rhythm_rows = {} # step -> {rhythm: quantity}
+        self.rhythm_transitions = {} # previous rhythm -> {rhythm: quantity}
+        self.note_rhythms = {} # rhythm -> quantity
+        self.locked_steps = set()
+        self.num_of_notes = 0
+
+    def add_follower(self, pitch, follower, quantity=1):
+        ''' Count a follower of the raw pitch of a certain pitch '''
+        row = self.followers[pitch % 12]
+        for entry in row:
+            if entry[0] == follower:
+                entry[1] += quantity
+                return
+        row.append([follower, quantity])
+
+    def add_pitch_followers(self, events):
+        ''' Count the pitch followers of the note events, the last note is followed by the first one (same as Midi_Util.calc_pitch_followers) '''
+        self.set_followers_at_step(events)
+        self.add_follower_counts(events)
+
+    def add_follower_counts(self, events):
+        ''' Add the follower counts of the note events, new followers of a raw pitch are appended in the order they are found '''
+        if len(events) == 0:
+            return
+        counts, first = kernels.follower_counts(events.pitches)
+        raw_pitches, followers = np.nonzero(counts)
+        order = np.lexsort((first[raw_pitches, followers], raw_pitches))
+        for raw_pitch, follower in zip(raw_pitches[order].tolist(), followers[order].tolist()):
+            self.add_follower(raw_pitch, follower, int(counts[raw_pitch, follower]))
+
+    def set_followers_at_step(self, events):
+        ''' Save the pitch that follows the note at each step of the note events '''
+        pitches = events.pitches.tolist()
+        for i, step in enumerate(events.steps.tolist()):
+            self.followers_at_step[step] = pitches[(i+1) % len(pitches)]
+
+    def add_rhythm_intervals(self, events):
+        ''' Count the rhythms of the note events, each rhythm of a step is known once (same as Midi_Util.calc_rhythm_intervals) '''
+        steps = events.steps.tolist()
+        for last_step, step in zip(steps, steps[1:]):
+            rhythm = step - last_step
+            self.note_rhythms[rhythm] = self.note_rhythms.get(rhythm, 0) + 1
+            self.rhythm_intervals_row(last_step)[rhythm] = 1
+        self.add_rhythm_transitions(events)
+        self.num_of_notes += len(steps)
+
+    def add_rhythm_transitions(self, events):
+        ''' Count which rhythm follows which rhythm in the note events '''
+        rhythms = np.diff(events.steps).tolist()
+        for last_rhythm, rhythm in zip(rhythms, rhythms[1:]):
+            row = self.rhythm_transitions.setdefault(last_rhythm, {})
+            row[rhythm] = row.get(rhythm, 0) + 1
+
+    def add_neighbour(self, events):
+        ''' Blend the pitch followers and the step-based rhythms of a similar source into the model, the quantities of a step add up '''
+        self.add_follower_counts(events)
+        steps = events.steps.tolist()
+        for last_step, step in zip(steps, steps[1:]):
+            rhythm = step - last_step
+            self.note_rhythms[rhythm] = self.note_rhythms.get(rhythm, 0) + 1
+            row = self.rhythm_intervals_row(last_step)
+            row[rhythm] = row.get(rhythm, 0) + 1
+        self.add_rhythm_transitions(events)
+
+    def rhythm_intervals_row(self, step):
+        return self.rhythm_rows.setdefault(step, {})
+
+    def load_info(self, pitch_quantity_path, rhythm_quantity_path):
+        ''' Add the pitch followers and the step-based rhythms of the .md files '''
+        self.add_pitch_quantity(md_format.read_pitch_quantity(pitch_quantity_path, 12, MAX_NOTES))
+        self.add_step_rhythms(md_format.read_rhythm_quantity(rhythm_quantity_path, self.grid)[2])
+
+    def add_pitch_quantity(self, pitch_quantity):
+        ''' Add the (pitch follower, quantity) tuples of each raw pitch, e.g. of md_format.read_pitch_quantity '''
+        for raw_pitch, pitch_followers in enumerate(pitch_quantity):
+            for pitch_follower, quantity in pitch_followers:
+                self.add_follower(raw_pitch, pitch_follower, quantity)
+
+    def add_step_rhythms(self, step_rhythms):
+        ''' Add the (step, rhythm, quantity) tuples of the step-based rhythms, e.g. of md_format.read_rhythm_quantity '''
+        for step, rhythm, quantity in step_rhythms:
+            row = self.rhythm_intervals_row(step)
+            row[rhythm] = row.get(rhythm, 0) + quantity
+
+    def load_locks(self, lock_steps_path):
+        ''' Add the locked steps of a .md file '''
+        self.locked_steps.update(md_format.read_lock_steps(lock_steps_path))
+
+    def build(self):
+        return RiffModel(self.grid, self.num_of_notes,
+                         [[(pitch, quantity) for pitch, quantity in row] for row in self.followers],
+                         self.followers_at_step, self.rhythm_rows, self.rhythm_transitions, self.note_rhythms, self.locked_steps)
+
+def load(events, pitch_quantity_path, rhythm_quantity_path, lock_steps_path=None, neighbours=()):
+    ''' Returns the generation model of a source: the .md files (which may be edited by the user), the blended neighbours,
+        the rhythms and the followers at each step of the source note events. '''
+    builder = RiffModelBuilder(events.grid)
+    builder.load_info(pitch_quantity_path, rhythm_quantity_path)
+    if lock_steps_path is not None:
+        builder.load_locks(lock_steps_path)
+    for neighbour in neighbours:
+        builder.add_neighbour(neighbour)
+    builder.add_rhythm_intervals(events)
+    builder.set_followers_at_step(events)
+    return builder.build()
+
+def recombined(pitch_model, rhythm_model, events):
+    ''' Returns the model of a recombined source (see recombine.py): the pitch followers of the pitch model, the rhythms, locked steps
+        and number of notes of the rhythm model and the followers at the steps of the recombined events. No table is copied. '''
+    if pitch_model.grid != rhythm_model.grid:
+        raise ValueError('The pitch and rhythm models must have the same quantization grid')
+    arrays = {name: getattr(pitch_model if name in PITCH_ARRAYS else rhythm_model, name) for name in ARRAYS}
+    arrays['at_step_steps'] = _frozen(events.steps)
+    arrays['at_step_followers'] = _frozen(np.roll(events.pitches, -1))
+    return RiffModel.from_arrays(rhythm_model.grid, rhythm_model.num_of_notes, arrays)
+
+def save_model(model, file):
+    ''' Write the binary model blob (.npz of the arrays, the grid and the number of notes) to a path or a binary file object.
+        A path is written as given (np.savez would append .npz to it). '''
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'wb') as f:
+            save_model(model, f)
+        return
+    np.savez(file, quantization=model.grid.quantization, triplets=model.grid.triplets, num_of_notes=model.num_of_notes,
+             **{name: getattr(model, name) for name in ARRAYS})
+
+def load_model(file):
+    ''' Returns the model of a binary model blob written by save_model (path or binary file object) '''
+    with np.load(file) as data:
+        grid = note_events.Grid(int(data['quantization']), bool(data['triplets']))
+        return RiffModel.from_arrays(grid, int(data['num_of_notes']), {name: _frozen(data[name]) for name in ARRAYS})
+
+class RiffGenerator:
+    ''' Per-variation state: the random number generator and the pitch sequence. The model and the source events are not changed. '''
+
+    __slots__ = ('model', 'rng', 'pitch_sequence')
+
+    def __init__(self, model, rng=None):
+        self.model = model
+        self.rng = rng if rng is not None else random.Random()
+        self.pitch_sequence = []
+
+    def _draws(self, n):
+        ''' Returns n uniform draws of the random number generator for a kernel '''
+        random = self.rng.random
+        return kernels.as_input([random() for _ in range(n)])
+
+    def random_follower(self, pitch, by_quantity=False):
+        ''' Randomly returns one of the followers of the raw pitch of the pitch, None if there are none '''
+        model = self.model
+        start, end = int(model.follower_offsets[pitch % 12]), int(model.follower_offsets[pitch % 12 + 1])
+        if end <= start:
+            return None
+        if by_quantity:
+            return self._weighted_row(model.follower_pitches, model.follower_cumulative, start, end)
+        return int(model.follower_pitches[start + self.rng.randint(0, end - start - 1)])
+
+    def _weighted_row(self, values, cumulative, start, end):
+        ''' Weighted choice inside of a CSR row, the cumulative quantities restart at each row '''
+        total = int(cumulative[end-1])
+        if total <= 0:
+            return None
+        r = self.rng.randint(0, total-1)
+        return int(values[start + int(np.searchsorted(cumulative[start:end], r, side='right'))])
+
+    def random_pitch_followers(self, events, random_algorithm):
+        ''' Randomly pitch up or down notes by using one of the transpose algorithms (see Midi_Util.notes_random_pitch_followers) '''
+        if random_algorithm == 0: # no random
+            log.info ("  Random notes: no randomization")
+            return events
+        elif random_algorithm > 0 and random_algorithm <= 1: # 0 - 1 randomize by choosing one of the pitch followers (file-based)
+            log.info ("  Random notes: choose random followers (file-based)")
+        elif random_algorithm > 1 and random_algorithm <= 2: # 1 - 2 randomize by choosing C major random between C5 and C6
+            log.info ("  Random notes: choose random followers of C major")
+        elif random_algorithm > 2 and random_algorithm <= 3: # 2 - 3 randomiize by choosing one of the pitch followers (file-based) and by using each of their quantities
+            log.info ("  Random notes: choose random followers by quantity (file-based)")
+        else:
+            return events
+
+        # Only steps with a note on event, a pitch without followers is kept
+        tables = self.model.tables()
+        pitches, velocities = kernels.as_input(events.pitches.copy()), kernels.as_input(events.velocities.copy())
+        kernels.pitch_followers(pitches, velocities, kernels.as_input(self.model._locked_list(events.steps.tolist())), float(random_algorithm),
+                                tables['follower_offsets'], tables['follower_pitches'], tables['follower_cumulative'], tables['cmajor'], self._draws(2 * len(pitches)))
+        events.pitches, events.velocities = np.asarray(pitches, dtype=np.int64), np.asarray(velocities, dtype=np.int64)
+        return events
+
+    def transpose(self, events, transpose_algorithm, transpose_probability, transpose_same=False):
+        ''' Transpose notes in the note events in octaves by using one of the transpose algorithms (see Midi_Util.notes_transpose) '''
+        rng = self.rng
+        if transpose_algorithm == 0: # no transpose
+            log.info ("  Transposition: no transposition")
+            return events
+        elif transpose_algorithm > 0 and transpose_algorithm <= 1: # 0 - 1 transpose down when followed by same
+            if transpose_same:
+                log.info ("  Transposition: -1 octave when followed by same and transpose-same = %s", transpose_same)
+            else:
+                log.info ("  Transposition: -1 octave when followed by same")
+        elif transpose_algorithm > 1 and transpose_algorithm <= 2: # 1 - 2 random transpose notes by +1 octave
+            if transpose_same:
+                log.info ("  Transposition: random transpose notes by +1 octave and transpose-same = %s", transpose_same)
+            else:
+                log.info ("  Transposition: random transpose notes by +1 octave")
+        elif transpose_algorithm > 2 and transpose_algorithm <= 3: # 2 - 3 random transpose notes by -1 octave
+            if transpose_same:
+                log.info ("  Transposition: random transpose notes by -1 octave and transpose-same = %s", transpose_same)
+            else:
+                log.info ("  Transposition: random transpose notes by -1 octave")
+        elif transpose_algorithm > 3 and transpose_algorithm <= 4: # 3 - 4 random transpose notes by +-1 octave
+            if transpose_same:
+                log.info ("  Transposition: random transpose notes by +-1 octave and transpose-same = %s", transpose_same)
+            else:
+                log.info ("  Transposition: random transpose notes by +-1 octave")
+        else:
+            return events
+
+        pitches, steps = events.pitches.tolist(), events.steps.tolist()
+        locked = self.model._locked_list(steps)
+        followers = self.model._followers_list(steps)
+        for i in range(len(pitches)):
+            if locked[i]:
+                continue
+            pitch = pitches[i]
+            followed_by_same = followers[i] == pitch
+            if transpose_algorithm <= 1:
+                if followed_by_same:
+                    if transpose_same or rng.random() < transpose_probability:
+                        pitches[i] = transposed(pitch, -12) # transpose down
+            elif transpose_algorithm <= 2:
+                if transpose_same and followed_by_same: # transpose same
+                    if rng.random() + 1 >= transpose_algorithm:
+                        pitches[i] = transposed(pitch, -12) # transpose down
+                    else:
+                        pitches[i] = transposed(pitch, +12) # transpose up
+                elif rng.random() < transpose_probability:
+                    if rng.random() + 1 >= transpose_algorithm:
+                        if followed_by_same:
+                            pitches[i] = transposed(pitch, -12) # transpose down
+                    else:
+                        pitches[i] = transposed(pitch, +12) # transpose up
+            elif transpose_algorithm <= 3:
+                if transpose_same and followed_by_same: # transpose same
+                    rng.random() # unused draw of a legacy branch (both outcomes transposed down), keeps the random sequence of the legacy engine
+                    pitches[i] = transposed(pitch, -12) # transpose down
+                elif rng.random() < transpose_probability:
+                    if rng.random() + 2 >= transpose_algorithm:
+                        if followed_by_same:
+                            pitches[i] = transposed(pitch, -12) # transpose down
+                    else:
+                        pitches[i] = transposed(pitch, -12) # transpose down
+            else:
+                if transpose_same and followed_by_same: # transpose same
+                    rng.random() # unused draw of a legacy branch (both outcomes transposed down), keeps the random sequence of the legacy engine
+                    pitches[i] = transposed(pitch, -12) # transpose down
+                elif rng.random() < transpose_probability:
+                    rng.random() # unused draw of a legacy branch (both outcomes transposed down), keeps the random sequence of the legacy engine
+                    pitches[i] = transposed(pitch, -12) # transpose down
+        events.pitches = np.array(pitches, dtype=np.int64)
+        return events
+
+    def to_min_max(self, events, pitch_min, pitch_max):
+        ''' Transposes notes in the note events to be inside of min and max by using +- 12 semitones transposition '''
+        outside = np.flatnonzero((events.pitches < pitch_min) | (events.pitches > pitch_max)).tolist() # the other notes don't change
+        if not outside:
+            return events
+        pitches = events.pitches.tolist()
+        locked = self.model._locked_list(events.steps.tolist())
+        for i in outside:
+            if not locked[i]:
+                pitches[i] = pitch_to_min_max(pitches[i], pitch_min, pitch_max)
+        events.pitches = np.array(pitches, dtype=np.int64)
+        return events
+
+    def random_rhythm_intervals(self, events, random_algorithm):
+        ''' Randomly change the rhythm intervals inside the midi pattern (see Midi_Util.notes_random_rhythm_intervals) '''
+
+        # Get the exact pitch sequence and use it as base for the rhythm randomization
+        self.pitch_sequence.extend(p for p in events.pitches.tolist() if p > 0)
+
+        if random_algorithm == 0: # no random
+            log.info ("  Random rhythm: no randomization")
+            return events
+        elif random_algorithm > 0 and random_algorithm <= 1: # 0 - 1 randomize by choosing one of the found rhythms (file-based)
+            log.info ("  Random rhythm: choose random rhythm (file-based)")
+        elif random_algorithm > 1 and random_algorithm <= 2: # 1 - 2 randomize by choosing file random by (rhythm-)quantity.md (step-based)
+            log.info ("  Random rhythm: choose random rhythm (step-based)")
+        elif random_algorithm > 2 and random_algorithm <= 3: # 2 - 3 randomize by choosing a rhythm that followed the last rhythm in the source (Markov)
+            log.info ("  Random rhythm: choose random rhythm (follows the last rhythm)")
+        else:
+            return events
+        if len(self.pitch_sequence) == 0 or (random_algorithm <= 1 and not self.model.has_rhythms()):
+            return events # nothing to choose from
+
+        # clear all note on events, except the locked ones, and walk through the loop with random rhythms:
+        # file-based, step-based or Markov (the rhythms that follow the last rhythm), unknown rhythms are filled with file-based ones
+        # The walk draws for about as many rhythms as the source has notes and is continued until the end of the loop
+        tables = self.model.tables()
+        locked = self.model.is_locked(events.steps)
+        notes = dict(zip(events.steps[locked].tolist(), zip(events.pitches[locked].tolist(), events.velocities[locked].tolist())))
+        pitch_sequence = self.pitch_sequence
+        notes[0] = (pitch_sequence[0], 100)
+        state, finished = (0, 0, 0), False # step, index in the pitch sequence, last rhythm
+        while not finished:
+            count, steps, sequence, *state, finished = kernels.rhythm_walk(events.length, float(random_algorithm), tables['rhythm_values'], tables['rhythm_cumulative'],
+                                                                          tables['row_steps'], tables['row_offsets'], tables['row_rhythms'], tables['row_cumulative'],
+                                                                          tables['transition_prev'], tables['transition_offsets'], tables['transition_rhythms'], tables['transition_cumulative'],
+                                                                          tables['locked_steps'], self._draws(2 * (len(events) + 1)), *state)
+            for step, seq_counter in zip(kernels.as_list(steps[:count]), kernels.as_list(sequence[:count])):
+                notes[step] = (pitch_sequence[seq_counter % len(pitch_sequence)], 100)
+        events.set_events(notes)
+        return events
+
+    def generate(self, events, random_notes, transpose_algorithm, transpose_probability, transpose_same, note_min, note_max, random_rhythm):
+        ''' Returns a new variation of the source note events, the source is not changed '''
+        variation = events.copy()
+        variation = self.random_pitch_followers(variation, random_notes)
+        variation = self.transpose(variation, transpose_algorithm, transpose_probability, transpose_same) # potentially correct notes that are followed by the same note by octaving them
+        variation = self.to_min_max(variation, note_min, note_max)
+        variation = self.random_rhythm_intervals(variation, random_rhythm)
+        return variation
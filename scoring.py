@@ -0,0 +1,83 @@
+''' This script contains the quality scoring of a batch of variations and the best-of-N selection.
+
+All variations of a batch are scored at once on their note events (before they are converted
+to midi and written): the notes of the batch are concatenated into flat columns with the index
+of their variation, so each metric is a few bincounts instead of a loop over the variations.
+
+Metrics (each between 0 and 1):
+- entropy: normalized pitch class entropy of the variation
+- interval_distance: total variation distance of the melodic interval histogram to the source
+- rhythm_distance: total variation distance of the rhythm histogram to the source
+- range: fraction of the notes inside of note min and note max
+- similarity: fraction of the (step, pitch) notes that the variation and the source share
+'''
+
+import numpy as np
+import corpus_index
+
+# Weights of the combined score. Close to the source style (entropy, intervals, rhythms, range), but not a copy of it.
+WEIGHTS = {"entropy": 1.0, "interval": 1.0, "rhythm": 1.0, "range": 1.0, "novelty": 1.0}
+
+def _flat(events_list):
+    ''' Returns the variation index, step and pitch columns of all notes of the batch '''
+    lengths = [len(events) for events in events_list]
+    ids = np.repeat(np.arange(len(events_list)), lengths)
+    if sum(lengths) == 0:
+        return ids, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return ids, np.concatenate([events.steps for events in events_list]), np.concatenate([events.pitches for events in events_list])
+
+def _distributions(histograms):
+    totals = histograms.sum(axis=1, keepdims=True).astype(np.float64)
+    return np.divide(histograms, totals, out=np.zeros(histograms.shape), where=totals > 0)
+
+def pitch_class_entropy(events_list):
+    ''' Returns the entropy of the pitch class histogram of each variation, normalized to 0 - 1 (1 = all 12 pitch classes equally often) '''
+    ids, steps, pitches = _flat(events_list)
+    p = _distributions(np.bincount(ids * 12 + pitches % 12, minlength=len(events_list) * 12).reshape(len(events_list), 12))
+    terms = np.where(p > 0, -p * np.log(np.where(p > 0, p, 1)), 0)
+    return terms.sum(axis=1) / np.log(12)
+
+def histogram_distance(histograms, reference):
+    ''' Returns the total variation distance (0 - 1) of each histogram row to the reference histogram '''
+    return 0.5 * np.abs(_distributions(histograms) - _distributions(np.atleast_2d(reference))).sum(axis=1)
+
+def range_compliance(events_list, note_min, note_max):
+    ''' Returns the fraction of the notes of each variation inside of note min and note max (1 for an empty variation) '''
+    ids, steps, pitches = _flat(events_list)
+    inside = np.bincount(ids, weights=(pitches >= note_min) & (pitches <= note_max), minlength=len(events_list))
+    counts = np.bincount(ids, minlength=len(events_list))
+    return np.divide(inside, counts, out=np.ones(len(events_list)), where=counts > 0)
+
+def source_similarity(events_list, source):
+    ''' Returns the number of notes (step and pitch) that each variation shares with the source, relative to the longer of both '''
+    ids, steps, pitches = _flat(events_list)
+    source_keys = source.steps * 128 + source.pitches
+    shared = np.bincount(ids, weights=np.isin(steps * 128 + pitches, source_keys), minlength=len(events_list))
+    longer = np.maximum(np.bincount(ids, minlength=len(events_list)), len(source))
+    return np.divide(shared, longer, out=np.zeros(len(events_list)), where=longer > 0)
+
+def score_batch(events_list, source, note_min=0, note_max=127):
+    ''' Returns the metrics of each variation of the batch and the combined "score" as dictionary of arrays '''
+    entropy = pitch_class_entropy(events_list)
+    source_entropy = pitch_class_entropy([source])[0]
+    metrics = {
+        "entropy": entropy,
+        "interval_distance": histogram_distance(corpus_index.interval_histograms(events_list), corpus_index.interval_histograms([source])),
+        "rhythm_distance": histogram_distance(corpus_index.rhythm_histograms(events_list), corpus_index.rhythm_histograms([source])),
+        "range": range_compliance(events_list, note_min, note_max),
+        "similarity": source_similarity(events_list, source),
+    }
+    metrics["score"] = (WEIGHTS["entropy"] * (1 - np.abs(entropy - source_entropy))
+                        + WEIGHTS["interval"] * (1 - metrics["interval_distance"])
+                        + WEIGHTS["rhythm"] * (1 - metrics["rhythm_distance"])
+                        + WEIGHTS["range"] * metrics["range"]
+                        + WEIGHTS["novelty"] * (1 - metrics["similarity"])) / sum(WEIGHTS.values())
+    return metrics
+
+def best(scores, k):
+    ''' Returns the indices of the k highest scores, best first (the earlier variation on a tie) '''
+    scores = np.asarray(scores)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.argsort(-scores, kind='stable')[:k]
@@ -0,0 +1,90 @@
+''' This script contains the distribution of the riff models to worker processes through one shared memory segment.
+
+The parent process copies the arrays of all models into one segment with a fixed layout: the
+arrays of a model follow each other, each array starts at a multiple of 8 bytes. The handle
+(segment name, grid and the offset and length of each array) is small and picklable, a worker
+attaches to the segment and builds its models as read-only views of the segment, without copying
+the arrays and without reading .md files.
+
+The parent owns the segment: SharedModels unlinks it when the with block ends (also on errors and
+Ctrl+C) or at exit. If the parent is killed, the resource tracker of multiprocessing unlinks it.
+Workers never unlink the segment.
+'''
+
+import atexit
+import sys
+import numpy as np
+from multiprocessing import shared_memory
+import note_events
+from riff_model import RiffModel, ARRAYS
+
+ITEM_SIZE = np.dtype(np.int64).itemsize
+
+def _layout(models):
+    ''' Returns the size of the segment and the (offset, length) of each array of each model '''
+    layout, offset = [], 0
+    for model in models:
+        arrays = {}
+        for name in ARRAYS:
+            length = len(getattr(model, name))
+            arrays[name] = (offset, length)
+            offset += length * ITEM_SIZE
+        layout.append(arrays)
+    return max(offset, 1), layout
+
+class SharedModels:
+    ''' A shared memory segment with the arrays of the models. The handle is passed to the workers. '''
+
+    def __init__(self, models):
+        models = list(models)
+        grids = set((model.grid.quantization, model.grid.triplets) for model in models)
+        if len(grids) > 1:
+            raise ValueError('The shared models must have the same quantization grid')
+        size, layout = _layout(models)
+        self.segment = shared_memory.SharedMemory(create=True, size=size)
+        atexit.register(self.close)
+        try:
+            for model, arrays in zip(models, layout):
+                for name, (offset, length) in arrays.items():
+                    np.ndarray(length, dtype=np.int64, buffer=self.segment.buf, offset=offset)[:] = getattr(model, name)
+        except BaseException:
+            self.close()
+            raise
+        grid = grids.pop() if grids else (note_events.Grid().quantization, False)
+        self.handle = (self.segment.name, grid, [(model.num_of_notes, arrays) for model, arrays in zip(models, layout)])
+
+    def close(self):
+        ''' Release and remove the segment (only once) '''
+        if self.segment is not None:
+            segment, self.segment = self.segment, None
+            atexit.unregister(self.close)
+            segment.close()
+            segment.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+_attached = [] # segments of this (worker) process, they stay open as long as their models may be used
+
+def attach(handle):
+    ''' Returns the models of the handle of a SharedModels as read-only views of the segment '''
+    name, (quantization, triplets), models = handle
+    if sys.version_info >= (3, 13):
+        segment = shared_memory.SharedMemory(name=name, track=False)
+    else:
+        segment = shared_memory.SharedMemory(name=name) # the workers share the resource tracker of the parent, it already knows the segment
+    _attached.append(segment)
+    grid = note_events.Grid(quantization, triplets)
+    result = []
+    for num_of_notes, arrays in models:
+        views = {}
+        for array_name, (offset, length) in arrays.items():
+            view = np.ndarray(length, dtype=np.int64, buffer=segment.buf, offset=offset)
+            view.setflags(write=False)
+            views[array_name] = view
+        result.append(RiffModel.from_arrays(grid, num_of_notes, views))
+    return result
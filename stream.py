@@ -0,0 +1,263 @@
+''' Randomize midi files of a stream (stdin) and write the variations to a stream (stdout), for shell pipelines.
+
+No files or directories are written (no .npy, .md or midi_out/ artifacts), the midi files are
+converted in memory. The input is one midi file, a tar stream of midi files or a length-prefixed
+stream (see below). The variations are written as a tar stream (<name><i>.mid like main.py) or as
+a length-prefixed stream: for each variation a 4 byte big-endian length and the midi file.
+
+The model of each source is its analysis, like main.py without .md files. The pitch followers,
+the step-based rhythms and the locked steps can be given inline in the format of the .md files
+(";" separates lines), or a binary model blob (--save-model, riff_model.save_model) is used for
+all sources.
+
+Examples:
+    python stream.py --amount 4 --random-notes 1 < riff.mid > variations.tar
+    tar cf - pack/*.mid | python stream.py --output lp --seed 7 | render
+'''
+
+import io
+import os
+import sys
+import struct
+import random
+import tarfile
+import zipfile
+import argparse
+from mido import MidiFile
+import note_events
+import md_format
+import riff_model
+import scoring
+import output_cache
+import checkpoint
+from diagnostics import log
+import diagnostics
+
+LENGTH = struct.Struct('>I') # length prefix of a midi file
+
+def read_length_prefixed(stream):
+    ''' Yields the midi files (bytes) of a length-prefixed stream '''
+    while True:
+        header = stream.read(LENGTH.size)
+        if not header:
+            return
+        if len(header) < LENGTH.size:
+            raise EOFError('Truncated length prefix')
+        size, = LENGTH.unpack(header)
+        data = stream.read(size)
+        if len(data) < size:
+            raise EOFError('Truncated midi file of {} bytes'.format(size))
+        yield data
+
+def read_sources(stream, input_format, name):
+    ''' Yields (name, midi file bytes) of the input stream: smf (one midi file), tar, lp (length-prefixed) or auto (smf or tar) '''
+    if input_format == 'auto':
+        input_format = 'smf' if stream.peek(4)[:4] == b'MThd' else 'tar'
+    if input_format == 'smf':
+        yield name, stream.read()
+    elif input_format == 'lp':
+        for i, data in enumerate(read_length_prefixed(stream)):
+            yield "{}_{}.mid".format(name.rsplit('.', 1)[0], i + 1), data
+    else:
+        with tarfile.open(fileobj=stream, mode='r|*') as tar:
+            for member in tar:
+                if member.isfile() and member.name.split('.')[-1] == 'mid':
+                    yield member.name, tar.extractfile(member).read()
+
+class TarOutput:
+    ''' Writes the variations as tar stream '''
+
+    def __init__(self, stream):
+        self.tar = tarfile.open(fileobj=stream, mode='w|')
+
+    def add(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = 0 # a fixed time, the same input and seed give the same stream
+        self.tar.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self.tar.close()
+
+class LengthPrefixedOutput:
+    ''' Writes the variations as length-prefixed stream '''
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def add(self, name, data):
+        self.stream.write(LENGTH.pack(len(data)))
+        self.stream.write(data)
+
+    def close(self):
+        self.stream.flush()
+
+def to_events(data, grid):
+    ''' Returns the note events of a midi file (bytes), raises ValueError if the midi file is not 4/4 '''
+    mid = MidiFile(file=io.BytesIO(data))
+    time_sig_msgs = [msg for msg in mid.tracks[0] if msg.type == 'time_signature']
+    if len(time_sig_msgs) != 1:
+        raise ValueError('No time signature')
+    if not (time_sig_msgs[0].numerator == 4 and time_sig_msgs[0].denominator == 4):
+        raise ValueError('Time signature not 4/4')
+    return note_events.midi_to_events(mid, grid)
+
+def inline_lines(text):
+    ''' Returns the text of an inline .md option, ";" separates lines '''
+    return text.replace(';', '\n')
+
+def read_inline(args, grid):
+    ''' Returns the pitch quantity, the step-based rhythms and the locked steps of the inline options (None if not given),
+        raises md_format.FormatError for a malformed line '''
+    pitch_quantity = md_format.read_pitch_quantity('--pitch-quantity', 12, riff_model.MAX_NOTES, inline_lines(args.pitch_quantity)) if args.pitch_quantity is not None else None
+    step_rhythms = md_format.read_rhythm_quantity('--rhythm-quantity', grid, inline_lines(args.rhythm_quantity))[2] if args.rhythm_quantity is not None else None
+    lock_steps = md_format.read_lock_steps('--lock-steps', inline_lines(args.lock_steps)) if args.lock_steps is not None else None
+    return pitch_quantity, step_rhythms, lock_steps
+
+def build_model(events, pitch_quantity=None, step_rhythms=None, lock_steps=None):
+    ''' Returns the model of the source: the inline pitch quantity or step-based rhythms (see read_inline) replace the ones of the analysis '''
+    builder = riff_model.RiffModelBuilder(events.grid)
+    if pitch_quantity is not None:
+        builder.add_pitch_quantity(pitch_quantity)
+    else:
+        builder.add_follower_counts(events)
+    if step_rhythms is not None:
+        builder.add_step_rhythms(step_rhythms)
+    if lock_steps is not None:
+        builder.locked_steps.update(lock_steps)
+    builder.add_rhythm_intervals(events)
+    builder.set_followers_at_step(events)
+    return builder.build()
+
+def generate(events, model, args, rng):
+    ''' Returns the variations of the source, the best --keep-best of them if it is set '''
+    variations = []
+    for i in range(int(args.amount)):
+        generator = riff_model.RiffGenerator(model, rng)
+        variations.append(generator.generate(events, float(args.random_notes), float(args.transpose_algorithm), float(args.transpose_probability),
+                                             args.transpose_same, int(args.note_min), int(args.note_max), float(args.random_rhythm)))
+    if int(args.keep_best) > 0:
+        scores = scoring.score_batch(variations, events, int(args.note_min), int(args.note_max))
+        variations = [variations[k] for k in scoring.best(scores["score"], int(args.keep_best)).tolist()]
+    return variations
+
+def to_bytes(events):
+    buffer = io.BytesIO()
+    note_events.events_to_midi(events, "Track1").save(file=buffer)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+
+    # Argument parsing
+    parser = argparse.ArgumentParser(
+        description='Randomize the midi files of stdin (one midi file, a tar stream or a length-prefixed stream) and write the variations \
+                     to stdout (tar or length-prefixed stream), without temporary files. The options have the same meaning as in main.py.')
+    parser.add_argument(
+        '--input',
+        dest='input',
+        default='auto',
+        choices=['auto', 'smf', 'tar', 'lp'],
+        help='format of stdin: one midi file (smf), a tar stream, a length-prefixed stream (lp) or auto (smf or tar, default)')
+    parser.add_argument(
+        '--output',
+        dest='output',
+        default='tar',
+        choices=['tar', 'lp'],
+        help='format of stdout: tar stream of <name><i>.mid (default) or length-prefixed stream (4 byte big-endian length and the midi file of each variation)')
+    parser.add_argument(
+        '--name',
+        dest='name',
+        default='stdin.mid',
+        help='name of the midi file of stdin (smf, lp), used for the output names and the seed')
+    parser.add_argument(
+        '--model',
+        dest='model',
+        default=None,
+        help='binary model blob (see --save-model) used for all sources instead of their analysis')
+    parser.add_argument(
+        '--save-model',
+        dest='save_model',
+        default=None,
+        help='write the binary model blob of the first source to this file')
+    parser.add_argument(
+        '--pitch-quantity',
+        dest='pitch_quantity',
+        default=None,
+        help='inline pitch followers in the format of the pitch_quantity .md files, e.g. "0 > 62 = 3; 2 > 64 = 1"')
+    parser.add_argument(
+        '--rhythm-quantity',
+        dest='rhythm_quantity',
+        default=None,
+        help='inline step-based rhythms in the format of the rhythm_quantity .md files, e.g. "# step-based; 0 > 4 = 2; 4 > 8 = 1"')
+    parser.add_argument(
+        '--lock-steps',
+        dest='lock_steps',
+        default=None,
+        help='inline locked steps in the format of the lock_steps .md files, e.g. "0; 64"')
+    parser.add_argument('--quantization', dest='quantization', default=5, help='quantization grid 2^n per whole note (default 5 = 1/32)')
+    parser.add_argument('--triplets', dest='triplets', action='store_true', help='triplet grid')
+    parser.add_argument('--amount', dest='amount', default=1, help='number of variations of each midi file')
+    parser.add_argument('--keep-best', dest='keep_best', default=0, help='0 = write all variations (default), k > 0 write only the best k of them')
+    parser.add_argument('--random-notes', dest='random_notes', default=0, help='pitch randomization algorithm (0 - 3)')
+    parser.add_argument('--random-rhythm', dest='random_rhythm', default=0, help='rhythm randomization algorithm (0 - 3)')
+    parser.add_argument('--note-min', dest='note_min', default=0, help='lowest note of the variations')
+    parser.add_argument('--note-max', dest='note_max', default=127, help='highest note of the variations')
+    parser.add_argument('--transpose-algorithm', dest='transpose_algorithm', default=0, help='transpose algorithm (0 - 2)')
+    parser.add_argument('--transpose-probability', dest='transpose_probability', default=0, help='transpose probability (0 - 100)')
+    parser.add_argument('--transpose-same', dest='transpose_same', action='store_true', help='transpose notes of the same pitch the same way')
+    parser.add_argument('--seed', dest='seed', type=int, default=None, help='random seed, each midi file gets its own random sequence of the seed and its name')
+    parser.add_argument(
+        '--log-level',
+        dest='log_level',
+        choices=sorted(diagnostics.LEVELS, key=diagnostics.LEVELS.get),
+        default='warning',
+        help='amount of console output on stderr: quiet, warning (default), info or debug')
+    parser.set_defaults(triplets=False)
+    parser.set_defaults(transpose_same=False)
+    args = parser.parse_args()
+    log.stream = sys.stderr # stdout is the output stream
+    log.set_level(args.log_level)
+
+    grid = note_events.Grid(args.quantization, args.triplets)
+    try:
+        inline = read_inline(args, grid)
+    except md_format.FormatError as error:
+        parser.error(str(error))
+    shared = None
+    if args.model is not None:
+        try:
+            shared = riff_model.load_model(args.model)
+        except OSError as error:
+            parser.error('can not read the model blob %s: %s' % (args.model, checkpoint.describe(error)))
+        except (ValueError, KeyError, zipfile.BadZipFile): # not an .npz file or not the arrays of save_model
+            parser.error('%s is not a model blob written by --save-model' % args.model)
+    rng = random.Random()
+    output = TarOutput(sys.stdout.buffer) if args.output == 'tar' else LengthPrefixedOutput(sys.stdout.buffer)
+    failed = 0
+    num_of_sources = 0
+    try:
+        for name, data in read_sources(sys.stdin.buffer, args.input, args.name):
+            num_of_sources += 1
+            try:
+                events = to_events(data, grid)
+                model = shared if shared is not None else build_model(events, *inline)
+                if args.save_model is not None and num_of_sources == 1:
+                    riff_model.save_model(model, args.save_model)
+                seed = output_cache.derive_seed(args.seed, name) if args.seed is not None else None
+                variations = generate(events, model, args, random.Random(seed) if seed is not None else rng)
+            except Exception as error: # the other midi files of the stream continue
+                log.error('Error: %s skipped: %s', name, checkpoint.describe(error))
+                failed += 1
+                continue
+            stem = name.rsplit('.', 1)[0]
+            for i, temp_events in enumerate(variations):
+                output.add(stem + str(i + 1) + ".mid", to_bytes(temp_events))
+            log.info('%s: %d variations', name, len(variations))
+        output.close()
+    except BrokenPipeError: # the reader of stdout stopped (e.g. head), the rest of the output is dropped
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    if args.save_model is not None and num_of_sources > 1:
+        log.warning('Warning: %s is the model of the first of %d midi files', args.save_model, num_of_sources)
+    sys.exit(1 if failed else 0)
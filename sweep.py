@@ -0,0 +1,80 @@
+''' This script contains the parameter sweep: the generation settings of a config file and the parallel fan-out of the generation.
+
+The config file is a .json file with a list of settings and/or a grid whose cartesian product is used, e.g.
+    {"grid": {"random_notes": [1, 3], "random_rhythm": [0, 2]},
+     "settings": [{"random_notes": 2, "note_min": 60, "note_max": 84}]}
+Parameters that are not given keep the value of the command line.
+'''
+
+import os
+import json
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Generation parameters (argparse dest names) that can be swept, the analysis is shared by all settings
+PARAMETERS = ('random_notes', 'random_rhythm', 'transpose_algorithm', 'transpose_probability', 'transpose_same',
+              'note_min', 'note_max', 'amount', 'keep_best', 'guided', 'target_density', 'target_distance')
+
+class ConfigError(ValueError):
+    ''' The sweep config file is invalid '''
+
+def _check(parameters, path):
+    unknown = sorted(set(parameters) - set(PARAMETERS))
+    if unknown:
+        raise ConfigError('{}: unknown parameters {}, expected some of {}'.format(path, ", ".join(unknown), ", ".join(PARAMETERS)))
+    return parameters
+
+def load_settings(path):
+    ''' Returns the (name, parameters) tuples of the settings of a config file, in file order (list first, then the grid) '''
+    with open(path, "rt", encoding="utf-8") as f:
+        config = json.load(f)
+    if isinstance(config, list):
+        config = {"settings": config}
+    settings = [_check(dict(parameters), path) for parameters in config.get("settings", [])]
+    grid = _check(config.get("grid", {}), path)
+    if grid:
+        names = sorted(grid)
+        for values in itertools.product(*(grid[name] if isinstance(grid[name], list) else [grid[name]] for name in names)):
+            settings.append(dict(zip(names, values)))
+    if not settings:
+        raise ConfigError('{}: no settings found, expected "settings" and/or "grid"'.format(path))
+    return [(setting_name(k, parameters), parameters) for k, parameters in enumerate(settings)]
+
+def setting_name(k, parameters):
+    ''' Returns the name of the output folder of a setting, e.g. "003_random_notes-1_random_rhythm-2" '''
+    return "_".join(["%03d" % k] + ["{}-{}".format(name, parameters[name]) for name in sorted(parameters)])
+
+def uses_workers(workers, num_tasks):
+    ''' Returns True if map_tasks runs the tasks in worker processes '''
+    return workers > 1 and num_tasks > 1 and 'fork' in multiprocessing.get_all_start_methods()
+
+def map_tasks(function, tasks, workers, initializer=None, initargs=(), on_result=None):
+    ''' Returns [function(task) for task in tasks]. The tasks run in worker processes when workers > 1 and the platform can fork
+        (the workers share the models of the parent without copying or pickling them, the initializer runs once in each worker),
+        else one after another. on_result(i, result) is called in the parent process as soon as the result of task i is there (e.g. progress). '''
+    tasks = list(tasks)
+    results = []
+    if uses_workers(workers, len(tasks)):
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'), initializer=initializer, initargs=initargs) as pool:
+            for result in pool.map(function, tasks):
+                results.append(result)
+                if on_result is not None:
+                    on_result(len(results) - 1, result)
+        return results
+    for task in tasks:
+        results.append(function(task))
+        if on_result is not None:
+            on_result(len(results) - 1, results[-1])
+    return results
+
+def write_manifest(path, config_path, settings, outputs):
+    ''' Write the manifest of a sweep: the parameters and the written files of each setting. outputs = {setting name: [files]} '''
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    manifest = {"config": config_path,
+                "settings": [{"name": name, "parameters": parameters, "files": outputs.get(name, [])} for name, parameters in settings]}
+    with open(path, "wt", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kernels
+
+def run_reference(inputs):
+    return kernels.run_kernels(inputs, kernels._py_follower_counts, kernels._py_pitch_followers, kernels._py_rhythm_walk, np.asarray, len(inputs["draws"]))
+
+def assert_equal(outputs, expected):
+    for a, b in zip(outputs, expected):
+        assert np.array_equal(a, b)
+
+def test_self_check():
+    assert kernels.self_check(trials=50) == 0
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_python_backend(seed):
+    rng = np.random.default_rng(seed)
+    assert kernels.check_helpers(kernels._list_row_choice, kernels._list_find, rng) == 0
+    inputs = kernels.random_inputs(rng)
+    outputs = kernels.run_kernels(inputs, kernels._py_follower_counts, kernels._py_pitch_followers, kernels._list_rhythm_walk, kernels.as_list, 6)
+    assert_equal(outputs, run_reference(inputs))
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_numba_backend(seed):
+    numba = pytest.importorskip("numba")
+    rng = np.random.default_rng(seed)
+    assert kernels.check_helpers(numba.njit(kernels._py_row_choice), numba.njit(kernels._py_find), rng) == 0
+    inputs = kernels.random_inputs(rng)
+    outputs = kernels.run_kernels(inputs, numba.njit(kernels._py_follower_counts), numba.njit(kernels._py_pitch_followers),
+                                  numba.njit(kernels._py_rhythm_walk), np.asarray, 6)
+    assert_equal(outputs, run_reference(inputs))
@@ -0,0 +1,286 @@
+''' Check that the optimized generation engine (riff_model.RiffGenerator) produces the same musical distribution as the legacy engine (Midi_Util).
+
+Both engines generate one variation of each source for each of the seeds and each of the settings,
+the legacy engine from a fresh analysis (Midi_Util keeps state between variations). Each variation
+has its own random sequence (of the engine, the source and the seed), so the outputs are compared as
+distributions, per setting over all sources and seeds, with chi-square tests of homogeneity:
+- pitch transitions: (source, pitch, next pitch) of the notes of the variations (the last note is followed by the first one)
+- rhythms: (source, rhythm) of the notes of the variations (the last rhythm wraps around the loop)
+- notes: (source, number of notes) of the variations
+- range compliance: the notes that are not locked inside or outside of --note-min / --note-max
+A setting fails if a p-value is below --alpha divided by the number of tests (Bonferroni), or if
+an engine changes a locked note of a source (lock compliance, --lock-every): both engines keep all
+locked notes, so there is no distribution to compare and the rates must be 1. The
+generation time of both engines is measured in the same run (analysis excluded), so the report
+shows the speedup next to the pass/fail result. The exit code is 1 if a test failed.
+
+Examples:
+    python validate_engines.py midi_in --seeds 2000
+    python validate_engines.py midi_in --config sweep.json --lock-every 0
+'''
+
+import os
+import math
+import time
+import random
+import argparse
+from collections import Counter
+import numpy as np
+import note_events
+import corpus_io
+import riff_model
+import sweep
+import stream
+from midi_util import Midi_Util
+from diagnostics import log
+import diagnostics
+
+# Engine parameters of the settings (sweep.py names), the legacy engine knows the random rhythm algorithms 0 - 2
+PARAMETERS = ('random_notes', 'random_rhythm', 'transpose_algorithm', 'transpose_probability', 'transpose_same', 'note_min', 'note_max')
+DEFAULTS = {'random_notes': 0, 'random_rhythm': 0, 'transpose_algorithm': 0, 'transpose_probability': 0, 'transpose_same': False,
+            'note_min': 0, 'note_max': 127}
+SETTINGS = [{'random_notes': 1},
+            {'random_notes': 0.5},
+            {'random_notes': 1.5},
+            {'random_notes': 3},
+            {'random_notes': 2.5, 'note_min': 60, 'note_max': 84},
+            {'transpose_algorithm': 1, 'transpose_probability': 0.5},
+            {'transpose_algorithm': 2, 'transpose_probability': 0.5, 'transpose_same': True},
+            {'transpose_algorithm': 3, 'transpose_probability': 0.3},
+            {'transpose_algorithm': 4, 'transpose_probability': 0.3},
+            {'random_rhythm': 1},
+            {'random_rhythm': 2},
+            {'random_notes': 1, 'transpose_algorithm': 2, 'transpose_probability': 0.3, 'random_rhythm': 2, 'note_min': 48, 'note_max': 72},
+            {'random_notes': 3, 'random_rhythm': 1, 'note_min': 60, 'note_max': 72}]
+TESTS = ('pitch transitions', 'rhythms', 'notes', 'range compliance') # chi-square tests, the lock compliance is checked directly
+MIN_EXPECTED = 5 # categories with a smaller expected count are pooled
+
+def chi_square_sf(x, df):
+    ''' Returns the p-value of a chi-square statistic: the regularized upper incomplete gamma function Q(df/2, x/2) '''
+    if df <= 0 or x <= 0:
+        return 1.0
+    a, x = df / 2.0, x / 2.0
+    scale = math.exp(-x + a * math.log(x) - math.lgamma(a))
+    if x < a + 1: # series of the lower function P
+        term = total = 1.0 / a
+        n = 0
+        while abs(term) > abs(total) * 1e-15:
+            n += 1
+            term *= x / (a + n)
+            total += term
+        return max(0.0, 1.0 - total * scale)
+    tiny = 1e-300 # continued fraction of Q (modified Lentz)
+    b = x + 1.0 - a
+    c, d = 1.0 / tiny, 1.0 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2.0
+        d = an * d + b
+        d = d if abs(d) > tiny else tiny
+        c = b + an / c
+        c = c if abs(c) > tiny else tiny
+        d = 1.0 / d
+        h *= d * c
+        if abs(d * c - 1.0) < 1e-15:
+            break
+    return h * scale
+
+def chi_square_test(a, b):
+    ''' Returns the statistic, the degrees of freedom and the p-value of the chi-square test of homogeneity of two histograms
+        ({category: count}), the categories with an expected count below MIN_EXPECTED are pooled into one '''
+    keys = sorted(set(a) | set(b), key=repr)
+    table = np.array([[a.get(key, 0) for key in keys], [b.get(key, 0) for key in keys]], dtype=np.float64)
+    if table.sum() == 0 or 0 in table.sum(axis=1):
+        return 0.0, 0, 1.0
+    expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+    rare = expected.min(axis=0) < MIN_EXPECTED
+    if rare.any():
+        table = np.column_stack([table[:, ~rare], table[:, rare].sum(axis=1)])
+        expected = np.outer(table.sum(axis=1), table.sum(axis=0)) / table.sum()
+    df = table.shape[1] - 1
+    if df == 0:
+        return 0.0, 0, 1.0
+    statistic = float(((table - expected)**2 / expected).sum())
+    return statistic, df, chi_square_sf(statistic, df)
+
+def load_sources(path, grid):
+    ''' Returns the (name, note events) of the midi files below path with at least 2 notes (the legacy rhythm needs a rhythm) '''
+    sources = []
+    for root, file in corpus_io.discover(path):
+        name = os.path.join(root, file)
+        try:
+            with open(name, 'rb') as f:
+                events = stream.to_events(f.read(), grid)
+        except Exception as error:
+            log.warning('Warning: %s skipped: %s', name, error)
+            continue
+        if len(events) < 2:
+            log.warning('Warning: %s skipped: less than 2 notes', name)
+            continue
+        sources.append((name, events))
+    return sources
+
+def lock_steps(events, lock_every):
+    ''' Returns the locked steps of a source: the step of every lock_every-th note, none for 0 '''
+    return set(events.steps[::lock_every].tolist()) if lock_every > 0 else set()
+
+def engine_seed(engine, name, seed):
+    ''' Returns the seed of a variation: independent random sequences for the engines and the sources of a seed '''
+    return '{}:{}:{}'.format(engine, name, seed)
+
+def legacy_variation(events, locked, setting, seed):
+    ''' Returns a variation of the legacy engine and its generation time (a fresh analysis, like main.py for each source) '''
+    util = Midi_Util(events.grid)
+    util.calc_pitch_followers(events)
+    util.calc_rhythm_intervals(events)
+    util.locked_steps = set(locked)
+    random.seed(seed) # the legacy engine uses the random module, Midi_Util() seeds it with the time
+    start = time.perf_counter()
+    variation = events.copy()
+    variation = util.notes_random_pitch_followers(variation, setting['random_notes'])
+    variation = util.notes_transpose(variation, setting['transpose_algorithm'], setting['transpose_probability'], setting['transpose_same'])
+    variation = util.notes_to_min_max(variation, setting['note_min'], setting['note_max'])
+    variation = util.notes_random_rhythm_intervals(variation, setting['random_rhythm'])
+    return variation, time.perf_counter() - start
+
+def model_of(events, locked):
+    builder = riff_model.RiffModelBuilder(events.grid)
+    builder.add_pitch_followers(events)
+    builder.add_rhythm_intervals(events)
+    builder.locked_steps.update(locked)
+    return builder.build()
+
+def optimized_variation(events, model, setting, seed):
+    ''' Returns a variation of the optimized engine and its generation time '''
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    generator = riff_model.RiffGenerator(model, rng)
+    variation = generator.generate(events, setting['random_notes'], setting['transpose_algorithm'], setting['transpose_probability'],
+                                   setting['transpose_same'], setting['note_min'], setting['note_max'], setting['random_rhythm'])
+    return variation, time.perf_counter() - start
+
+def count(histograms, k, source, locked, variation, setting):
+    ''' Add a variation of source k to the histograms of the tests '''
+    steps, pitches = variation.steps.tolist(), variation.pitches.tolist()
+    if len(steps) > 0:
+        histograms['pitch transitions'].update((k, p, q) for p, q in zip(pitches, pitches[1:] + pitches[:1]))
+        histograms['rhythms'].update((k, r) for r in np.diff(np.append(variation.steps, variation.steps[0] + variation.length)).tolist())
+    histograms['notes'][(k, len(steps))] += 1
+    notes = dict(zip(steps, zip(pitches, variation.velocities.tolist())))
+    for step, pitch, velocity in zip(source.steps.tolist(), source.pitches.tolist(), source.velocities.tolist()):
+        if step in locked:
+            histograms['lock compliance']['kept' if notes.get(step) == (pitch, velocity) else 'changed'] += 1
+    for step, pitch in zip(steps, pitches):
+        if step not in locked:
+            histograms['range compliance']['inside' if setting['note_min'] <= pitch <= setting['note_max'] else 'outside'] += 1
+
+def rate(histogram, key):
+    total = sum(histogram.values())
+    return histogram[key] / total if total > 0 else 1.0
+
+def validate(sources, setting, seeds, lock_every):
+    ''' Returns the histograms and the generation times of both engines for a setting '''
+    histograms = {engine: {test: Counter() for test in TESTS + ('lock compliance',)} for engine in ('legacy', 'optimized')}
+    times = {'legacy': 0.0, 'optimized': 0.0}
+    for k, (name, events) in enumerate(sources):
+        locked = lock_steps(events, lock_every)
+        model = model_of(events, locked)
+        for seed in seeds: # the engines alternate, so both are timed under the same conditions
+            for engine in ('legacy', 'optimized'):
+                if engine == 'legacy':
+                    variation, seconds = legacy_variation(events, locked, setting, engine_seed(engine, name, seed))
+                else:
+                    variation, seconds = optimized_variation(events, model, setting, engine_seed(engine, name, seed))
+                times[engine] += seconds
+                count(histograms[engine], k, events, locked, variation, setting)
+    return histograms, times
+
+
+if __name__ == "__main__":
+
+    # Argument parsing
+    parser = argparse.ArgumentParser(
+        description='Compare the output distributions of the legacy engine (Midi_Util) and the optimized engine (RiffGenerator) \
+                     with chi-square tests over many seeds and measure the speedup. The exit code is 1 if a test failed.')
+    parser.add_argument(
+        'path',
+        default='midi_in',
+        nargs='?',
+        help='corpus directory with the midi files (default midi_in)')
+    parser.add_argument(
+        '--config',
+        dest='config',
+        default=None,
+        help='sweep config file (see sweep.py) with the settings to be validated instead of the built-in settings')
+    parser.add_argument('--seeds', dest='seeds', type=int, default=2000, help='number of seeds (variations of each source) per setting (default 2000)')
+    parser.add_argument('--first-seed', dest='first_seed', type=int, default=0, help='first seed (default 0)')
+    parser.add_argument('--lock-every', dest='lock_every', type=int, default=4, help='lock the step of every n-th note of the sources, 0 = no locks (default 4)')
+    parser.add_argument('--alpha', dest='alpha', type=float, default=0.01, help='significance level of all tests of a setting (default 0.01)')
+    parser.add_argument('--quantization', dest='quantization', default=5, help='quantization grid 2^n per whole note (default 5 = 1/32)')
+    parser.add_argument('--triplets', dest='triplets', action='store_true', help='triplet grid')
+    parser.add_argument(
+        '--log-level',
+        dest='log_level',
+        choices=sorted(diagnostics.LEVELS, key=diagnostics.LEVELS.get),
+        default='info',
+        help='amount of console output: quiet, warning, info (default) or debug')
+    parser.set_defaults(triplets=False)
+    args = parser.parse_args()
+    log.set_level(args.log_level)
+
+    if args.config is not None:
+        try:
+            settings = [parameters for name, parameters in sweep.load_settings(args.config)]
+        except (OSError, ValueError) as error:
+            parser.error(str(error))
+    else:
+        settings = SETTINGS
+    grid = note_events.Grid(args.quantization, args.triplets)
+    sources = load_sources(args.path, grid)
+    if not sources:
+        parser.error('No midi files with at least 2 notes found in ' + args.path)
+    seeds = range(args.first_seed, args.first_seed + args.seeds)
+    log.info('%d sources, %d seeds, %d settings', len(sources), len(seeds), len(settings))
+
+    failed = 0
+    total_times = {'legacy': 0.0, 'optimized': 0.0}
+    for parameters in settings:
+        ignored = sorted(set(parameters) - set(PARAMETERS))
+        setting = dict(DEFAULTS, **{name: parameters[name] for name in PARAMETERS if name in parameters})
+        setting = {name: value if name == 'transpose_same' else (int(value) if name in ('note_min', 'note_max') else float(value))
+                   for name, value in setting.items()}
+        description = ", ".join("{}={}".format(name, parameters[name]) for name in PARAMETERS if name in parameters) or "defaults"
+        if setting['random_rhythm'] > 2:
+            log.warning('Warning: %s skipped: the legacy engine has no random rhythm algorithm %s', description, setting['random_rhythm'])
+            continue
+        if ignored:
+            log.warning('Warning: %s: %s not used by the engines', description, ", ".join(ignored))
+
+        level = log.level
+        log.set_level(diagnostics.QUIET) # the engines log each variation
+        histograms, times = validate(sources, setting, seeds, args.lock_every)
+        log.set_level(level)
+        for engine in total_times:
+            total_times[engine] += times[engine]
+
+        results = [(test,) + chi_square_test(histograms['legacy'][test], histograms['optimized'][test]) for test in TESTS]
+        locks_kept = all(histograms[engine]['lock compliance']['changed'] == 0 for engine in histograms)
+        passed = locks_kept and all(p >= args.alpha / len(TESTS) for test, statistic, df, p in results)
+        failed += not passed
+        variations = len(sources) * len(seeds)
+        log.info('%s %s: legacy %.1f us, optimized %.1f us per variation, speedup %.2fx', 'PASS' if passed else 'FAIL', description,
+                 1e6 * times['legacy'] / variations, 1e6 * times['optimized'] / variations, times['legacy'] / max(times['optimized'], 1e-12))
+        for test, statistic, df, p in results:
+            log.info('  %-17s chi2 = %10.2f  df = %4d  p = %.4f%s', test, statistic, df, p, '' if p >= args.alpha / len(TESTS) else '  <- differs')
+        log.info('  lock compliance  legacy %.4f, optimized %.4f (%d locked notes)%s', rate(histograms['legacy']['lock compliance'], 'kept'),
+                 rate(histograms['optimized']['lock compliance'], 'kept'), sum(histograms['optimized']['lock compliance'].values()), '' if locks_kept else '  <- locked notes changed')
+        log.info('  range compliance legacy %.4f, optimized %.4f',
+                 rate(histograms['legacy']['range compliance'], 'inside'), rate(histograms['optimized']['range compliance'], 'inside'))
+
+    if total_times['optimized'] > 0:
+        log.info('Total: legacy %.2f s, optimized %.2f s, speedup %.2fx', total_times['legacy'], total_times['optimized'],
+                 total_times['legacy'] / total_times['optimized'])
+    if failed:
+        log.error('%d settings differ between the legacy and the optimized engine', failed)
+    raise SystemExit(1 if failed else 0)